@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 批量离线推理
+流式遍历目录或 glob，在线程池中解码 + letterbox，同时主线程跑模型；
+结果逐批写出为 JSON Lines 或 Parquet，中断后再次运行会从上次停止的位置继续。
+
+内存占用与图片总数无关：文件按目录流式遍历，预取队列有上限，结果写出后即释放。
+
+用法:
+    python batch_inference.py <目录或glob> -o results.jsonl
+    python batch_inference.py "photos/**/*.jpg" -o results_parquet --format parquet --batch-size 16
+    python batch_inference.py /data/food_photos -o results_npz --format columnar   # 二进制列式输出，适合数百万个框
+"""
+
+import os
+import sys
+import glob
+import json
+import fnmatch
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from inference_backends import load_backend
+from inference_worker import DEFAULT_SESSION_FILE, build_detections, find_latest_model
+from detection_results import ColumnarWriter, detection_columns
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+PROGRESS_EVERY = 500
+
+
+# =============================================================================
+# 输入遍历（顺序确定，断点续跑依赖这一点）
+# =============================================================================
+
+def iter_images(source, recursive=True):
+    """按确定的顺序流式产出图片路径；目录和 glob 都逐层排序遍历，不会一次性列出所有文件"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            if not recursive:
+                dirs.clear()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    else:
+        for path in _iter_glob(source):
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+
+
+def _sorted_entries(directory):
+    """目录中的条目按名称排序（只排序这一层）；与 glob 一致，跳过隐藏文件"""
+    try:
+        with os.scandir(directory) as it:
+            return sorted((e for e in it if not e.name.startswith(".")), key=lambda e: e.name)
+    except OSError:
+        return []
+
+
+def _iter_glob(pattern):
+    """流式展开 glob（支持 **）：从第一个通配符之前的目录开始，逐层排序遍历，不先收集全部路径"""
+    parts = os.path.normpath(pattern).split(os.sep)
+    fixed = 0
+    while fixed < len(parts) and not glob.has_magic(parts[fixed]):
+        fixed += 1
+    if fixed == 0:
+        # 相对模式直接以通配符开头：从当前目录开始，产出的路径不带 "./" 前缀（与 glob 一致）
+        yield from _match_parts(os.curdir, parts, prefix=True)
+    else:
+        yield from _match_parts(os.sep.join(parts[:fixed]) or os.sep, parts[fixed:])
+
+
+def _match_parts(base, parts, prefix=False):
+    join = (lambda name: name) if prefix else (lambda name: os.path.join(base, name))
+    if not parts:
+        if os.path.exists(base):
+            yield base
+        return
+    part, rest = parts[0], parts[1:]
+    if part == "**":
+        # 零层：当前目录直接匹配后面的模式；再按名称顺序进入每个子目录
+        yield from _match_parts(base, rest, prefix)
+        for entry in _sorted_entries(base):
+            if entry.is_dir():
+                yield from _match_parts(join(entry.name), parts)
+            elif not rest:
+                yield join(entry.name)
+    elif glob.has_magic(part):
+        for entry in _sorted_entries(base):
+            if fnmatch.fnmatch(entry.name, part) and (rest == [] or entry.is_dir()):
+                yield from _match_parts(join(entry.name), rest)
+    else:
+        yield from _match_parts(join(part), rest)
+
+
+# =============================================================================
+# 输出（JSON Lines / Parquet / 列式 npz），都支持读取已完成的进度
+# =============================================================================
+
+class JsonlWriter:
+    """每条结果一行；续跑时截掉中断时写了一半的最后一行"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done, self.last_path = self._scan()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _scan(self):
+        if not os.path.exists(self.path):
+            return 0, None
+        done, last_path, valid_bytes = 0, None, 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):  # 没有换行符的最后一行也算写了一半，否则下一条会接在同一行
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                done += 1
+                last_path = record.get("image_path")
+                valid_bytes += len(line)
+        if valid_bytes != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
+        return done, last_path
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """每次运行写一个新的 part 文件，按行组定期落盘；续跑时统计已有 part 的行数"""
+
+    def __init__(self, directory, row_group_size=1024):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet 输出需要 pyarrow: pip install pyarrow")
+        self.pa, self.pq = pa, pq
+        self.directory = directory
+        self.row_group_size = row_group_size
+        os.makedirs(directory, exist_ok=True)
+        self.schema = pa.schema([
+            ("image_path", pa.string()),
+            ("success", pa.bool_()),
+            ("error", pa.string()),
+            ("detections", pa.list_(pa.struct([
+                ("class", pa.string()),
+                ("confidence", pa.float32()),
+                ("bbox", pa.list_(pa.float32())),
+            ]))),
+        ])
+        self.done, self.last_path = self._scan()
+        part = len(self._parts())
+        self.writer = pq.ParquetWriter(os.path.join(directory, f"part-{part:05d}.parquet"), self.schema)
+        self.buffer = []
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.directory, "part-*.parquet")))
+
+    def _scan(self):
+        done, last_path = 0, None
+        for part in self._parts():
+            try:
+                meta = self.pq.ParquetFile(part).metadata
+            except Exception:
+                # 中断时未写完 footer 的 part 文件无法读取，删除后重跑这部分
+                os.remove(part)
+                continue
+            done += meta.num_rows
+            if meta.num_rows:
+                table = self.pq.ParquetFile(part).read_row_group(meta.num_row_groups - 1, columns=["image_path"])
+                last_path = table.column("image_path")[-1].as_py()
+        return done, last_path
+
+    def write(self, records):
+        self.buffer.extend(records)
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            rows = [dict(record, error=record.get("error"), detections=record.get("detections", []))
+                    for record in self.buffer]
+            self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def existing_format(output):
+    """已有输出目录的格式（按 part 文件 / 列式的 names.json 判断），不是目录或还没有结果时返回 None"""
+    if not os.path.isdir(output):
+        return None
+    if glob.glob(os.path.join(output, "part-*.npz")) or os.path.exists(os.path.join(output, "names.json")):
+        return "columnar"
+    if glob.glob(os.path.join(output, "part-*.parquet")):
+        return "parquet"
+    return None
+
+
+def open_writer(output, fmt=None, names=None):
+    existing = existing_format(output)
+    if fmt and existing and fmt != existing:
+        raise ValueError(f"输出目录 {output} 中已有 {existing} 格式的结果，不能用 {fmt} 续跑（或使用 --no-resume）")
+    fmt = fmt or existing or ("parquet" if output.endswith(".parquet") or os.path.isdir(output) else "jsonl")
+    if fmt == "columnar":
+        return ColumnarWriter(output, names)
+    return ParquetWriter(output) if fmt == "parquet" else JsonlWriter(output)
+
+
+def skip_done(paths, done, last_path):
+    """跳过已完成的前 done 张图片；校验最后一条记录对应的路径，顺序不一致时拒绝续跑"""
+    if not done:
+        return paths
+    skipped = None
+    for _ in range(done):
+        skipped = next(paths, None)
+        if skipped is None:
+            break
+    if last_path is not None and skipped != last_path:
+        raise RuntimeError(f"输入顺序与已有结果不一致（期望 {last_path}，实际 {skipped}），请使用 --no-resume 重新开始")
+    print(f"⏩ 续跑: 跳过已完成的 {done} 张图片")
+    return paths
+
+
+# =============================================================================
+# 流水线
+# =============================================================================
+
+def _prepare(backend, path):
+    """返回 (路径, 预处理结果, 错误, 解码耗时秒)"""
+    started = time.perf_counter()
+    try:
+        return path, backend.prepare(path), None, time.perf_counter() - started
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}", time.perf_counter() - started
+
+
+def iter_batches(paths, backend, batch_size, prefetch, workers):
+    """线程池解码，预取队列最多 prefetch 个任务；按输入顺序产出批次"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        batch = []
+        for path in paths:
+            pending.append(pool.submit(_prepare, backend, path))
+            while len(pending) >= prefetch:
+                batch.append(pending.popleft().result())
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        while pending:
+            batch.append(pending.popleft().result())
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def run_batch_inference(source, output, model_path=None, fmt=None, batch_size=8, prefetch=32, workers=4,
+                        conf=0.25, backend="auto", resume=True, recursive=True):
+    """批量推理主流程，返回处理统计"""
+    model_path = model_path or find_latest_model(DEFAULT_SESSION_FILE)
+    if not model_path:
+        raise FileNotFoundError("未找到训练好的模型，请先完成模型训练或使用 --model 指定")
+    model = load_backend(model_path, backend)
+    print(f"🤖 模型: {model.model_path} [{model.name}]")
+
+    if not resume and os.path.exists(output):
+        if os.path.isdir(output):
+            for part in glob.glob(os.path.join(output, "part-*.parquet")) + glob.glob(os.path.join(output, "part-*.npz")):
+                os.remove(part)
+            if os.path.exists(os.path.join(output, "names.json")):
+                os.remove(os.path.join(output, "names.json"))
+        else:
+            os.remove(output)
+    writer = open_writer(output, fmt, model.names)
+    columnar = getattr(writer, "columnar", False)
+    paths = skip_done(iter_images(source, recursive), writer.done, writer.last_path)
+
+    processed, failed, decode_s = 0, 0, 0.0
+    started = time.perf_counter()
+    try:
+        for batch in iter_batches(paths, model, batch_size, max(prefetch, batch_size), workers):
+            ready = [(path, prepared) for path, prepared, error, _ in batch if error is None]
+            decode_s += sum(item[3] for item in batch)
+            predictions = {}
+            if ready:
+                for (path, _), pred in zip(ready, model.predict_prepared([p for _, p in ready], conf=conf)):
+                    predictions[path] = pred
+
+            records = []
+            for path, _, error, _ in batch:
+                if error is None and columnar:
+                    records.append({"image_path": path, "success": True,
+                                    "columns": detection_columns(predictions[path], model.names)})
+                elif error is None:
+                    records.append({"image_path": path, "success": True,
+                                    "detections": build_detections(predictions[path], model.names)})
+                else:
+                    failed += 1
+                    records.append({"image_path": path, "success": False, "error": error})
+            writer.write(records)
+
+            previous = processed
+            processed += len(batch)
+            if processed // PROGRESS_EVERY != previous // PROGRESS_EVERY:
+                rate = processed / (time.perf_counter() - started)
+                print(f"📊 已处理 {processed} 张 ({rate:.1f} 张/秒, 失败 {failed})")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "processed": processed,
+        "failed": failed,
+        "skipped": writer.done,
+        "elapsed_s": elapsed,
+        "images_per_s": processed / elapsed if elapsed > 0 else 0.0,
+        # 解码线程的累计耗时（与推理重叠），偏高时增加 --workers
+        "decode_ms_per_image": decode_s * 1000 / processed if processed else 0.0,
+    }
+    print(f"✅ 批量推理完成: {json.dumps(stats, ensure_ascii=False)}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 批量离线推理")
+    parser.add_argument("source", help="图片目录或 glob（如 'photos/**/*.jpg'）")
+    parser.add_argument("-o", "--output", required=True, help="输出文件 (.jsonl) 或 Parquet 目录")
+    parser.add_argument("--format", choices=["jsonl", "parquet", "columnar"], default=None,
+                        help="输出格式（默认按已有结果或输出路径推断；columnar 为 npz 列式目录）")
+    parser.add_argument("--model", default=None, help="模型路径（默认最新完成的训练会话）")
+    parser.add_argument("--backend", default="auto", choices=["auto", "openvino", "onnxruntime", "ultralytics"])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--prefetch", type=int, default=32, help="预取队列长度（决定内存上限）")
+    parser.add_argument("--workers", type=int, default=4, help="解码线程数")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有结果，从头开始")
+    parser.add_argument("--no-recursive", action="store_true", help="只处理目录第一层")
+    args = parser.parse_args()
+
+    try:
+        run_batch_inference(args.source, args.output, model_path=args.model, fmt=args.format,
+                            batch_size=args.batch_size, prefetch=args.prefetch, workers=args.workers,
+                            conf=args.conf, backend=args.backend, resume=not args.no_resume,
+                            recursive=not args.no_recursive)
+    except KeyboardInterrupt:
+        print("\n⏸️ 已中断，再次运行相同命令即可继续")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
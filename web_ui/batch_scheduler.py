@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 动态微批处理调度器
+把并发到达的推理请求排队，合并成一次批量前向推理，再把结果分发回各自的调用方
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+def percentile(values, q):
+    """计算百分位数（最近邻插值，避免依赖 numpy）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class BatchStats:
+    """延迟与吞吐统计：保留最近一段窗口的请求用于计算 p50/p99"""
+
+    def __init__(self, window=2048):
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.completions = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_errors = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record_batch(self, size):
+        with self._lock:
+            self.total_batches += 1
+            self.batch_sizes.append(size)
+
+    def record_request(self, latency, queue_wait, ok=True):
+        with self._lock:
+            self.total_requests += 1
+            if not ok:
+                self.total_errors += 1
+            self.latencies.append(latency)
+            self.queue_waits.append(queue_wait)
+            self.completions.append(time.monotonic())
+
+    def snapshot(self):
+        """返回当前统计（毫秒）"""
+        with self._lock:
+            latencies = list(self.latencies)
+            waits = list(self.queue_waits)
+            completions = list(self.completions)
+            sizes = list(self.batch_sizes)
+            throughput = 0.0
+            if len(completions) > 1 and completions[-1] > completions[0]:
+                throughput = (len(completions) - 1) / (completions[-1] - completions[0])
+            return {
+                "total_requests": self.total_requests,
+                "total_batches": self.total_batches,
+                "total_errors": self.total_errors,
+                "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+                "latency_p50_ms": percentile(latencies, 50) * 1000,
+                "latency_p99_ms": percentile(latencies, 99) * 1000,
+                "queue_wait_p50_ms": percentile(waits, 50) * 1000,
+                "queue_wait_p99_ms": percentile(waits, 99) * 1000,
+                "throughput_rps": throughput,
+                "uptime_s": time.time() - self.started_at,
+            }
+
+
+class _Pending:
+    __slots__ = ("item", "future", "enqueued_at")
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    动态微批处理：
+    - 第一个请求到达后最多等待 max_wait_ms，期间到达的请求合并进同一批
+    - 凑满 max_batch_size 立即执行
+    - run_batch(items) 必须返回与 items 一一对应的结果列表；
+      单个结果为 Exception 实例时只让对应的调用方失败
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0, stats_window=2048):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 必须 >= 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchStats(window=stats_window)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """停止调度线程；队列中剩余的请求会先处理完"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, item):
+        """提交一个请求，返回 Future"""
+        pending = _Pending(item)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("MicroBatcher 尚未启动")
+            self._queue.append(pending)
+            self._cond.notify()
+        return pending.future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                if not self._running:
+                    return None
+                self._cond.wait()
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch_size and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(self.max_batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.monotonic()
+        self.stats.record_batch(len(batch))
+        try:
+            results = self.run_batch([p.item for p in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"批处理结果数量不匹配: {len(results)} != {len(batch)}")
+        except Exception as e:
+            results = [e] * len(batch)
+
+        finished = time.monotonic()
+        for pending, result in zip(batch, results):
+            ok = not isinstance(result, Exception)
+            self.stats.record_request(finished - pending.enqueued_at, started - pending.enqueued_at, ok)
+            if ok:
+                pending.future.set_result(result)
+            else:
+                pending.future.set_exception(result)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - CPU 推理基准测试
+按 模型 (yolov8n/s/m 或会话的 best.pt) × 格式 (pt/torchscript/onnx/int8) × imgsz × batch 扫描，
+每个组合在独立的子进程中运行（峰值内存互不影响），先预热再重复计时，记录 p50/p95/p99、吞吐和峰值内存。
+结果写入 benchmarks/benchmark_<时间>.json（并更新 benchmarks/latest.json），
+指定 --session 时把结果文件和该会话模型的测量值记录到训练会话，仪表盘据此显示推理时间。
+
+用法:
+    python benchmark.py --models yolov8n,yolov8s,yolov8m --formats pt,onnx,int8 --imgsz 320,640 --batch 1,4
+    python benchmark.py --session <ID> --formats pt,onnx,int8
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import multiprocessing as mp
+
+from batch_scheduler import percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, "benchmarks")
+FORMATS = ["pt", "torchscript", "onnx", "int8"]
+DEFAULT_WARMUP = 5
+DEFAULT_RUNS = 30
+
+
+def peak_rss_mb():
+    """本进程的峰值常驻内存"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位是 KB，macOS 是字节
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+def host_info():
+    info = {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+    for module in ("torch", "ultralytics", "onnxruntime"):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return info
+
+
+def benchmark_images(imgsz, count, image_dir=None):
+    """固定的测试图片：指定目录时取前 count 张，否则用固定种子生成"""
+    import numpy as np
+
+    if image_dir:
+        from batch_inference import iter_images
+        paths = list(iter_images(image_dir))[:count]
+        if paths:
+            return paths
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8) for _ in range(count)]
+
+
+# =============================================================================
+# 准备各格式的模型文件
+# =============================================================================
+
+def prepare_artifact(model, fmt, imgsz, batch, work_dir):
+    """
+    返回该组合要加载的模型路径；导出结果按 (模型, imgsz) 缓存在 work_dir 中。
+    ONNX / INT8 使用动态 batch，TorchScript 是固定形状，按 batch 分别导出。
+    """
+    if fmt == "pt":
+        return model
+    from ultralytics import YOLO
+
+    stem = os.path.splitext(os.path.basename(model))[0]
+    target_dir = os.path.join(work_dir, f"{stem}_{imgsz}")
+    os.makedirs(target_dir, exist_ok=True)
+    weights = os.path.join(target_dir, f"{stem}.pt")
+    if not os.path.exists(weights):
+        # 预训练模型名（yolov8n.pt）由 ultralytics 自动下载
+        source = model if os.path.exists(model) else YOLO(model).ckpt_path
+        shutil.copy2(source, weights)
+
+    if fmt == "torchscript":
+        path = os.path.join(target_dir, f"{stem}_b{batch}.torchscript")
+        if not os.path.exists(path):
+            exported = YOLO(weights).export(format="torchscript", imgsz=imgsz, batch=batch)
+            os.replace(exported, path)
+        return path
+
+    onnx_path = os.path.join(target_dir, f"{stem}.onnx")
+    if not os.path.exists(onnx_path):
+        YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True)
+    if fmt == "onnx":
+        return onnx_path
+
+    int8_path = os.path.join(target_dir, f"{stem}_int8.onnx")
+    if not os.path.exists(int8_path):
+        from quantization import calibration_from_npy, quantize_onnx
+        quantize_onnx(onnx_path, calibration_from_npy(imgsz=imgsz), int8_path)
+    return int8_path
+
+
+# =============================================================================
+# 计时（子进程）
+# =============================================================================
+
+def _measure(config):
+    """在独立子进程中加载模型并计时，返回结果字典"""
+    from ultralytics import YOLO
+
+    images = benchmark_images(config["imgsz"], config["batch"], config.get("image_dir"))
+    baseline_mb = peak_rss_mb()
+    started = time.perf_counter()
+    model = YOLO(config["artifact"], task="detect")
+    predict_kwargs = {"imgsz": config["imgsz"], "device": "cpu", "verbose": False}
+    model.predict(images, **predict_kwargs)
+    load_s = time.perf_counter() - started
+
+    for _ in range(config["warmup"]):
+        model.predict(images, **predict_kwargs)
+    timings = []
+    total_started = time.perf_counter()
+    for _ in range(config["runs"]):
+        started = time.perf_counter()
+        model.predict(images, **predict_kwargs)
+        timings.append((time.perf_counter() - started) * 1000)
+    total = time.perf_counter() - total_started
+
+    return {
+        "load_s": load_s,
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "mean_ms": sum(timings) / len(timings),
+        "per_image_p50_ms": percentile(timings, 50) / config["batch"],
+        "throughput_ips": config["batch"] * config["runs"] / total if total > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline_mb,
+    }
+
+
+def measure_isolated(config):
+    """每个组合一个新进程，峰值内存只反映该组合"""
+    with mp.get_context("spawn").Pool(processes=1, maxtasksperchild=1) as pool:
+        return pool.apply(_measure, (config,))
+
+
+# =============================================================================
+# 扫描
+# =============================================================================
+
+def run_benchmark(models, formats=("pt", "onnx"), imgsz_list=(640,), batch_list=(1,), warmup=DEFAULT_WARMUP,
+                  runs=DEFAULT_RUNS, image_dir=None, output_dir=DEFAULT_OUTPUT_DIR):
+    """执行扫描，返回 (报告, 结果文件路径)"""
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = os.path.join(output_dir, "artifacts")
+    results = []
+    for model in models:
+        for fmt in formats:
+            for imgsz in imgsz_list:
+                for batch in batch_list:
+                    entry = {"model": model, "format": fmt, "imgsz": imgsz, "batch": batch}
+                    try:
+                        artifact = prepare_artifact(model, fmt, imgsz, batch, work_dir)
+                        entry["artifact"] = artifact
+                        entry["size_mb"] = os.path.getsize(artifact) / (1024 * 1024)
+                        entry.update(measure_isolated({**entry, "warmup": warmup, "runs": runs, "image_dir": image_dir}))
+                        print(f"⏱️ {os.path.basename(model)} {fmt} imgsz={imgsz} batch={batch}: "
+                              f"p50 {entry['p50_ms']:.1f} ms, p99 {entry['p99_ms']:.1f} ms, "
+                              f"{entry['throughput_ips']:.1f} 张/秒, 峰值内存 {entry['peak_rss_mb']:.0f} MB")
+                    except Exception as e:
+                        entry["error"] = f"{type(e).__name__}: {e}"
+                        print(f"❌ {os.path.basename(model)} {fmt} imgsz={imgsz} batch={batch}: {entry['error']}")
+                    results.append(entry)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": host_info(),
+        "settings": {"warmup": warmup, "runs": runs, "image_dir": image_dir},
+        "results": results,
+    }
+    path = os.path.join(output_dir, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    shutil.copyfile(path, os.path.join(output_dir, "latest.json"))
+    print(f"📄 基准测试结果: {path}")
+    return report, path
+
+
+def session_summary(report, model_path):
+    """某个模型在各格式下 batch=1 的单张延迟，写入训练会话"""
+    summary = {}
+    for entry in report["results"]:
+        if entry["model"] == model_path and entry["batch"] == 1 and "error" not in entry:
+            key = f"{entry['format']}@{entry['imgsz']}"
+            summary[key] = {"p50_ms": entry["p50_ms"], "p99_ms": entry["p99_ms"],
+                            "throughput_ips": entry["throughput_ips"], "peak_rss_mb": entry["peak_rss_mb"]}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY CPU 推理基准测试")
+    parser.add_argument("--models", default=None, help="逗号分隔的模型名或权重路径（默认 yolov8n,yolov8s,yolov8m）")
+    parser.add_argument("--session", help="把该训练会话的 best.pt 加入测试，并把结果记录到会话")
+    parser.add_argument("--formats", default="pt,onnx,int8", help=f"逗号分隔，可选 {','.join(FORMATS)}")
+    parser.add_argument("--imgsz", default="640", help="逗号分隔的输入尺寸")
+    parser.add_argument("--batch", default="1", help="逗号分隔的 batch 大小")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--images", default=None, help="测试图片目录（默认固定种子生成的图片）")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR)
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"不支持的格式: {', '.join(sorted(unknown))}")
+
+    session = None
+    if args.session:
+        from local_training import SESSION_FILE
+        from inference_worker import resolve_model_path
+        from session_store import SessionStore
+        session = SessionStore(SESSION_FILE).get(args.session)
+        if not session or not session.get("best_model_path"):
+            print(f"❌ 找不到训练会话或模型: {args.session}")
+            sys.exit(1)
+        session_model = resolve_model_path(session["best_model_path"])
+
+    if args.models:
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+    else:
+        models = [] if session else ["yolov8n", "yolov8s", "yolov8m"]
+    models = [m if os.path.exists(m) or m.endswith(".pt") else f"{m}.pt" for m in models]
+    if session:
+        models.insert(0, session_model)
+
+    report, path = run_benchmark(models, formats, [int(v) for v in args.imgsz.split(",")],
+                                 [int(v) for v in args.batch.split(",")], args.warmup, args.runs,
+                                 args.images, args.output_dir)
+
+    if session:
+        from local_training import SESSION_FILE, update_training_session
+        update_training_session(session["id"], {"benchmark": {
+            "file": os.path.relpath(path, os.path.join(BASE_DIR, "..")),
+            "created_at": report["created_at"],
+            "results": session_summary(report, session_model),
+        }}, SESSION_FILE)
+
+
+if __name__ == "__main__":
+    main()
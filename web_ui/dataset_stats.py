@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 数据集统计
+一次流式读取某个划分（train / valid / test）的全部 YOLO 标签文件，得到 NumPy 数组形式的统计:
+  - class_instances        每个类别的目标数                        (nc,)
+  - images_per_class       包含该类别的图片数                      (nc,)
+  - image_class_counts     每张图片中各类别的目标数                (N, nc)，供类别均衡采样使用
+  - width_hist / height_hist / size_hist
+                           每个类别的归一化宽、高、sqrt(面积) 直方图 (nc, BINS)
+  - missing / empty / corrupt  缺少标签、空标签（背景图）和损坏标签的文件及原因
+
+结果按数据集指纹（dataset_store 的 manifest 哈希，没有 manifest 时用文件名/大小/mtime）缓存为 .npz，
+数据集不变时直接读取缓存。标签文件用线程池读取，每个文件的解析在 NumPy 中一次完成，10 万级文件只需数秒。
+
+用法:
+    python dataset_stats.py <数据集目录> [--split train] [--no-cache]
+"""
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_cache import dataset_fingerprint, list_images
+from detection_metrics import label_path_for
+from sharded_inference import resolve_split_images
+
+BINS = 20
+CACHE_DIR_NAME = ".nutriscan_stats"
+CHUNK_SIZE = 512
+
+
+def parse_label_file(path):
+    """解析单个标签文件，返回 (类别数组, xywh 数组, 错误原因或 None)；取值范围在 compute_stats 中统一检查"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return None, None, f"无法读取: {e}"
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return np.zeros(0, np.int64), np.zeros((0, 4), np.float32), None
+
+    if all(len(line) == 5 for line in lines):
+        try:
+            values = np.array(lines, dtype=np.float32)
+        except ValueError:
+            return None, None, "包含非数字内容"
+        cls, xywh = values[:, 0], values[:, 1:]
+    else:
+        # 多边形标注（类别 + 成对坐标）转换为外接框，与 ultralytics 的处理一致
+        cls_list, boxes = [], []
+        for line in lines:
+            if len(line) < 7 or len(line) % 2 == 0:
+                return None, None, f"列数错误: {len(line)}"
+            try:
+                coords = np.array(line[1:], dtype=np.float32).reshape(-1, 2)
+                cls_list.append(float(line[0]))
+            except ValueError:
+                return None, None, "包含非数字内容"
+            (x0, y0), (x1, y1) = coords.min(0), coords.max(0)
+            boxes.append([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+        cls, xywh = np.array(cls_list, np.float32), np.array(boxes, np.float32)
+    return cls, xywh, None
+
+
+def invalid_rows(cls, xywh, nc):
+    """逐行检查类别和坐标，返回 (错误行掩码, 每行的错误原因)"""
+    reasons = np.full(len(cls), "", dtype=object)
+    checks = (
+        (xywh[:, 2:].min(axis=1) <= 0 if len(xywh) else np.zeros(0, bool), "宽或高为 0"),
+        ((xywh < 0).any(axis=1) | (xywh > 1.0001).any(axis=1), "坐标未归一化或超出图片"),
+        ((cls != np.floor(cls)) | (cls < 0) | (cls >= nc), f"类别编号超出范围 0~{nc - 1}"),
+    )
+    # 后面的检查优先级更高，覆盖前面的原因
+    for mask, reason in checks:
+        reasons[mask] = reason
+    return reasons != "", reasons
+
+
+class DatasetStats:
+    """统计结果：NumPy 数组 + 报告，可保存为 / 读取自 .npz"""
+
+    ARRAYS = ("class_instances", "images_per_class", "image_class_counts", "width_hist", "height_hist", "size_hist")
+
+    def __init__(self, names, image_files, arrays, missing, empty, corrupt):
+        self.names = names
+        self.image_files = image_files
+        self.missing = missing
+        self.empty = empty
+        self.corrupt = corrupt  # [(文件, 原因)]
+        for key in self.ARRAYS:
+            setattr(self, key, arrays[key])
+
+    @property
+    def nc(self):
+        return len(self.names)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, names=np.array(self.names), image_files=np.array(self.image_files),
+                 missing=np.array(self.missing, dtype=str), empty=np.array(self.empty, dtype=str),
+                 corrupt=np.array(self.corrupt, dtype=str).reshape(-1, 2),
+                 **{key: getattr(self, key) for key in self.ARRAYS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["names"].tolist(), data["image_files"].tolist(),
+                       {key: data[key] for key in cls.ARRAYS}, data["missing"].tolist(), data["empty"].tolist(),
+                       [tuple(row) for row in data["corrupt"].tolist()])
+
+    def image_weights(self, power=0.5, class_factors=None):
+        """
+        类别均衡采样权重：每张图片取其中最稀有类别的 (1 / 频率)^power，背景图取最小权重。
+        class_factors 可对个别类别再加权（例如混淆严重的类别），返回归一化到均值 1 的 (N,) 数组。
+        """
+        freq = self.class_instances / max(1, self.class_instances.sum())
+        class_weight = np.where(freq > 0, 1.0 / np.maximum(freq, 1e-12), 0.0) ** power
+        if class_factors is not None:
+            class_weight = class_weight * np.asarray(class_factors, dtype=np.float64)
+        present = self.image_class_counts > 0
+        weights = np.where(present, class_weight[None, :], 0.0).max(axis=1)
+        positive = weights[weights > 0]
+        weights[weights == 0] = positive.min() if len(positive) else 1.0
+        return weights / weights.mean()
+
+    def summary(self):
+        total = int(self.class_instances.sum())
+        return {
+            "images": len(self.image_files),
+            "instances": total,
+            "missing_labels": len(self.missing),
+            "empty_labels": len(self.empty),
+            "corrupt_labels": len(self.corrupt),
+            "classes": {
+                name: {"instances": int(self.class_instances[i]), "images": int(self.images_per_class[i]),
+                       "share": float(self.class_instances[i] / total) if total else 0.0}
+                for i, name in enumerate(self.names)
+            },
+        }
+
+    def under_represented(self, ratio=0.5):
+        """目标数低于各类平均值 ratio 倍的类别"""
+        mean = self.class_instances.mean() if self.nc else 0
+        return [self.names[i] for i in np.flatnonzero(self.class_instances < mean * ratio)]
+
+
+def _read_chunk(label_files):
+    return [parse_label_file(path) if path is not None else None for path in label_files]
+
+
+def compute_stats(image_files, names, workers=8):
+    """流式统计一组图片对应的标签"""
+    nc = len(names)
+    label_files = [label_path_for(path) for path in image_files]
+    existing = [path if os.path.exists(path) else None for path in label_files]
+
+    missing, empty, corrupt = [], [], []
+    all_cls, all_xywh, labelled, counts = [], [], [], []
+
+    chunks = [existing[i:i + CHUNK_SIZE] for i in range(0, len(existing), CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        index = 0
+        for parsed_chunk in pool.map(_read_chunk, chunks):
+            for parsed in parsed_chunk:
+                if parsed is None:
+                    missing.append(image_files[index])
+                else:
+                    cls, xywh, error = parsed
+                    if error:
+                        corrupt.append((label_files[index], error))
+                    elif not len(cls):
+                        empty.append(image_files[index])
+                    else:
+                        all_cls.append(cls)
+                        all_xywh.append(xywh)
+                        labelled.append(index)
+                        counts.append(len(cls))
+                index += 1
+
+    # 所有目标拼接后一次性检查和计数，避免逐图调用 NumPy
+    cls = np.concatenate(all_cls) if all_cls else np.zeros(0, np.float32)
+    xywh = np.concatenate(all_xywh) if all_xywh else np.zeros((0, 4), np.float32)
+    image_index = np.repeat(np.asarray(labelled, np.int64), counts)
+
+    bad, reasons = invalid_rows(cls, xywh, nc)
+    if bad.any():
+        bad_images, first = np.unique(image_index[bad], return_index=True)
+        bad_reasons = reasons[bad][first]
+        corrupt.extend((label_files[i], reason) for i, reason in zip(bad_images.tolist(), bad_reasons))
+        keep = ~np.isin(image_index, bad_images)
+        cls, xywh, image_index = cls[keep], xywh[keep], image_index[keep]
+    cls = cls.astype(np.int64)
+
+    image_class_counts = np.zeros((len(image_files), nc), np.int32)
+    np.add.at(image_class_counts, (image_index, cls), 1)
+    class_instances = np.bincount(cls, minlength=nc).astype(np.int64)
+    edges = np.linspace(0, 1, BINS + 1)
+    hists = []
+    w, h = xywh[:, 2], xywh[:, 3]
+    for values in (w, h, np.sqrt(w * h)):
+        hist = np.zeros((nc, BINS), np.int64)
+        bins = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, BINS - 1)
+        np.add.at(hist, (cls, bins), 1)
+        hists.append(hist)
+    width_hist, height_hist, size_hist = hists
+    arrays = {
+        "class_instances": class_instances,
+        "images_per_class": (image_class_counts > 0).sum(axis=0).astype(np.int64),
+        "image_class_counts": image_class_counts,
+        "width_hist": width_hist,
+        "height_hist": height_hist,
+        "size_hist": size_hist,
+    }
+    return DatasetStats(list(names), list(image_files), arrays, missing, empty, corrupt)
+
+
+def load_split_stats(dataset_path, split="train", use_cache=True, workers=8):
+    """某个划分的统计，按数据集指纹缓存"""
+    image_dir, names = resolve_split_images(dataset_path, split)
+    names = [names[i] for i in sorted(names)]
+    image_files = list_images(image_dir)
+    label_dir = os.path.dirname(label_path_for(os.path.join(image_dir, "x.jpg")))
+    label_files = [os.path.join(label_dir, f) for f in os.listdir(label_dir)] if os.path.isdir(label_dir) else []
+    key = dataset_fingerprint(image_dir, image_files + label_files)[:16]
+    cache_path = os.path.join(dataset_path, CACHE_DIR_NAME, f"{split}_{key}.npz")
+
+    if use_cache and os.path.exists(cache_path):
+        return DatasetStats.load(cache_path)
+    stats = compute_stats(image_files, names, workers)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    for name in os.listdir(os.path.dirname(cache_path)):
+        if name.startswith(f"{split}_") and name.endswith(".npz"):
+            os.remove(os.path.join(os.path.dirname(cache_path), name))
+    stats.save(cache_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 数据集统计")
+    parser.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    parser.add_argument("--split", default="train", choices=["train", "val", "test"])
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args()
+
+    import time
+    started = time.perf_counter()
+    stats = load_split_stats(args.dataset, args.split, not args.no_cache, args.workers)
+    elapsed = time.perf_counter() - started
+    summary = stats.summary()
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+
+    print(f"📊 {args.split}: {summary['images']} 张图片, {summary['instances']} 个目标 ({elapsed:.2f}s)")
+    for name, info in sorted(summary["classes"].items(), key=lambda item: -item[1]["instances"]):
+        print(f"  {name:<24} {info['instances']:>7} 个目标  {info['images']:>6} 张图片  {info['share'] * 100:5.1f}%")
+    print(f"  缺少标签 {summary['missing_labels']}，空标签 {summary['empty_labels']}，损坏 {summary['corrupt_labels']}")
+    for path, reason in stats.corrupt[:20]:
+        print(f"  ❌ {path}: {reason}")
+    rare = stats.under_represented()
+    if rare:
+        print(f"⚠️ 样本偏少的类别（低于平均值一半）: {', '.join(rare)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
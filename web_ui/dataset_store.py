@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 本地数据集仓库（增量 Roboflow 同步）
+数据集按 workspace/project/version 存放在 datasets/ 下，每个版本带一份 manifest.json（逐文件 size / CRC32 / SHA-256）。
+
+- 已同步过的版本再次运行直接返回本地路径，不访问网络（Roboflow 的版本是不可变的）
+- 新版本先从本地最近的旧版本硬链接一份，再只下载 CRC/大小有变化的图片和标签：
+  服务器支持 HTTP Range 时只读取 zip 的中央目录和变化的文件，否则下载整个 zip 后只写入变化的文件
+- offline=True 时只使用本地已有的数据集
+- 导出 zip 的地址可以换成本地替身服务（ROBOFLOW_API_URL 或直接传 zip_url），便于测试
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import hashlib
+import argparse
+import tempfile
+import urllib.error
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STORE_DIR = os.path.join(BASE_DIR, "datasets")
+ROBOFLOW_API_URL = os.environ.get("ROBOFLOW_API_URL", "https://api.roboflow.com")
+MANIFEST_NAME = "manifest.json"
+RANGE_BLOCK_SIZE = 1024 * 1024
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class HttpRangeFile(io.RawIOBase):
+    """只读、可 seek 的远程文件：按需用 HTTP Range 读取，带一个块大小的读缓存"""
+
+    def __init__(self, url, block_size=RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.pos = 0
+        self.bytes_fetched = 0
+        self._buffer_start = 0
+        self._buffer = b""
+        self.size = self._probe_size()
+
+    def _request(self, start, end):
+        request = urllib.request.Request(self.url, headers={"Range": f"bytes={start}-{end}"})
+        return urllib.request.urlopen(request, timeout=60)
+
+    def _probe_size(self):
+        with self._request(0, 0) as response:
+            content_range = response.headers.get("Content-Range", "")
+            if response.status != 206 or "/" not in content_range:
+                raise RangeNotSupported(self.url)
+            return int(content_range.rsplit("/", 1)[1])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.pos
+        size = min(size, self.size - self.pos)
+        if size <= 0:
+            return b""
+        offset = self.pos - self._buffer_start
+        if not (0 <= offset and offset + size <= len(self._buffer)):
+            end = min(self.size, self.pos + max(size, self.block_size)) - 1
+            with self._request(self.pos, end) as response:
+                self._buffer = response.read()
+            self._buffer_start = self.pos
+            self.bytes_fetched += len(self._buffer)
+            offset = 0
+        data = self._buffer[offset:offset + size]
+        self.pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def manifest_hash(dataset_path):
+    """数据集内容的指纹（基于 manifest 的逐文件哈希），供各类缓存作为失效依据"""
+    manifest = load_manifest(dataset_path)
+    if manifest is None:
+        return None
+    files = manifest.get("files", {})
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}\0{files[name]['sha256']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_manifest(dataset_path):
+    path = os.path.join(dataset_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class DatasetStore:
+    """按 workspace/project/version 管理本地数据集"""
+
+    def __init__(self, root=DEFAULT_STORE_DIR, api_url=ROBOFLOW_API_URL):
+        self.root = root
+        self.api_url = api_url.rstrip("/")
+
+    def location(self, workspace, project, version):
+        return os.path.join(self.root, workspace, project, f"v{version}")
+
+    def is_synced(self, workspace, project, version, fmt="yolov8"):
+        manifest = load_manifest(self.location(workspace, project, version))
+        return bool(manifest and manifest.get("complete") and manifest.get("format") == fmt)
+
+    def export_link(self, workspace, project, version, api_key, fmt="yolov8"):
+        """通过 Roboflow REST API 获取导出 zip 的下载地址"""
+        url = f"{self.api_url}/{workspace}/{project}/{version}/{fmt}?api_key={api_key}"
+        with urllib.request.urlopen(url, timeout=60) as response:
+            payload = json.loads(response.read().decode("utf-8"))
+        link = (payload.get("export") or {}).get("link")
+        if not link:
+            raise RuntimeError(f"Roboflow 尚未生成 {fmt} 格式的导出，请先在 Roboflow 中生成: {payload}")
+        return link
+
+    # ------------------------------------------------------------------ 同步
+
+    def _seed_from_previous(self, workspace, project, version, target):
+        """从本地最近的旧版本硬链接文件，新版本只需下载差异部分"""
+        project_dir = os.path.join(self.root, workspace, project)
+        previous = []
+        for name in os.listdir(project_dir) if os.path.isdir(project_dir) else []:
+            if name.startswith("v") and name[1:].isdigit() and int(name[1:]) < int(version):
+                if load_manifest(os.path.join(project_dir, name)):
+                    previous.append(int(name[1:]))
+        if not previous:
+            return {}
+        source = os.path.join(project_dir, f"v{max(previous)}")
+        manifest = load_manifest(source)
+        for name in manifest.get("files", {}):
+            src, dst = os.path.join(source, name), os.path.join(target, name)
+            if not os.path.exists(src) or os.path.exists(dst):
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        print(f"🔗 从本地 v{max(previous)} 复用 {len(manifest.get('files', {}))} 个文件")
+        return manifest.get("files", {})
+
+    def sync(self, workspace, project, version, api_key=None, fmt="yolov8", zip_url=None, offline=False, force=False):
+        """同步一个版本，返回 (本地路径, 统计)"""
+        target = self.location(workspace, project, version)
+        if not force and self.is_synced(workspace, project, version, fmt):
+            print(f"✅ 数据集已是最新 (本地缓存): {target}")
+            return target, {"downloaded": 0, "unchanged": len(load_manifest(target)["files"]), "removed": 0, "bytes_fetched": 0}
+        if offline:
+            raise FileNotFoundError(f"离线模式下本地没有该数据集版本: {workspace}/{project}/v{version}")
+
+        os.makedirs(target, exist_ok=True)
+        manifest = load_manifest(target) or {}
+        known = manifest.get("files") or self._seed_from_previous(workspace, project, version, target)
+        zip_url = zip_url or self.export_link(workspace, project, version, api_key, fmt)
+
+        temp_zip = None
+        try:
+            if os.path.exists(zip_url):
+                remote = open(zip_url, 'rb')  # 本地 zip（测试 / 手动下载）
+            else:
+                try:
+                    remote = HttpRangeFile(zip_url)
+                    print(f"📡 使用 HTTP Range 增量同步 ({remote.size / 1e6:.1f} MB)")
+                except (RangeNotSupported, urllib.error.HTTPError):
+                    print("📥 服务器不支持 Range，下载完整 zip...")
+                    temp_zip = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+                    with urllib.request.urlopen(zip_url, timeout=300) as response:
+                        shutil.copyfileobj(response, temp_zip)
+                    temp_zip.close()
+                    remote = open(temp_zip.name, 'rb')
+            with remote:
+                stats = self._apply_zip(remote, target, known)
+            stats["bytes_fetched"] = getattr(remote, "bytes_fetched", 0)
+            if temp_zip is not None:
+                stats["bytes_fetched"] = os.path.getsize(temp_zip.name)
+        finally:
+            if temp_zip is not None and os.path.exists(temp_zip.name):
+                os.remove(temp_zip.name)
+
+        _write_json_atomic(os.path.join(target, MANIFEST_NAME), {
+            "workspace": workspace,
+            "project": project,
+            "version": version,
+            "format": fmt,
+            "complete": True,
+            "synced_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": stats.pop("files"),
+        })
+        print(f"✅ 数据集同步完成: 下载 {stats['downloaded']}，未变 {stats['unchanged']}，删除 {stats['removed']}"
+              f"（网络 {stats['bytes_fetched'] / 1e6:.1f} MB）")
+        return target, stats
+
+    def _apply_zip(self, fileobj, target, known):
+        """按 zip 中央目录对比 CRC 和大小，只解压变化的文件，删除已不存在的文件"""
+        files, downloaded, unchanged = {}, 0, 0
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                name = info.filename.replace("\\", "/")
+                if name.startswith("/") or ".." in name.split("/"):
+                    continue
+                dst = os.path.join(target, name)
+                entry = known.get(name)
+                if entry and entry["crc32"] == info.CRC and entry["size"] == info.file_size and os.path.exists(dst):
+                    files[name] = entry
+                    unchanged += 1
+                    continue
+                data = zf.read(info)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                tmp_path = f"{dst}.part"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, dst)
+                files[name] = {"size": info.file_size, "crc32": info.CRC, "sha256": _sha256(data)}
+                downloaded += 1
+
+        removed = 0
+        for name in set(known) - set(files):
+            path = os.path.join(target, name)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return {"files": files, "downloaded": downloaded, "unchanged": unchanged, "removed": removed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 数据集增量同步")
+    parser.add_argument("--workspace", default="malaysian-food-detection")
+    parser.add_argument("--project", default="malaysian-food-detection-wy3kt")
+    parser.add_argument("--version", type=int, default=2)
+    parser.add_argument("--format", default="yolov8")
+    parser.add_argument("--api-key", default=os.environ.get("ROBOFLOW_API_KEY"))
+    parser.add_argument("--zip-url", default=None, help="直接指定导出 zip 地址或本地路径（测试用）")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR)
+    parser.add_argument("--offline", action="store_true")
+    parser.add_argument("--force", action="store_true", help="忽略本地完成标记，重新对比全部文件")
+    args = parser.parse_args()
+
+    store = DatasetStore(args.store)
+    try:
+        location, _ = store.sync(args.workspace, args.project, args.version, api_key=args.api_key, fmt=args.format,
+                                 zip_url=args.zip_url, offline=args.offline, force=args.force)
+    except Exception as e:
+        print(f"❌ 数据集同步失败: {e}")
+        sys.exit(1)
+    print(location)
+
+
+if __name__ == "__main__":
+    main()
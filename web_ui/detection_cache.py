@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 检测结果缓存
+同一张图片（按内容哈希）+ 同一个模型 + 同一置信度阈值只推理一次。
+两级缓存：内存 LRU + 可选的磁盘缓存（总大小有上限）。
+磁盘缓存按模型标识分子目录，多个模型交替使用（热切换、切片 / 整图）时互不清空，旧模型的结果按 LRU 淘汰。
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelIdentity:
+    """模型标识 = 路径 + mtime + 大小 + 内容哈希；同一版本的权重文件只计算一次哈希"""
+
+    def __init__(self):
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, model_path):
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key not in self._memo:
+                target = model_path
+                if os.path.isdir(model_path):
+                    # OpenVINO 导出目录：以其中的权重文件为准
+                    target = next((os.path.join(model_path, f) for f in sorted(os.listdir(model_path))
+                                   if f.endswith(".bin")), None)
+                content_hash = file_sha256(target) if target else ""
+                self._memo[key] = hashlib.sha256(f"{key[0]}|{key[1]}|{key[2]}|{content_hash}".encode()).hexdigest()[:16]
+            return self._memo[key]
+
+
+class DetectionCache:
+    """内存 LRU + 可选磁盘缓存"""
+
+    def __init__(self, max_entries=1024, cache_dir=None, max_disk_mb=256):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.model_identity = ModelIdentity()
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        if cache_dir:
+            self._load_disk_index()
+
+    # ------------------------------------------------------------------ 键
+
+    def make_key(self, image_path, model_path, conf, variant=""):
+        """缓存键：图片内容哈希 + 模型标识 + 置信度阈值（+ 推理方式，如切片参数）"""
+        model_id = self.model_identity(model_path)
+        key = f"{file_sha256(image_path)}_{model_id}_{conf:.4f}"
+        if variant:
+            key += "_" + hashlib.sha256(variant.encode("utf-8")).hexdigest()[:8]
+        return key
+
+    # ------------------------------------------------------------------ 读写
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return self._memory[key]
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # ------------------------------------------------------------------ 磁盘
+
+    def _disk_path(self, key):
+        """<cache_dir>/<模型标识>/<哈希前两位>/<key>.json"""
+        model_id = key.split("_")[1]
+        return os.path.join(self.cache_dir, model_id, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        """启动时扫描磁盘缓存，按 mtime 恢复 LRU 顺序；不在对应模型目录下的文件（旧版布局）直接删除"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):  # 其他进程正在写入的临时文件
+                    continue
+                path = os.path.join(root, name)
+                key = name[:-5]
+                if key.count("_") < 2 or path != self._disk_path(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        with self._lock:
+            if key not in self._disk_index:
+                return None
+            self._disk_index.move_to_end(key)
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)
+            return value
+        except Exception:
+            with self._lock:
+                self._disk_bytes -= self._disk_index.pop(key, 0)
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(data)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk_index) > 1:
+                old_key, size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= size
+                try:
+                    os.remove(self._disk_path(old_key))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._disk_index.clear()
+            self._disk_bytes = 0
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------ 统计
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "lookups": lookups,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_mb": self._disk_bytes / (1024 * 1024),
+            }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 检测指标（NumPy 实现）
+与 ultralytics 的 DetMetrics 计算方式一致：先逐图匹配预测与标注，得到每个预测在 10 个 IoU 阈值下的 TP 标记，
+再把所有图片的匹配结果拼接后统一计算 P / R / mAP50 / mAP50-95。
+因为指标只依赖拼接后的匹配结果，分片并行验证时各分片返回匹配结果、由主进程汇总即可得到正确的全局指标。
+"""
+
+import os
+
+import numpy as np
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+EPS = 1e-16
+
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def box_iou_matrix(boxes1, boxes2):
+    """(N, 4) x (M, 4) xyxy -> (N, M) IoU"""
+    lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    return inter / (area1[:, None] + area2[None, :] - inter + 1e-9)
+
+
+def label_path_for(image_path):
+    """YOLO 数据集约定: .../images/xxx.jpg -> .../labels/xxx.txt"""
+    sep = os.sep
+    parts = image_path.rsplit(f"{sep}images{sep}", 1)
+    base = f"{sep}labels{sep}".join(parts) if len(parts) == 2 else image_path
+    return os.path.splitext(base)[0] + ".txt"
+
+
+def load_yolo_labels(label_path, width, height):
+    """读取 YOLO 标签（归一化 xywh），返回像素 xyxy 与类别"""
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+    rows = []
+    with open(label_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            values = line.split()
+            if len(values) >= 5:
+                rows.append([float(v) for v in values[:5]])
+    if not rows:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.int64)
+    labels = np.asarray(rows, dtype=np.float32)
+    cx, cy, w, h = labels[:, 1] * width, labels[:, 2] * height, labels[:, 3] * width, labels[:, 4] * height
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return boxes, labels[:, 0].astype(np.int64)
+
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls, iouv=IOU_THRESHOLDS):
+    """每个预测在各 IoU 阈值下是否为 TP（同类、一一匹配、IoU 高者优先）"""
+    correct = np.zeros((len(pred_boxes), len(iouv)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return correct
+    iou = box_iou_matrix(gt_boxes, pred_boxes) * (gt_cls[:, None] == pred_cls[None, :])
+    for i, threshold in enumerate(iouv):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if not len(gt_idx):
+            continue
+        matches = np.stack([gt_idx, pred_idx, iou[gt_idx, pred_idx]], axis=1)
+        if len(matches) > 1:
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1].astype(int), i] = True
+    return correct
+
+
+def image_stats(prediction, gt_boxes, gt_cls):
+    """单张图片的匹配结果，可跨进程传递并在主进程拼接"""
+    return {
+        "tp": match_predictions(prediction["xyxy"], prediction["cls"], gt_boxes, gt_cls),
+        "conf": prediction["conf"],
+        "pred_cls": prediction["cls"],
+        "target_cls": gt_cls,
+    }
+
+
+def concat_stats(stats_list):
+    """拼接多张图片（或多个分片）的匹配结果"""
+    if not stats_list:
+        return {"tp": np.zeros((0, len(IOU_THRESHOLDS)), bool), "conf": np.zeros(0),
+                "pred_cls": np.zeros(0, np.int64), "target_cls": np.zeros(0, np.int64)}
+    return {key: np.concatenate([s[key] for s in stats_list], axis=0) for key in stats_list[0]}
+
+
+def compute_ap(recall, precision):
+    """101 点插值 AP（COCO 方式）"""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return _trapezoid(np.interp(x, mrec, mpre), x)
+
+
+def ap_per_class(tp, conf, pred_cls, target_cls):
+    """按类别计算 AP，返回 (类别, P, R, AP[nc, 10])"""
+    order = np.argsort(-conf)
+    tp, conf, pred_cls = tp[order], conf[order], pred_cls[order]
+    classes, n_targets = np.unique(target_cls, return_counts=True)
+
+    x = np.linspace(0, 1, 1000)
+    ap = np.zeros((len(classes), tp.shape[1]))
+    p_curve = np.zeros((len(classes), len(x)))
+    r_curve = np.zeros((len(classes), len(x)))
+    for ci, c in enumerate(classes):
+        mask = pred_cls == c
+        if not mask.any():
+            continue
+        fpc = (1 - tp[mask]).cumsum(0)
+        tpc = tp[mask].cumsum(0)
+        recall = tpc / (n_targets[ci] + EPS)
+        precision = tpc / (tpc + fpc)
+        r_curve[ci] = np.interp(-x, -conf[mask], recall[:, 0], left=0)
+        p_curve[ci] = np.interp(-x, -conf[mask], precision[:, 0], left=1)
+        for j in range(tp.shape[1]):
+            ap[ci, j] = compute_ap(recall[:, j], precision[:, j])
+
+    # 取平均 F1 最大的置信度点上的 P / R
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + EPS)
+    best = f1.mean(0).argmax() if len(classes) else 0
+    return classes, p_curve[:, best], r_curve[:, best], ap
+
+
+def summarize(stats, names=None):
+    """汇总指标，键名与 ultralytics results_dict 一致"""
+    tp = stats["tp"].astype(np.float64)
+    classes, p, r, ap = ap_per_class(tp, stats["conf"], stats["pred_cls"], stats["target_cls"])
+    names = names or {}
+    summary = {
+        "metrics/precision(B)": float(p.mean()) if len(p) else 0.0,
+        "metrics/recall(B)": float(r.mean()) if len(r) else 0.0,
+        "metrics/mAP50(B)": float(ap[:, 0].mean()) if len(ap) else 0.0,
+        "metrics/mAP50-95(B)": float(ap.mean()) if len(ap) else 0.0,
+    }
+    summary["per_class"] = {
+        names.get(int(c), f"class_{int(c)}"): {"mAP50": float(ap[i, 0]), "mAP50-95": float(ap[i].mean()),
+                                                "precision": float(p[i]), "recall": float(r[i])}
+        for i, c in enumerate(classes)
+    }
+    return summary
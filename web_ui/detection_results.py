@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 检测结果构造
+后端返回的 {"xyxy", "conf", "cls"} 数组整体做置信度过滤、xyxy -> xywh 和类别名映射，不逐框索引:
+  - detection_columns()      列式结果（并行数组），批量推理和拥挤图片直接使用
+  - columns_to_detections()  转为接口现有的 [{"class", "confidence", "bbox"}, ...]
+  - columns_to_json()        紧凑的 JSON 列式结构 {"class": [...], "confidence": [...], "bbox": [x, y, w, h, ...]}
+  - ColumnarWriter           批量推理的二进制列式输出（每个 part 一个 .npz，续跑时统计已有 part）
+"""
+
+import os
+import glob
+import json
+import threading
+
+import numpy as np
+
+_name_arrays = {}
+_name_lock = threading.Lock()
+
+
+def names_array(names):
+    """类别 id -> 名称的 NumPy 数组（未知 id 为 class_<id>），同一组 names 只构造一次"""
+    key = tuple(sorted(names.items()))
+    with _name_lock:
+        array = _name_arrays.get(key)
+        if array is None:
+            size = max(names) + 1 if names else 0
+            array = np.array([names.get(i, f"class_{i}") for i in range(size)], dtype=object)
+            _name_arrays[key] = array
+        return array
+
+
+def detection_columns(prediction, names, conf=0.0):
+    """{"class_id", "class", "confidence", "bbox"(xywh)}，每项都是长度相同的数组"""
+    scores = np.asarray(prediction["conf"], dtype=np.float32)
+    keep = scores >= conf
+    xyxy = np.asarray(prediction["xyxy"], dtype=np.float32).reshape(-1, 4)[keep]
+    cls = np.asarray(prediction["cls"], dtype=np.int64)[keep]
+
+    bbox = xyxy.copy()
+    bbox[:, 2:] -= xyxy[:, :2]
+    lookup = names_array(names)
+    known = cls < len(lookup)
+    if known.all():
+        class_names = lookup[cls]
+    else:
+        class_names = np.array([f"class_{c}" for c in cls], dtype=object)
+        class_names[known] = lookup[cls[known]]
+    return {"class_id": cls.astype(np.int32), "class": class_names, "confidence": scores[keep], "bbox": bbox}
+
+
+def columns_to_detections(columns):
+    """列式结果 -> 检测字典列表（每列只 tolist() 一次）"""
+    return [{"class": name, "confidence": score, "bbox": box}
+            for name, score, box in zip(columns["class"].tolist(), columns["confidence"].tolist(),
+                                        columns["bbox"].tolist())]
+
+
+def columns_to_json(columns):
+    return {
+        "class": columns["class"].tolist(),
+        "class_id": columns["class_id"].tolist(),
+        "confidence": columns["confidence"].tolist(),
+        "bbox": columns["bbox"].ravel().tolist(),
+    }
+
+
+class ColumnarWriter:
+    """
+    批量推理的列式输出目录：part-XXXXX.npz 中是一批图片的所有框
+    (image_path, success, error, offsets) 按图片，(class_id, confidence, bbox) 按框，offsets 划分每张图片的框
+    """
+
+    columnar = True
+
+    def __init__(self, directory, names=None, rows_per_part=4096):
+        self.directory = directory
+        self.rows_per_part = rows_per_part
+        os.makedirs(directory, exist_ok=True)
+        if names is not None:
+            with open(os.path.join(directory, "names.json"), 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in names.items()}, f, ensure_ascii=False)
+        self.done, self.last_path = self._scan()
+        self.part = len(self._parts())
+        self.buffer = []
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.directory, "part-*.npz")))
+
+    def _scan(self):
+        # 中途退出时残留的临时文件（不匹配 part-*.npz，不会被当作已完成的 part）
+        for tmp in glob.glob(os.path.join(self.directory, ".part-*.tmp.npz")):
+            os.remove(tmp)
+        done, last_path = 0, None
+        for part in self._parts():
+            try:
+                with np.load(part, allow_pickle=False) as data:
+                    paths = data["image_path"]
+            except Exception:
+                os.remove(part)  # 写了一半的 part
+                continue
+            done += len(paths)
+            if len(paths):
+                last_path = str(paths[-1])
+        return done, last_path
+
+    def write(self, records):
+        self.buffer.extend(records)
+        if len(self.buffer) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        empty = {"class_id": np.zeros(0, np.int32), "confidence": np.zeros(0, np.float32),
+                 "bbox": np.zeros((0, 4), np.float32)}
+        columns = [record.get("columns") or empty for record in self.buffer]
+        counts = [len(c["class_id"]) for c in columns]
+        path = os.path.join(self.directory, f"part-{self.part:05d}.npz")
+        tmp_path = os.path.join(self.directory, f".part-{self.part:05d}.tmp.npz")
+        np.savez(tmp_path,
+                 image_path=np.array([r["image_path"] for r in self.buffer]),
+                 success=np.array([r["success"] for r in self.buffer]),
+                 error=np.array([r.get("error") or "" for r in self.buffer]),
+                 offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                 class_id=np.concatenate([c["class_id"] for c in columns]).astype(np.int16),
+                 confidence=np.concatenate([c["confidence"] for c in columns]).astype(np.float32),
+                 bbox=np.concatenate([c["bbox"] for c in columns]).astype(np.float32).reshape(-1, 4))
+        os.replace(tmp_path, path)
+        self.part += 1
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+
+
+def read_columnar(directory):
+    """逐个 part 产出 (图片路径数组, offsets, class_id, confidence, bbox)"""
+    for part in sorted(glob.glob(os.path.join(directory, "part-*.npz"))):
+        with np.load(part, allow_pickle=False) as data:
+            yield data["image_path"], data["offsets"], data["class_id"], data["confidence"], data["bbox"]
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 知识蒸馏（yolov8s 教师 → yolov8n 学生）
+1. 教师模型（训练好的 best.pt）对训练集只推理一次，预测框和置信度缓存为 .npz
+   （按教师权重 + 数据集指纹缓存，学生训练的每一轮都不再运行教师）
+2. 学生训练时，缓存的教师预测作为软标签加入每张图片的标注：与真实框重叠（IoU ≥ 0.5）的教师框丢弃，
+   其余的以教师置信度作为目标分数的权重（真实框权重为 1），随图片一起经过 mosaic / 仿射等数据增强
+3. 学生模型走正常的 export_model() 导出，教师与学生的精度（mAP）和 CPU 延迟一起写入训练会话
+
+权重放在类别编号的小数部分（cls + (1 - conf) / 2），数据增强对类别数组只做筛选和拼接，权重随框一起保留；
+DistillationLoss 在计算损失前还原类别编号，并按权重缩放分配给每个框的目标分数。
+
+用法:
+    python distillation.py <数据集目录> --teacher nutriscan_training/<run>/weights/best.pt --student yolov8n
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+DISTILL_PROJECT = "nutriscan_distill"
+CACHE_DIR_NAME = ".nutriscan_distill"
+TEACHER_CONF = 0.25
+OVERLAP_IOU = 0.5
+PREDICT_CHUNK = 64
+
+
+# =============================================================================
+# 教师预测缓存
+# =============================================================================
+
+def teacher_cache_path(teacher_path, dataset_path, image_dir, image_files, imgsz, conf):
+    from image_cache import dataset_fingerprint
+
+    stat = os.stat(teacher_path)
+    digest = hashlib.sha256(f"{os.path.abspath(teacher_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0"
+                            f"{imgsz}\0{conf}\0{dataset_fingerprint(image_dir, image_files)}".encode("utf-8"))
+    return os.path.join(dataset_path, CACHE_DIR_NAME, f"teacher_{digest.hexdigest()[:16]}.npz")
+
+
+def cache_teacher_predictions(teacher_path, dataset_path, imgsz=640, conf=TEACHER_CONF, split="train"):
+    """教师对训练集推理一次并缓存，返回缓存文件路径（已存在时直接返回）"""
+    from image_cache import list_images
+    from sharded_inference import resolve_split_images
+
+    image_dir, _ = resolve_split_images(dataset_path, split)
+    image_files = list_images(image_dir)
+    cache_path = teacher_cache_path(teacher_path, dataset_path, image_dir, image_files, imgsz, conf)
+    if os.path.exists(cache_path):
+        print(f"♻️ 使用缓存的教师预测: {cache_path}")
+        return cache_path
+
+    from ultralytics import YOLO
+    print(f"🧑‍🏫 教师模型推理 {len(image_files)} 张训练图片（只运行一次）...")
+    teacher = YOLO(teacher_path, task="detect")
+    counts, cls, scores, xywhn = [], [], [], []
+    for start in range(0, len(image_files), PREDICT_CHUNK):
+        chunk = image_files[start:start + PREDICT_CHUNK]
+        for result in teacher.predict(chunk, imgsz=imgsz, conf=conf, device="cpu", verbose=False, stream=True):
+            boxes = result.boxes
+            counts.append(len(boxes))
+            cls.append(boxes.cls.cpu().numpy())
+            scores.append(boxes.conf.cpu().numpy())
+            xywhn.append(boxes.xywhn.cpu().numpy())
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp.npz"
+    np.savez(tmp_path, files=np.array([os.path.basename(p) for p in image_files]),
+             counts=np.array(counts, np.int64), cls=np.concatenate(cls).astype(np.float32),
+             conf=np.concatenate(scores).astype(np.float32), xywhn=np.concatenate(xywhn).astype(np.float32).reshape(-1, 4),
+             teacher=np.array(os.path.abspath(teacher_path)))
+    os.replace(tmp_path, cache_path)
+    print(f"💾 教师预测已缓存: {cache_path}（{sum(counts)} 个框）")
+    return cache_path
+
+
+def load_teacher_predictions(cache_path):
+    """{图片文件名: (cls, conf, xywhn)}"""
+    with np.load(cache_path, allow_pickle=False) as data:
+        offsets = np.concatenate([[0], np.cumsum(data["counts"])])
+        cls, conf, xywhn = data["cls"], data["conf"], data["xywhn"]
+        return {name: (cls[a:b], conf[a:b], xywhn[a:b])
+                for name, a, b in zip(data["files"].tolist(), offsets[:-1], offsets[1:])}
+
+
+def _xywh_iou(a, b):
+    """两组归一化 xywh 框的 IoU 矩阵 (len(a), len(b))"""
+    a0, a1 = a[:, None, :2] - a[:, None, 2:] / 2, a[:, None, :2] + a[:, None, 2:] / 2
+    b0, b1 = b[None, :, :2] - b[None, :, 2:] / 2, b[None, :, :2] + b[None, :, 2:] / 2
+    inter = np.clip(np.minimum(a1, b1) - np.maximum(a0, b0), 0, None).prod(axis=2)
+    union = a[:, None, 2:].prod(axis=2) + b[None, :, 2:].prod(axis=2) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def encode_soft_labels(gt_cls, gt_xywh, t_cls, t_conf, t_xywh, iou=OVERLAP_IOU):
+    """在真实标注后追加不与真实框重叠的教师框，类别编号的小数部分编码权重"""
+    if len(t_cls) and len(gt_xywh):
+        keep = _xywh_iou(t_xywh, gt_xywh).max(axis=1) < iou
+        t_cls, t_conf, t_xywh = t_cls[keep], t_conf[keep], t_xywh[keep]
+    soft_cls = t_cls + np.minimum((1.0 - t_conf) / 2, 0.499)
+    return (np.concatenate([gt_cls.reshape(-1, 1), soft_cls.reshape(-1, 1)]).astype(np.float32),
+            np.concatenate([gt_xywh.reshape(-1, 4), t_xywh.reshape(-1, 4)]).astype(np.float32))
+
+
+def decode_soft_labels(cls):
+    """(类别编号, 权重)；真实框权重为 1"""
+    classes = cls.floor()
+    return classes, 1.0 - 2.0 * (cls - classes)
+
+
+# =============================================================================
+# 训练
+# =============================================================================
+
+def _make_loss_class():
+    from ultralytics.utils.loss import v8DetectionLoss
+
+    class DistillationLoss(v8DetectionLoss):
+        """按框权重缩放 TaskAlignedAssigner 给出的目标分数（教师框是软目标）"""
+
+        def __init__(self, model):
+            super().__init__(model)
+            self._weights = None
+            assigner = self.assigner
+
+            def weighted_assigner(*args, **kwargs):
+                out = assigner(*args, **kwargs)
+                if self._weights is None:
+                    return out
+                _, target_bboxes, target_scores, fg_mask, target_gt_idx = out
+                weights = self._weights.gather(1, target_gt_idx.clamp(max=self._weights.shape[1] - 1))
+                return (_, target_bboxes, target_scores * weights.unsqueeze(-1), fg_mask, target_gt_idx)
+
+            self.assigner = weighted_assigner
+
+        def __call__(self, preds, batch):
+            import torch
+
+            classes, weights = decode_soft_labels(batch["cls"].view(-1))
+            batch = {**batch, "cls": classes.view(-1, 1)}
+            # 与 v8DetectionLoss.preprocess 相同的排列：每张图片的框按原顺序填入 (batch, 最大框数)
+            batch_idx = batch["batch_idx"].view(-1).long()
+            batch_size = (preds[1] if isinstance(preds, tuple) else preds)[0].shape[0]
+            counts = torch.bincount(batch_idx, minlength=batch_size)
+            padded = torch.zeros(batch_size, max(int(counts.max()) if len(counts) else 0, 1), device=self.device)
+            if len(batch_idx):
+                order = torch.argsort(batch_idx, stable=True)
+                starts = torch.cumsum(counts, 0) - counts
+                slots = torch.arange(len(batch_idx), device=batch_idx.device) - starts[batch_idx[order]]
+                padded[batch_idx[order], slots] = weights[order].to(self.device)
+            self._weights = padded
+            try:
+                return super().__call__(preds, batch)
+            finally:
+                self._weights = None
+
+    return DistillationLoss
+
+
+class DistillationTrainerMixin:
+    """DetectionTrainer 的 mixin：训练集标注加入缓存的教师软标签，损失按框权重计算"""
+
+    teacher_cache = None  # 由 build_trainer(teacher_cache=...) 设置
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if mode == "train" and self.teacher_cache:
+            predictions = load_teacher_predictions(self.teacher_cache)
+            added = 0
+            for label in dataset.labels:
+                teacher = predictions.get(os.path.basename(label["im_file"]))
+                if teacher is None:
+                    continue
+                before = len(label["cls"])
+                label["cls"], label["bboxes"] = encode_soft_labels(label["cls"], label["bboxes"], *teacher)
+                added += len(label["cls"]) - before
+            print(f"🧑‍🏫 加入 {added} 个教师软标签（{len(predictions)} 张图片的缓存预测）")
+        return dataset
+
+    def preprocess_batch(self, batch):
+        criterion = getattr(self.model, "criterion", None)
+        if criterion is None or type(criterion).__name__ != "DistillationLoss":
+            # 只替换训练模型的损失函数；EMA 和保存的检查点中没有 criterion，导出的模型不依赖本模块
+            self.model.criterion = _make_loss_class()(self.model)
+        return super().preprocess_batch(batch)
+
+
+# =============================================================================
+# 蒸馏流程
+# =============================================================================
+
+def _evaluate(model_path, dataset_path, imgsz):
+    """验证集精度 + CPU 单张延迟"""
+    from ultralytics import YOLO
+    from export_stage import benchmark_artifact
+    from local_training import validate_model
+
+    metrics = validate_model(YOLO(model_path), dataset_path).results_dict
+    return {
+        "model_path": str(model_path),
+        "mAP50": float(metrics.get("metrics/mAP50(B)", 0.0)),
+        "mAP50-95": float(metrics.get("metrics/mAP50-95(B)", 0.0)),
+        "latency": benchmark_artifact(str(model_path), imgsz),
+    }
+
+
+def distill(teacher_path, dataset_path, student="yolov8n", epochs=100, batch=16, imgsz=640,
+            conf=TEACHER_CONF, resume=False, overrides=None):
+    """
+    训练学生模型并保存会话，返回会话 ID（训练失败时返回 None）。
+    resume 默认关闭：未完成的蒸馏运行只按数据集匹配，可能来自不同的教师 / 学生 / conf
+    """
+    from local_training import SESSION_FILE, export_model, save_training_session, train_model
+
+    cache_path = cache_teacher_predictions(teacher_path, dataset_path, imgsz, conf)
+    model, results = train_model(dataset_path, epochs=epochs, batch=batch, imgsz=imgsz, resume=resume,
+                                 model_type=student, overrides=overrides, teacher_cache=cache_path,
+                                 project=DISTILL_PROJECT)
+    if not model:
+        return None
+
+    student_path = str(model.trainer.best)
+    exported_models = export_model(student_path, imgsz)
+    report = {
+        "teacher": _evaluate(teacher_path, dataset_path, imgsz),
+        "student": {"model_type": student, **_evaluate(student_path, dataset_path, imgsz)},
+        "teacher_cache": cache_path,
+        "teacher_conf": conf,
+    }
+    teacher_ms, student_ms = report["teacher"]["latency"]["p50_ms"], report["student"]["latency"]["p50_ms"]
+    print(f"📊 教师 mAP50 {report['teacher']['mAP50']:.3f} / {teacher_ms:.1f} ms，"
+          f"学生 mAP50 {report['student']['mAP50']:.3f} / {student_ms:.1f} ms")
+
+    return save_training_session({
+        "model_config": {"model_type": student, "epochs": epochs, "batch_size": batch, "img_size": imgsz,
+                         "teacher": os.path.abspath(teacher_path), **(overrides or {})},
+        "metrics": results.results_dict if hasattr(results, "results_dict") else {},
+        "best_model_path": student_path,
+        "exported_models": exported_models,
+        "distillation": report,
+    }, SESSION_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 知识蒸馏")
+    parser.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    parser.add_argument("--teacher", required=True, help="教师模型 best.pt")
+    parser.add_argument("--student", default="yolov8n")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--conf", type=float, default=TEACHER_CONF, help="教师框的最低置信度")
+    parser.add_argument("--resume", action="store_true", help="继续同一数据集上未完成的蒸馏（须是相同的教师和学生）")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.teacher):
+        print(f"❌ 找不到教师模型: {args.teacher}")
+        sys.exit(1)
+    session_id = distill(args.teacher, args.dataset, args.student, args.epochs, args.batch, args.imgsz,
+                         args.conf, args.resume)
+    if not session_id:
+        sys.exit(1)
+    print(json.dumps({"session_id": session_id}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 模型导出阶段
+从任意已完成会话的 best.pt 出发，用进程池并行导出各格式（每种格式一个进程），
+记录每种格式的导出耗时、产物大小，并在固定图片上做一次快速延迟测试，结果写回会话的 exported_models:
+
+    "exported_models": {"onnx": {"path": ..., "duration_s": ..., "size_mb": ..., "latency": {...}}, ...}
+
+每个格式先在独立的暂存目录中导出（TFLite 导出内部也会生成 ONNX，避免并行时互相覆盖），
+完成后移动到权重旁边，产物位置与原先串行导出时相同。
+
+用法:
+    python export_stage.py                      # 最新完成的会话
+    python export_stage.py --session <ID> --formats onnx,torchscript
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import importlib.util
+import multiprocessing as mp
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batch_scheduler import percentile
+
+DEFAULT_FORMATS = ['onnx', 'torchscript', 'tflite']
+BENCHMARK_RUNS = 10
+BENCHMARK_WARMUP = 2
+
+
+def default_formats():
+    formats = list(DEFAULT_FORMATS)
+    # 安装了 OpenVINO 时额外导出，推理服务会优先使用（见 inference_backends.py）
+    if importlib.util.find_spec('openvino') is not None:
+        formats.append('openvino')
+    return formats
+
+
+def artifact_size_mb(path):
+    if os.path.isdir(path):
+        total = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    else:
+        total = os.path.getsize(path)
+    return total / (1024 * 1024)
+
+
+def _export_one(best_model_path, fmt, imgsz):
+    """工作进程：在暂存目录导出一种格式，再移动到权重旁边；返回 (格式, 结果)"""
+    weights_dir = os.path.dirname(os.path.abspath(best_model_path))
+    staging = os.path.join(weights_dir, f".export_{fmt}")
+    started = time.perf_counter()
+    try:
+        from ultralytics import YOLO
+
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        staged_weights = os.path.join(staging, os.path.basename(best_model_path))
+        shutil.copy2(best_model_path, staged_weights)
+        exported = str(YOLO(staged_weights).export(format=fmt, imgsz=imgsz))
+
+        # 产物可能是文件（best.onnx）或目录里的文件（best_saved_model/best_float32.tflite），整体移动顶层条目
+        relative = os.path.relpath(exported, staging)
+        top = relative.split(os.sep)[0]
+        target = os.path.join(weights_dir, top)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+        shutil.move(os.path.join(staging, top), target)
+        path = os.path.join(weights_dir, relative)
+        return fmt, {
+            "path": path,
+            "duration_s": time.perf_counter() - started,
+            "size_mb": artifact_size_mb(target),
+        }
+    except Exception as e:
+        traceback.print_exc()
+        return fmt, {
+            "error": f"{type(e).__name__}: {e}",
+            "duration_s": time.perf_counter() - started,
+        }
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def benchmark_artifact(path, imgsz=640, image=None, runs=BENCHMARK_RUNS, warmup=BENCHMARK_WARMUP):
+    """在固定图片上测量单张推理延迟（毫秒）；image 为空时使用固定种子生成的图片"""
+    import numpy as np
+    from ultralytics import YOLO
+
+    if image is None:
+        image = np.random.default_rng(0).integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8)
+    model = YOLO(path, task="detect")
+    for _ in range(warmup):
+        model.predict(image, imgsz=imgsz, device="cpu", verbose=False)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        model.predict(image, imgsz=imgsz, device="cpu", verbose=False)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "mean_ms": sum(timings) / len(timings),
+        "runs": runs,
+        "image": image if isinstance(image, str) else f"random_{imgsz}x{imgsz}_seed0",
+    }
+
+
+def run_export_stage(best_model_path, formats=None, imgsz=640, workers=None, benchmark=True, image=None):
+    """
+    并行导出，返回 {格式: 结果}；失败的格式带 error 字段，不影响其他格式。
+    延迟测试在全部导出结束后依次进行，避免与仍在运行的导出进程争抢 CPU。
+    """
+    formats = formats or default_formats()
+    workers = workers or min(len(formats), os.cpu_count() or 1)
+    print(f"📦 导出模型: {', '.join(formats)}（{workers} 个进程）")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = [pool.submit(_export_one, best_model_path, fmt, imgsz) for fmt in formats]
+        for future in as_completed(futures):
+            fmt, result = future.result()
+            results[fmt] = result
+            if "error" in result:
+                print(f"❌ {fmt.upper()} 导出失败 ({result['duration_s']:.1f}s): {result['error']}")
+            else:
+                print(f"✅ {fmt.upper()} 导出成功 ({result['duration_s']:.1f}s, {result['size_mb']:.1f} MB): {result['path']}")
+
+    if benchmark:
+        for fmt in formats:
+            result = results[fmt]
+            if "error" in result:
+                continue
+            try:
+                result["latency"] = benchmark_artifact(result["path"], imgsz, image)
+                print(f"⏱️ {fmt.upper()} 延迟: p50 {result['latency']['p50_ms']:.1f} ms")
+            except Exception as e:
+                result["latency"] = {"error": f"{type(e).__name__}: {e}"}
+                print(f"⚠️ {fmt.upper()} 延迟测试失败: {e}")
+
+    # 保持与导出顺序一致
+    return {fmt: results[fmt] for fmt in formats}
+
+
+def export_session(session_id=None, formats=None, imgsz=640, workers=None, benchmark=True, image=None):
+    """对会话的 best.pt 执行导出阶段并写回 exported_models"""
+    from local_training import SESSION_FILE, update_training_session
+    from inference_worker import resolve_model_path
+    from session_store import SessionStore
+
+    store = SessionStore(SESSION_FILE)
+    session = store.get(session_id) if session_id else store.latest_completed()
+    if not session or not session.get("best_model_path"):
+        raise FileNotFoundError(f"找不到可导出的训练会话: {session_id or '最新完成的会话'}")
+    best_model_path = resolve_model_path(session["best_model_path"])
+    if not os.path.exists(best_model_path):
+        raise FileNotFoundError(f"模型文件不存在: {best_model_path}")
+
+    exported = run_export_stage(best_model_path, formats, imgsz, workers, benchmark, image)
+    # 只覆盖本次导出的格式，保留之前导出的其他格式
+    merged = {**(session.get("exported_models") or {}), **exported}
+    update_training_session(session["id"], {"exported_models": merged}, SESSION_FILE)
+    return session["id"], merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 模型导出阶段")
+    parser.add_argument("--session", help="训练会话 ID（默认最新完成的会话）")
+    parser.add_argument("--formats", default=None, help=f"逗号分隔，默认 {','.join(DEFAULT_FORMATS)}（安装 OpenVINO 时加上 openvino）")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数（默认每种格式一个）")
+    parser.add_argument("--image", default=None, help="延迟测试使用的图片（默认固定随机图片）")
+    parser.add_argument("--no-benchmark", action="store_true", help="跳过延迟测试")
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()] if args.formats else None
+    try:
+        session_id, exported = export_session(args.session, formats, args.imgsz, args.workers,
+                                              not args.no_benchmark, args.image)
+    except Exception as e:
+        print(f"❌ 导出失败: {e}")
+        sys.exit(1)
+    print(json.dumps({"session_id": session_id, "exported_models": exported}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 超参数搜索（ASHA 提前停止）
+围绕 train_model() 在多个工作进程中并行跑短试验，搜索 lr0、数据增强强度、模型类型和 imgsz。
+每个试验训练到若干"阶梯"轮次（min_epochs × eta^k）时，从 results.csv 读取指标并与同一阶梯上已记录的试验比较，
+低于前 1/eta 分位的试验立即停止（异步 successive halving，不需要等同一批试验全部到达阶梯）。
+总预算按 CPU 小时计（每个试验的耗时 × 分配给它的线程数），用完后不再启动新试验，运行中的试验在当前轮结束后停止。
+
+每个试验都作为独立的训练会话保存（status 为 sweep_completed / sweep_stopped，不会被当作部署模型），
+汇总写入 nutriscan_sweeps/<sweep_id>/sweep.json。
+
+用法:
+    python hparam_sweep.py <数据集目录> --trials 16 --workers 4 --budget-hours 8
+    python hparam_sweep.py <数据集目录> --space space.json --min-epochs 3 --max-epochs 27 --eta 3
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+import multiprocessing as mp
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+SWEEP_PROJECT = "nutriscan_sweeps"
+DEFAULT_METRIC = "metrics/mAP50-95(B)"
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# 两个 Colab 模板中出现过的取值都在搜索范围内
+DEFAULT_SEARCH_SPACE = {
+    "lr0": [0.01, 0.005, 0.0025],
+    "mosaic": [1.0, 0.5],
+    "mixup": [0.0, 0.1],
+    "hsv_s": [0.7, 0.4],
+    "model_type": ["yolov8n", "yolov8s"],
+    "imgsz": [512, 640],
+}
+
+
+def sample_trials(space, count, seed=0):
+    """从网格中无放回随机抽取 count 个配置（网格更小时全部返回）"""
+    keys = sorted(space)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+    random.Random(seed).shuffle(grid)
+    return grid[:count]
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """阶梯轮次: min_epochs, min_epochs*eta, ... （不含 max_epochs，训练到最后一轮自然结束）"""
+    rungs, epoch = [], min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= eta
+    return rungs
+
+
+def read_last_metric(results_csv, metric=DEFAULT_METRIC):
+    """results.csv 最后一行的指标（ultralytics 的列名可能带前导空格）"""
+    with open(results_csv, 'r', encoding='utf-8') as f:
+        rows = [{k.strip(): v for k, v in row.items()} for row in csv.DictReader(f)]
+    if not rows or not rows[-1].get(metric):
+        return None
+    return float(rows[-1][metric])
+
+
+class AshaScheduler:
+    """跨进程共享的 ASHA 状态（Manager 字典 + 锁），在每个试验进程的回调里调用"""
+
+    def __init__(self, shared, lock, rungs, eta, budget_cpu_s):
+        self.shared = shared
+        self.lock = lock
+        self.rungs = rungs
+        self.eta = eta
+        self.budget_cpu_s = budget_cpu_s
+
+    def report(self, trial_id, epoch, value):
+        """到达阶梯时记录指标，返回是否继续训练"""
+        if epoch not in self.rungs or value is None:
+            return True
+        with self.lock:
+            key = f"rung_{epoch}"
+            recorded = list(self.shared.get(key, [])) + [value]
+            self.shared[key] = recorded
+        recorded.sort(reverse=True)
+        # 同一阶梯上排在前 1/eta 的继续；记录少于 eta 个时至少保留第一名
+        keep = max(1, len(recorded) // self.eta)
+        cutoff = recorded[keep - 1]
+        return value >= cutoff
+
+    def charge(self, cpu_seconds):
+        """累计消耗的 CPU 秒，返回预算是否还有剩余"""
+        with self.lock:
+            used = self.shared.get("cpu_seconds", 0.0) + cpu_seconds
+            self.shared["cpu_seconds"] = used
+        return used < self.budget_cpu_s
+
+    def exhausted(self):
+        return self.shared.get("cpu_seconds", 0.0) >= self.budget_cpu_s
+
+
+def _run_trial(trial_id, params, dataset_path, sweep_id, scheduler, max_epochs, threads, batch, metric):
+    """工作进程：训练一个试验并保存为训练会话"""
+    import torch
+    torch.set_num_threads(threads)
+    from local_training import SESSION_FILE, save_training_session, train_model
+
+    state = {"status": "sweep_completed", "epochs": 0, "last_time": time.perf_counter(), "history": []}
+
+    def on_fit_epoch_end(trainer):
+        now = time.perf_counter()
+        in_budget = scheduler.charge((now - state["last_time"]) * threads)
+        state["last_time"] = now
+        epoch = trainer.epoch + 1
+        value = read_last_metric(os.path.join(trainer.save_dir, "results.csv"), metric)
+        state["epochs"] = epoch
+        state["history"].append(value)
+        if not scheduler.report(trial_id, epoch, value):
+            print(f"✂️ 试验 {trial_id} 在第 {epoch} 轮被提前停止 ({metric}={value})")
+            state["status"] = "sweep_stopped"
+            trainer.stop = True
+        elif not in_budget and epoch < max_epochs:
+            print(f"⌛ CPU 预算用完，试验 {trial_id} 在第 {epoch} 轮停止")
+            state["status"] = "sweep_stopped"
+            trainer.stop = True
+
+    params = dict(params)
+    model_type = params.pop("model_type", "yolov8n")
+    imgsz = params.pop("imgsz", 640)
+    started = time.perf_counter()
+    model, results = train_model(dataset_path, epochs=max_epochs, batch=batch, imgsz=imgsz, resume=False,
+                                 save_period=-1, model_type=model_type, overrides={**params, "workers": 2},
+                                 callbacks={"on_fit_epoch_end": on_fit_epoch_end},
+                                 project=os.path.join(SWEEP_PROJECT, sweep_id), name=f"trial_{trial_id:03d}")
+    if model is None:
+        return {"trial": trial_id, "status": "failed"}
+
+    metrics = results.results_dict if hasattr(results, "results_dict") else {}
+    config = {"model_type": model_type, "imgsz": imgsz, **params}
+    session_id = save_training_session({
+        "status": state["status"],
+        "model_config": {**config, "epochs": max_epochs, "batch_size": batch, "sweep_id": sweep_id,
+                         "trial": trial_id},
+        "metrics": metrics,
+        "best_model_path": str(model.trainer.best),
+        "validation_results": json.dumps({"history": state["history"]}),
+    }, SESSION_FILE)
+    return {
+        "trial": trial_id,
+        "status": state["status"],
+        "params": config,
+        "epochs_run": state["epochs"],
+        "score": metrics.get(metric, max((v for v in state["history"] if v is not None), default=None)),
+        "wall_s": time.perf_counter() - started,
+        "session_id": session_id,
+        "run_dir": str(model.trainer.save_dir),
+    }
+
+
+def _set_thread_env(threads):
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+
+
+def run_sweep(dataset_path, space=None, trials=16, workers=2, budget_hours=8.0, min_epochs=3, max_epochs=27,
+              eta=3, batch=16, metric=DEFAULT_METRIC, seed=0):
+    """执行搜索，返回按得分排序的试验结果"""
+    sweep_id = time.strftime("%Y%m%d_%H%M%S")
+    configs = sample_trials(space or DEFAULT_SEARCH_SPACE, trials, seed)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    print(f"🔬 超参数搜索 {sweep_id}: {len(configs)} 个试验, {workers} 个进程 × {threads} 线程, "
+          f"阶梯 {rungs} / {max_epochs} 轮, 预算 {budget_hours} CPU 小时")
+
+    manager = mp.get_context("spawn").Manager()
+    scheduler = AshaScheduler(manager.dict(), manager.Lock(), rungs, eta, budget_hours * 3600)
+    results, pending = [], list(enumerate(configs))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                             initializer=_set_thread_env, initargs=(threads,)) as pool:
+        running = set()
+        while pending or running:
+            while pending and len(running) < workers and not scheduler.exhausted():
+                trial_id, params = pending.pop(0)
+                running.add(pool.submit(_run_trial, trial_id, params, dataset_path, sweep_id, scheduler,
+                                        max_epochs, threads, batch, metric))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+                results.append(result)
+                print(f"📋 试验结果: {json.dumps(result, ensure_ascii=False)}")
+
+    if pending:
+        print(f"⌛ 预算用完，{len(pending)} 个试验未运行")
+    ranked = sorted((r for r in results if r.get("score") is not None), key=lambda r: r["score"], reverse=True)
+    summary = {
+        "sweep_id": sweep_id,
+        "metric": metric,
+        "rungs": rungs,
+        "max_epochs": max_epochs,
+        "eta": eta,
+        "cpu_hours_used": scheduler.shared.get("cpu_seconds", 0.0) / 3600,
+        "budget_hours": budget_hours,
+        "skipped_trials": len(pending),
+        "best": ranked[0] if ranked else None,
+        "trials": ranked + [r for r in results if r.get("score") is None],
+    }
+    sweep_dir = os.path.join(SWEEP_PROJECT, sweep_id)
+    os.makedirs(sweep_dir, exist_ok=True)
+    with open(os.path.join(sweep_dir, "sweep.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    manager.shutdown()
+    if ranked:
+        print(f"🏆 最佳配置: {json.dumps(ranked[0]['params'], ensure_ascii=False)} ({metric}={ranked[0]['score']:.4f})")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 超参数搜索 (ASHA)")
+    parser.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    parser.add_argument("--space", help="搜索空间 JSON 文件 {参数: [取值, ...]}（默认见 DEFAULT_SEARCH_SPACE）")
+    parser.add_argument("--trials", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2, help="并行试验数")
+    parser.add_argument("--budget-hours", type=float, default=8.0, help="总 CPU 小时预算")
+    parser.add_argument("--min-epochs", type=int, default=3, help="第一个阶梯的轮次")
+    parser.add_argument("--max-epochs", type=int, default=27)
+    parser.add_argument("--eta", type=int, default=3, help="每个阶梯保留前 1/eta")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--metric", default=DEFAULT_METRIC)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    space = None
+    if args.space:
+        with open(args.space, 'r', encoding='utf-8') as f:
+            space = json.load(f)
+    summary = run_sweep(args.dataset, space, args.trials, args.workers, args.budget_hours, args.min_epochs,
+                        args.max_epochs, args.eta, args.batch, args.metric, args.seed)
+    if not summary["best"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
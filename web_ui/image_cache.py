@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 预解码训练图片缓存
+把 train/ 和 valid/ 的图片一次性解码并缩放（长边 = imgsz，与 ultralytics 的 load_image 一致），
+写入内存映射的 uint8 数组 (N, imgsz, imgsz, 3) + 索引文件。训练时数据加载器直接读取数组切片（零拷贝），
+不再每个 epoch 重新解码 JPEG。
+
+缓存目录名包含 imgsz、缩放插值方式和数据集指纹（dataset_store 的 manifest 哈希，没有 manifest 时用文件名/大小/mtime），
+数据集或 imgsz 变化时自动使用新缓存；相同配置的多次训练共用同一份缓存。
+同一图片目录的构建持有文件锁，在临时目录中写完后整体 os.replace 到位（并行的 sweep 试验不会读到半成品）；
+旧缓存不会自动删除（其他试验可能正在读取），用 --prune 按最近使用时间清理。
+
+用法:
+    python image_cache.py <数据集目录> --imgsz 640      # 预先构建 train / valid 缓存
+    python image_cache.py --prune 2                     # 每个图片目录只保留最近使用的 2 份缓存（没有训练在运行时执行）
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dataset_store import manifest_hash, MANIFEST_NAME
+from session_store import file_lock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_ROOT = os.path.join(BASE_DIR, "image_cache")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+INDEX_NAME = "index.json"
+ARRAY_NAME = "images.npy"
+TMP_MARKER = ".tmp-"
+
+
+def list_images(image_dir):
+    return sorted(os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def dataset_fingerprint(image_dir, files):
+    """优先使用 dataset_store 的 manifest 哈希；否则用文件名 + 大小 + mtime"""
+    current = os.path.abspath(image_dir)
+    for _ in range(4):
+        if os.path.exists(os.path.join(current, MANIFEST_NAME)):
+            return manifest_hash(current)
+        current = os.path.dirname(current)
+    digest = hashlib.sha256()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _decode(path, imgsz, augment):
+    """与 ultralytics BaseDataset.load_image(rect_mode=True) 相同的解码和缩放"""
+    import cv2
+
+    im = cv2.imread(path)
+    if im is None:
+        raise FileNotFoundError(f"图片无法读取: {path}")
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(int(np.ceil(w0 * r)), imgsz), min(int(np.ceil(h0 * r)), imgsz)
+        interp = cv2.INTER_LINEAR if (augment or r > 1) else cv2.INTER_AREA
+        im = cv2.resize(im, (w, h), interpolation=interp)
+    return im, (h0, w0)
+
+
+class ImageCache:
+    """只读内存映射缓存；数据加载器子进程里按需重新打开（不会把整个数组 pickle 过去）"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.imgsz = index["imgsz"]
+        self.files = index["files"]
+        self.shapes0 = index["shapes0"]
+        self.shapes = index["shapes"]
+        self.positions = {os.path.normcase(os.path.abspath(p)): i for i, p in enumerate(self.files)}
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            # 只读映射：下游如果误写原图会直接报错，而不是悄悄污染缓存
+            self._array = np.load(os.path.join(self.directory, ARRAY_NAME), mmap_mode='r')
+        return self._array
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    def get(self, path):
+        """返回 (图像视图, 原始尺寸, 缩放后尺寸)，不在缓存中时返回 None"""
+        i = self.positions.get(os.path.normcase(os.path.abspath(path)))
+        if i is None:
+            return None
+        h, w = self.shapes[i]
+        return self.array[i, :h, :w], tuple(self.shapes0[i]), (h, w)
+
+
+def build_image_cache(image_dir, imgsz=640, augment=True, cache_root=DEFAULT_CACHE_ROOT, workers=8):
+    """构建（或复用）一个图片目录的缓存，返回 ImageCache"""
+    files = list_images(image_dir)
+    if not files:
+        raise FileNotFoundError(f"目录中没有图片: {image_dir}")
+    split_key = hashlib.sha1(os.path.abspath(image_dir).encode("utf-8")).hexdigest()[:10]
+    key = f"{split_key}_{imgsz}_{'linear' if augment else 'area'}_{dataset_fingerprint(image_dir, files)[:16]}"
+    directory = os.path.join(cache_root, key)
+
+    if os.path.exists(os.path.join(directory, INDEX_NAME)):
+        return _reuse(directory)
+
+    os.makedirs(cache_root, exist_ok=True)
+    with file_lock(os.path.join(cache_root, f"{split_key}.lock")):
+        # 等锁期间其他进程可能已经构建完成
+        if os.path.exists(os.path.join(directory, INDEX_NAME)):
+            return _reuse(directory)
+        # 持有锁时同一目录不会有其他构建，残留的临时目录来自中途退出的进程
+        for name in os.listdir(cache_root):
+            if name.startswith(f".{split_key}_") and TMP_MARKER in name:
+                shutil.rmtree(os.path.join(cache_root, name), ignore_errors=True)
+        tmp_dir = os.path.join(cache_root, f".{key}{TMP_MARKER}{os.getpid()}")
+        _write_cache(tmp_dir, image_dir, files, imgsz, augment, workers)
+        os.replace(tmp_dir, directory)
+    print(f"✅ 图片缓存完成: {directory}")
+    return ImageCache(directory)
+
+
+def _reuse(directory):
+    print(f"♻️ 复用图片缓存: {directory}")
+    os.utime(directory)  # 记录最近使用时间，供 prune_image_cache 按 LRU 清理
+    return ImageCache(directory)
+
+
+def _write_cache(directory, image_dir, files, imgsz, augment, workers):
+    os.makedirs(directory)
+    array = np.lib.format.open_memmap(os.path.join(directory, ARRAY_NAME), mode='w+',
+                                      dtype=np.uint8, shape=(len(files), imgsz, imgsz, 3))
+    shapes0, shapes, kept = [], [], []
+    print(f"🗜️ 预解码 {len(files)} 张图片 ...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        decoded = pool.map(lambda p: (p, *_try_decode(p, imgsz, augment)), files)
+        for path, im, hw0 in decoded:
+            if im is None:
+                continue
+            h, w = im.shape[:2]
+            array[len(kept), :h, :w] = im
+            kept.append(path)
+            shapes0.append(list(hw0))
+            shapes.append([h, w])
+    array.flush()
+    del array
+
+    # 索引最后写入，作为缓存完整的标记
+    with open(os.path.join(directory, INDEX_NAME), 'w', encoding='utf-8') as f:
+        json.dump({"imgsz": imgsz, "augment": augment, "image_dir": os.path.abspath(image_dir),
+                   "files": [os.path.abspath(p) for p in kept], "shapes0": shapes0, "shapes": shapes}, f)
+    print(f"📦 {len(kept)} 张 ({os.path.getsize(os.path.join(directory, ARRAY_NAME)) / 1e9:.2f} GB)")
+
+
+def prune_image_cache(cache_root=DEFAULT_CACHE_ROOT, keep=2):
+    """每个图片目录只保留最近使用的 keep 份缓存，返回删除的目录；不要在训练运行时执行"""
+    if not os.path.isdir(cache_root):
+        return []
+    groups = {}
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        groups.setdefault(name.split("_", 1)[0], []).append(path)
+    removed = []
+    for split_key, paths in groups.items():
+        with file_lock(os.path.join(cache_root, f"{split_key}.lock")):
+            for path in sorted(paths, key=os.path.getmtime, reverse=True)[keep:]:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+    return removed
+
+
+def _try_decode(path, imgsz, augment):
+    try:
+        return _decode(path, imgsz, augment)
+    except Exception as e:
+        print(f"⚠️ 跳过无法解码的图片 {path}: {e}")
+        return None, None
+
+
+# =============================================================================
+# ultralytics 训练集成
+# =============================================================================
+
+try:
+    from ultralytics.data.dataset import YOLODataset as _YOLODataset
+except ImportError:  # 只构建缓存时不需要 ultralytics
+    _YOLODataset = object
+
+
+class CachedYOLODataset(_YOLODataset):
+    """load_image 优先从内存映射缓存读取；定义在模块顶层，数据加载器子进程可以正常 pickle"""
+
+    image_cache = None
+
+    def load_image(self, i, rect_mode=True):
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+        cached = self.image_cache.get(self.im_files[i]) if self.image_cache is not None else None
+        if cached is None or not rect_mode:
+            return super().load_image(i, rect_mode)
+        # 复制出可写数组（后续增强会原地修改），并和 BaseDataset.load_image 一样维护 mosaic 使用的 buffer
+        view, hw0, hw = cached
+        im = np.array(view)  # 连续的切片也是只读视图，总是复制
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, hw
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != "ram":
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, hw0, hw
+
+
+def attach_image_cache(dataset, cache):
+    """把已构建的 YOLODataset 切换为带缓存的版本"""
+    dataset.__class__ = CachedYOLODataset
+    dataset.image_cache = cache
+    # 缓存已在内存映射中，不需要 ultralytics 自己的 RAM / 磁盘缓存
+    if hasattr(dataset, "ims"):
+        dataset.ims = [None] * len(dataset.im_files)
+    return dataset
+
+
+class ImageCacheTrainerMixin:
+    """DetectionTrainer 的 mixin：构建数据集后挂上预解码缓存"""
+
+    image_cache_root = DEFAULT_CACHE_ROOT
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        image_dirs = img_path if isinstance(img_path, (list, tuple)) else [img_path]
+        if len(image_dirs) == 1 and os.path.isdir(image_dirs[0]):
+            try:
+                cache = build_image_cache(image_dirs[0], self.args.imgsz, augment=(mode == "train"),
+                                          cache_root=self.image_cache_root)
+                attach_image_cache(dataset, cache)
+            except Exception as e:
+                print(f"⚠️ 图片缓存不可用，回退到逐张解码: {e}")
+        return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 预解码训练图片缓存")
+    parser.add_argument("dataset", nargs="?", help="数据集目录（包含 train/ 和 valid/）")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--cache-root", default=DEFAULT_CACHE_ROOT)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--prune", type=int, metavar="KEEP", help="每个图片目录只保留最近使用的 KEEP 份缓存")
+    args = parser.parse_args()
+
+    if args.prune is not None:
+        removed = prune_image_cache(args.cache_root, args.prune)
+        print(f"🧹 删除 {len(removed)} 份旧缓存")
+        return
+    if not args.dataset:
+        parser.error("需要数据集目录（或使用 --prune）")
+
+    for split, augment in (("train", True), ("valid", False)):
+        image_dir = os.path.join(args.dataset, split, "images")
+        if not os.path.isdir(image_dir):
+            print(f"⚠️ 找不到 {image_dir}，跳过")
+            continue
+        build_image_cache(image_dir, args.imgsz, augment=augment, cache_root=args.cache_root, workers=args.workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
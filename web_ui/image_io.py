@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 图片读取
+上传的手机照片通常是 12MP JPEG，而模型输入只有 640。完整解码后再缩放既慢又占内存，这里:
+  - JPEG 用 PIL draft 模式在 DCT 阶段按 1/2、1/4、1/8 缩小解码（保证不小于目标尺寸）
+  - 按 EXIF 方向旋转（手机竖拍的照片）
+  - 直接缩放并 letterbox 到模型输入尺寸，可写入调用方提供的可复用缓冲区
+返回的缩放比例和原图尺寸都以旋转后的完整分辨率为准，检测框可以照常映射回原图。
+
+用法:
+    python image_io.py photo.jpg --imgsz 640     # 比较完整解码与缩小解码的耗时
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+PAD_COLOR = 114
+# EXIF 方向 5~8 表示图片需要旋转 90°，宽高互换
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _as_hw(imgsz):
+    return (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+
+
+def open_image(path, target=None):
+    """
+    读取图片为 RGB uint8 数组，返回 (图像, 旋转后的原图尺寸 (h, w))。
+    target=(h, w) 时 JPEG 只解码到不小于 target 等比缩放所需的分辨率
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        w0, h0 = img.size
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            w0, h0 = h0, w0
+        if target is not None and img.format == "JPEG":
+            r = min(target[0] / h0, target[1] / w0)
+            if r < 1:
+                # draft 的尺寸是旋转前的宽高
+                size = (int(np.ceil(w0 * r)), int(np.ceil(h0 * r)))
+                img.draft("RGB", size[::-1] if orientation in TRANSPOSED_ORIENTATIONS else size)
+        img = ImageOps.exif_transpose(img)
+        return np.asarray(img.convert("RGB")), (h0, w0)
+
+
+def letterbox_into(image, orig_shape, imgsz, out=None, color=PAD_COLOR):
+    """
+    把 image（可能已缩小解码）缩放到 orig_shape 按 imgsz 等比缩放后的尺寸并居中填充，写入 out。
+    返回 (画布, 相对原图的缩放比例, (左填充, 上填充))，与 inference_backends.letterbox 的结果一致
+    """
+    from PIL import Image
+
+    new_shape = _as_hw(imgsz)
+    h0, w0 = orig_shape
+    r = min(new_shape[0] / h0, new_shape[1] / w0)
+    new_w, new_h = int(round(w0 * r)), int(round(h0 * r))
+    dw, dh = (new_shape[1] - new_w) / 2, (new_shape[0] - new_h) / 2
+    if image.shape[:2] != (new_h, new_w):
+        image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.BILINEAR))
+
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+    if out is None:
+        out = np.empty((new_shape[0], new_shape[1], 3), dtype=np.uint8)
+    out[:top] = color
+    out[top + new_h:] = color
+    out[top:top + new_h, :left] = color
+    out[top:top + new_h, left + new_w:] = color
+    out[top:top + new_h, left:left + new_w] = image
+    return out, r, (left, top)
+
+
+def load_letterboxed(source, imgsz, out=None):
+    """路径或 RGB 数组 -> (画布, 缩放比例, 填充, 原图尺寸)，路径输入走缩小解码"""
+    if isinstance(source, str):
+        image, orig_shape = open_image(source, _as_hw(imgsz))
+    else:
+        image, orig_shape = source, source.shape[:2]
+    canvas, ratio, pad = letterbox_into(image, orig_shape, imgsz, out)
+    return canvas, ratio, pad, orig_shape
+
+
+def load_resized(source, imgsz):
+    """路径或 RGB 数组 -> (最长边不超过 imgsz 的图像, 相对原图的缩放比例, 原图尺寸)，不填充"""
+    from PIL import Image
+
+    if isinstance(source, str):
+        image, orig_shape = open_image(source, _as_hw(imgsz))
+    else:
+        image, orig_shape = source, source.shape[:2]
+    h0, w0 = orig_shape
+    r = min(1.0, min(_as_hw(imgsz)[0] / h0, _as_hw(imgsz)[1] / w0))
+    new_w, new_h = int(round(w0 * r)), int(round(h0 * r))
+    if image.shape[:2] != (new_h, new_w):
+        image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.BILINEAR))
+    return image, r, orig_shape
+
+
+class BatchBuffer:
+    """(batch, h, w, 3) 的可复用输入缓冲区，batch 变大时才重新分配"""
+
+    def __init__(self, imgsz):
+        self.shape = _as_hw(imgsz)
+        self.array = np.empty((0, *self.shape, 3), dtype=np.uint8)
+
+    def get(self, batch):
+        if len(self.array) < batch:
+            self.array = np.empty((batch, *self.shape, 3), dtype=np.uint8)
+        return self.array[:batch]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 图片读取耗时对比")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    from inference_backends import letterbox, load_image
+
+    for path in args.images:
+        timings = {}
+        for name, fn in (("full", lambda: letterbox(load_image(path), args.imgsz)),
+                         ("reduced", lambda: load_letterboxed(path, args.imgsz))):
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                fn()
+            timings[name] = (time.perf_counter() - started) * 1000 / args.runs
+        print(f"🖼️ {path}: 完整解码 {timings['full']:.1f} ms，缩小解码 {timings['reduced']:.1f} ms "
+              f"({timings['full'] / max(timings['reduced'], 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 可插拔推理后端
+优先使用 export_model() 导出的 OpenVINO / ONNX 模型，通过 ONNX Runtime 或 OpenVINO 在 CPU 上推理；
+预处理（letterbox、归一化）和 NMS 用 NumPy 实现，不需要导入 torch。
+没有可用的导出模型或运行时时回退到 ultralytics 加载 best.pt。
+
+所有后端的 predict() 返回相同结构，每张图片一个字典:
+    {"xyxy": (N, 4) float32, "conf": (N,) float32, "cls": (N,) int64}
+
+prepare() 只做解码和预处理（可以在线程池中并行），predict_prepared() 只做前向推理和后处理，
+批量推理流水线用这两步把图片解码与模型计算重叠起来。JPEG 按模型输入尺寸缩小解码（见 image_io.py），
+predict() 在每张图片的结果中附带 decode_ms（解码 + 缩放耗时）。
+"""
+
+import os
+import ast
+import sys
+import json
+import time
+import threading
+
+import numpy as np
+
+from image_io import BatchBuffer, load_letterboxed, load_resized
+
+# 自动选择时的优先级（越靠前越快）
+BACKEND_PRIORITY = ["openvino", "onnxruntime", "ultralytics"]
+
+
+# =============================================================================
+# NumPy 预处理与后处理
+# =============================================================================
+
+def load_image(image_path):
+    """读取图片为 RGB uint8 数组"""
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def letterbox(image, new_shape=640, color=114):
+    """等比缩放并居中填充到 new_shape，返回 (图像, 缩放比例, (左填充, 上填充))，与 ultralytics 的 LetterBox 一致"""
+    from PIL import Image
+
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    h, w = image.shape[:2]
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (new_shape[1] - new_w) / 2, (new_shape[0] - new_h) / 2
+
+    if (w, h) != (new_w, new_h):
+        image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.BILINEAR))
+
+    top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+    canvas = np.full((new_shape[0], new_shape[1], 3), color, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = image
+    return canvas, r, (left, top)
+
+
+def to_input_tensor(images, dtype=np.float32):
+    """NHWC uint8 -> NCHW 归一化到 [0, 1]"""
+    batch = np.stack(images) if isinstance(images, (list, tuple)) else images
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2)).astype(dtype) / 255.0
+
+
+def xywh2xyxy(boxes):
+    out = np.empty_like(boxes)
+    half_w, half_h = boxes[:, 2] / 2, boxes[:, 3] / 2
+    out[:, 0] = boxes[:, 0] - half_w
+    out[:, 1] = boxes[:, 1] - half_h
+    out[:, 2] = boxes[:, 0] + half_w
+    out[:, 3] = boxes[:, 1] + half_h
+    return out
+
+
+def box_iou(box, boxes):
+    """一个框与一组框的 IoU"""
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area + areas - inter + 1e-9)
+
+
+def nms(boxes, scores, iou_thres=0.7):
+    """贪心 NMS，返回保留框的下标（按分数降序）"""
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        ious = box_iou(boxes[i], boxes[order[1:]])
+        order = order[1:][ious <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def empty_prediction():
+    return {
+        "xyxy": np.zeros((0, 4), dtype=np.float32),
+        "conf": np.zeros((0,), dtype=np.float32),
+        "cls": np.zeros((0,), dtype=np.int64),
+    }
+
+
+def postprocess(output, conf=0.25, iou=0.7, max_det=300, max_nms=30000, max_wh=7680):
+    """
+    YOLOv8 原始输出 (4 + nc, anchors) -> 检测结果
+    按类别偏移框坐标后做一次 NMS，等价于 ultralytics 的非类别无关 NMS
+    """
+    pred = output.T  # (anchors, 4 + nc)
+    scores_all = pred[:, 4:]
+    cls = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(cls)), cls]
+    mask = scores > conf
+    if not mask.any():
+        return empty_prediction()
+
+    boxes = xywh2xyxy(pred[mask, :4])
+    scores, cls = scores[mask], cls[mask]
+    if len(scores) > max_nms:
+        top = scores.argsort()[::-1][:max_nms]
+        boxes, scores, cls = boxes[top], scores[top], cls[top]
+
+    keep = nms(boxes + cls[:, None] * max_wh, scores, iou)[:max_det]
+    return {
+        "xyxy": boxes[keep].astype(np.float32),
+        "conf": scores[keep].astype(np.float32),
+        "cls": cls[keep].astype(np.int64),
+    }
+
+
+def scale_boxes(xyxy, ratio, pad, orig_shape):
+    """把 letterbox 坐标映射回原图并裁剪到图像范围内"""
+    boxes = xyxy.copy()
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes
+
+
+def prepare_timed(backend, images, buffer=None):
+    """逐张 prepare 并计时，返回 (prepared 列表, 每张的毫秒数)；buffer 为 (batch, h, w, 3) 时写入其中"""
+    prepared, decode_ms = [], []
+    for index, image in enumerate(images):
+        started = time.perf_counter()
+        if buffer is None:
+            prepared.append(backend.prepare(image))
+        else:
+            prepared.append(backend.prepare(image, out=buffer[index]))
+        decode_ms.append((time.perf_counter() - started) * 1000)
+    return prepared, decode_ms
+
+
+def parse_names(names):
+    """导出模型元数据中的 names 可能是字符串形式的字典"""
+    if isinstance(names, str):
+        names = ast.literal_eval(names)
+    if isinstance(names, (list, tuple)):
+        names = dict(enumerate(names))
+    return {int(k): v for k, v in (names or {}).items()}
+
+
+# =============================================================================
+# 后端实现
+# =============================================================================
+
+class NumpyBackend:
+    """ONNX Runtime / OpenVINO 共用的预处理、批处理和后处理逻辑"""
+
+    name = "numpy"
+
+    def __init__(self, model_path, imgsz=640, names=None, batch_size=1, input_dtype=np.float32):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.names = parse_names(names)
+        self.batch_size = batch_size  # None 表示动态 batch
+        self.input_dtype = input_dtype
+        self._buffers = threading.local()
+
+    def run(self, tensor):
+        """执行前向推理，返回 (batch, 4 + nc, anchors)"""
+        raise NotImplementedError
+
+    def prepare(self, image, out=None):
+        """缩小解码 + letterbox（可写入 out），返回 (输入图像, 缩放比例, 填充, 原图尺寸)"""
+        return load_letterboxed(image, self.imgsz, out)
+
+    def predict_prepared(self, prepared, conf=0.25, iou=0.7, max_det=300):
+        outputs = []
+        step = self.batch_size or len(prepared)
+        for start in range(0, len(prepared), step):
+            chunk = [p[0] for p in prepared[start:start + step]]
+            outputs.extend(self.run(to_input_tensor(chunk, self.input_dtype)))
+
+        predictions = []
+        for output, (_, ratio, pad, orig_shape) in zip(outputs, prepared):
+            pred = postprocess(np.asarray(output, dtype=np.float32), conf=conf, iou=iou, max_det=max_det)
+            pred["xyxy"] = scale_boxes(pred["xyxy"], ratio, pad, orig_shape)
+            predictions.append(pred)
+        return predictions
+
+    def predict(self, images, conf=0.25, iou=0.7, max_det=300):
+        """images 可以是路径或 RGB 数组；预处理结果写入本线程复用的输入缓冲区"""
+        images = list(images)
+        if not hasattr(self._buffers, "batch"):
+            self._buffers.batch = BatchBuffer(self.imgsz)
+        prepared, decode_ms = prepare_timed(self, images, self._buffers.batch.get(len(images)))
+        predictions = self.predict_prepared(prepared, conf=conf, iou=iou, max_det=max_det)
+        for pred, ms in zip(predictions, decode_ms):
+            pred["decode_ms"] = ms
+        return predictions
+
+
+class OnnxRuntimeBackend(NumpyBackend):
+    name = "onnxruntime"
+
+    def __init__(self, model_path, intra_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        imgsz = ast.literal_eval(metadata["imgsz"]) if "imgsz" in metadata else model_input.shape[2:]
+        batch = model_input.shape[0]
+        super().__init__(
+            model_path,
+            imgsz=tuple(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz,
+            names=metadata.get("names"),
+            batch_size=batch if isinstance(batch, int) else None,
+            input_dtype=np.float16 if model_input.type == "tensor(float16)" else np.float32,
+        )
+
+    def run(self, tensor):
+        return self.session.run(None, {self.input_name: tensor})[0]
+
+
+class OpenVinoBackend(NumpyBackend):
+    name = "openvino"
+
+    def __init__(self, model_path, intra_op_threads=None):
+        try:
+            import openvino as ov
+            core = ov.Core()
+        except (ImportError, AttributeError):
+            from openvino.runtime import Core
+            core = Core()
+
+        xml_path = model_path
+        if os.path.isdir(model_path):
+            xml_path = next(os.path.join(model_path, f) for f in os.listdir(model_path) if f.endswith(".xml"))
+        config = {"INFERENCE_NUM_THREADS": intra_op_threads} if intra_op_threads else {}
+        model = core.read_model(xml_path)
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.output = self.compiled.output(0)
+
+        metadata = {}
+        metadata_path = os.path.join(os.path.dirname(xml_path), "metadata.yaml")
+        if os.path.exists(metadata_path):
+            import yaml
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = yaml.safe_load(f) or {}
+        input_shape = model.input(0).get_partial_shape()
+        batch = input_shape[0].get_length() if input_shape[0].is_static else None
+        imgsz = metadata.get("imgsz") or [input_shape[2].get_length(), input_shape[3].get_length()]
+        super().__init__(
+            model_path,
+            imgsz=tuple(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz,
+            names=metadata.get("names"),
+            batch_size=batch,
+        )
+
+    def run(self, tensor):
+        return self.compiled(tensor)[self.output]
+
+
+class UltralyticsBackend:
+    """回退方案：ultralytics 加载 .pt / TorchScript"""
+
+    name = "ultralytics"
+
+    def __init__(self, model_path, intra_op_threads=None):
+        if intra_op_threads:
+            import torch
+            torch.set_num_threads(intra_op_threads)
+        from ultralytics import YOLO
+
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        self.names = parse_names(self.model.names)
+        self.imgsz = self.model.overrides.get("imgsz") or 640
+
+    def prepare(self, image, out=None):
+        """缩小解码并缩放到 imgsz 以内，转为 BGR（ultralytics 对数组输入按 BGR 处理，letterbox 由 ultralytics 完成）"""
+        resized, ratio, orig_shape = load_resized(image, self.imgsz)
+        return np.ascontiguousarray(resized[..., ::-1]), ratio, orig_shape
+
+    def predict_prepared(self, prepared, conf=0.25, iou=0.7, max_det=300):
+        results = self.model([p[0] for p in prepared], conf=conf, iou=iou, max_det=max_det,
+                             batch=len(prepared), save=False, verbose=False)
+        predictions = []
+        for result, (_, ratio, orig_shape) in zip(results, prepared):
+            if getattr(result, "boxes", None) is None:
+                predictions.append(empty_prediction())
+                continue
+            boxes = result.boxes
+            xyxy = boxes.xyxy.cpu().numpy().astype(np.float32) / ratio  # 映射回原图
+            xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, orig_shape[1])
+            xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, orig_shape[0])
+            predictions.append({
+                "xyxy": xyxy,
+                "conf": boxes.conf.cpu().numpy().astype(np.float32),
+                "cls": boxes.cls.cpu().numpy().astype(np.int64),
+            })
+        return predictions
+
+    def predict(self, images, conf=0.25, iou=0.7, max_det=300):
+        prepared, decode_ms = prepare_timed(self, list(images))
+        predictions = self.predict_prepared(prepared, conf=conf, iou=iou, max_det=max_det)
+        for pred, ms in zip(predictions, decode_ms):
+            pred["decode_ms"] = ms
+        return predictions
+
+
+BACKENDS = {
+    "openvino": OpenVinoBackend,
+    "onnxruntime": OnnxRuntimeBackend,
+    "ultralytics": UltralyticsBackend,
+}
+
+RUNTIME_MODULES = {
+    "openvino": "openvino",
+    "onnxruntime": "onnxruntime",
+    "ultralytics": "ultralytics",
+}
+
+
+# =============================================================================
+# 导出模型发现与后端选择
+# =============================================================================
+
+def runtime_available(backend):
+    import importlib.util
+    return importlib.util.find_spec(RUNTIME_MODULES[backend]) is not None
+
+
+def artifact_path(entry):
+    """exported_models 的条目可以是路径，或 export_stage 写入的 {"path": ..., "duration_s": ...}"""
+    if isinstance(entry, dict):
+        return entry.get("path")
+    return entry
+
+
+def artifact_mtime(path):
+    """文件的 mtime；目录（OpenVINO 导出）取其中最新文件的 mtime"""
+    if os.path.isdir(path):
+        return max((os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)), default=os.path.getmtime(path))
+    return os.path.getmtime(path)
+
+
+def find_artifacts(model_path, exported_models=None):
+    """
+    查找 best.pt 对应的导出模型（export_model() 默认写在权重旁边），
+    返回 {后端名: 模型路径}。比 best.pt 旧的导出模型（重新训练后尚未重新导出）不使用
+    """
+    stem, _ = os.path.splitext(model_path)
+    exported_models = exported_models or {}
+    artifacts = {}
+    weights_mtime = os.path.getmtime(model_path) if os.path.isfile(model_path) else None
+
+    def fresh(path):
+        return weights_mtime is None or artifact_mtime(path) >= weights_mtime
+
+    openvino_dir = artifact_path(exported_models.get("openvino")) or f"{stem}_openvino_model"
+    if os.path.isdir(openvino_dir) and fresh(openvino_dir):
+        artifacts["openvino"] = openvino_dir
+    onnx_path = artifact_path(exported_models.get("onnx")) or f"{stem}.onnx"
+    if os.path.isfile(onnx_path) and fresh(onnx_path):
+        artifacts["onnxruntime"] = onnx_path
+    if model_path.endswith(".onnx"):
+        artifacts["onnxruntime"] = model_path
+    if os.path.isfile(model_path) and not model_path.endswith(".onnx"):
+        artifacts["ultralytics"] = model_path
+    return artifacts
+
+
+def serving_candidates(model_path, backend="auto", exported_models=None):
+    """[(后端名, 模型路径)]，按优先级排列，只包含运行时已安装的后端；第一个就是实际会使用的模型"""
+    artifacts = find_artifacts(model_path, exported_models)
+    candidates = BACKEND_PRIORITY if backend == "auto" else [backend]
+    return [(name, artifacts[name]) for name in candidates if name in artifacts and runtime_available(name)]
+
+
+def load_backend(model_path, backend="auto", exported_models=None, intra_op_threads=None):
+    """按优先级加载最快可用的后端；加载失败时继续尝试下一个"""
+    artifacts = find_artifacts(model_path, exported_models)
+    candidates = BACKEND_PRIORITY if backend == "auto" else [backend]
+
+    errors = []
+    for name in candidates:
+        if name not in artifacts:
+            continue
+        if not runtime_available(name):
+            errors.append(f"{name}: 未安装 {RUNTIME_MODULES[name]}")
+            continue
+        try:
+            return BACKENDS[name](artifacts[name], intra_op_threads=intra_op_threads)
+        except Exception as e:
+            errors.append(f"{name}: {type(e).__name__}: {e}")
+            print(f"⚠️ {name} 后端加载失败，尝试下一个: {e}", file=sys.stderr)
+
+    if not artifacts:
+        raise FileNotFoundError(f"模型文件不存在: {model_path}")
+    raise RuntimeError("没有可用的推理后端: " + "; ".join(errors or [f"{backend}: 没有对应的模型文件"]))
+
+
+def main():
+    """命令行快速测试: python inference_backends.py best.pt image.jpg [backend]"""
+    if len(sys.argv) < 3:
+        print("用法: python inference_backends.py <模型路径> <图片路径> [auto|openvino|onnxruntime|ultralytics]")
+        sys.exit(1)
+    backend = load_backend(sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else "auto")
+    pred = backend.predict([sys.argv[2]])[0]
+    print(f"🤖 后端: {backend.name} ({backend.model_path})")
+    print(json.dumps({k: v.tolist() if hasattr(v, "tolist") else v for k, v in pred.items()}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
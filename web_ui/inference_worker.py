@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 常驻推理进程
+模型只加载一次并常驻内存，通过 stdin/stdout JSON Lines 协议接收推理请求
+推理后端由 inference_backends 选择（OpenVINO / ONNX Runtime 优先，回退到 ultralytics）
+
+请求 (每行一个 JSON):
+    {"id": "1", "image_path": "uploads/xxx.jpg", "conf": 0.25}
+    {"id": "1", "image_path": "uploads/xxx.jpg", "sliced": true}    # 高分辨率图片切片推理（见 sliced_inference.py）
+    {"id": "1", "image_path": "uploads/xxx.jpg", "format": "columnar"}   # 列式结果（拥挤图片）
+    {"id": "2", "cmd": "ping"}
+    {"id": "3", "cmd": "reload"}
+    {"id": "4", "cmd": "stats"}
+    {"id": "5", "cmd": "shutdown"}
+
+并发到达的推理请求由 MicroBatcher 合并成一次批量前向推理，响应顺序不保证与请求顺序一致，
+调用方按 id 匹配。相同图片内容 + 模型 + 阈值的请求直接从 DetectionCache 返回（响应带 "cached": true）。
+
+响应 (每行一个 JSON，与原推理脚本的输出格式一致，额外带上 id):
+    {"id": "1", "success": true, "detections": [...], "nutrition_missing": [...], "model_path": "..."}
+每个检测结果的 nutrition 字段从模型旁的营养表（nutrition_table.py）查询，表中没有的类别列在 nutrition_missing 中。
+format 为 columnar 时用 "columns": {"class": [...], "class_id": [...], "confidence": [...], "bbox": [x, y, w, h, ...]}
+代替 detections，营养信息按类别放在 "nutrition": {类别: {...}} 中。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+
+from batch_scheduler import MicroBatcher
+from inference_backends import artifact_mtime, load_backend, serving_candidates
+from detection_cache import DetectionCache
+from detection_results import columns_to_detections, columns_to_json, detection_columns
+from session_store import SessionStore
+from nutrition_table import fill_nutrition, load_table_for_model, lookup_classes
+from sliced_inference import MERGE_MODES, sliced_predict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SESSION_FILE = os.path.join(BASE_DIR, "data", "training_sessions.json")
+DEFAULT_CONF = 0.25
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT_MS = 10.0
+DEFAULT_CACHE_ENTRIES = 1024
+DEFAULT_CACHE_MAX_MB = 256
+# 切片参数的允许范围：tile 过小或重叠接近 1 时窗口数量会暴增，阻塞常驻进程
+SLICE_TILE_RANGE = (128, 2048)
+SLICE_MAX_OVERLAP = 0.9
+
+
+def resolve_model_path(model_path):
+    """相对路径按项目根目录解析（与 server.js 的规则一致）"""
+    if os.path.isabs(model_path):
+        return model_path
+    return os.path.normpath(os.path.join(BASE_DIR, "..", model_path))
+
+
+def find_latest_model(session_file):
+    """从训练会话索引中找出最新完成的模型路径"""
+    try:
+        latest = SessionStore(session_file).latest_completed()
+    except Exception:
+        return None
+    if not latest:
+        return None
+    # 量化后被选为首选的部署模型优先
+    serving_path = latest.get("serving_model_path")
+    if serving_path and os.path.exists(resolve_model_path(serving_path)):
+        return resolve_model_path(serving_path)
+    return resolve_model_path(latest["best_model_path"])
+
+
+def build_detections(prediction, names, conf=0.0):
+    """把后端返回的检测数组转换为接口返回的检测列表（过滤和坐标转换整体向量化，见 detection_results.py）"""
+    return columns_to_detections(detection_columns(prediction, names, conf))
+
+
+class ModelManager:
+    """
+    持有常驻模型；训练会话指向新模型、权重文件更新或实际使用的导出模型变化（重新导出 / 旧导出失效）时热替换
+    """
+
+    def __init__(self, session_file=DEFAULT_SESSION_FILE, model_path=None, check_interval=2.0, backend="auto"):
+        self.session_file = session_file
+        self.pinned_path = model_path
+        self.backend = backend
+        self.check_interval = check_interval
+        self.model = None
+        self.model_path = None
+        self.model_signature = None
+        self._latest_path = None
+        self._session_mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _session_changed(self):
+        """按间隔检查会话索引和 Node 会话文件的 mtime，避免每个请求都读取会话"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        mtime = tuple(os.path.getmtime(p) if os.path.exists(p) else None
+                      for p in (self.session_file, SessionStore(self.session_file).index_file))
+        if mtime == self._session_mtime or mtime == (None, None):
+            return False
+        self._session_mtime = mtime
+        return True
+
+    def _target_path(self, requested_path=None):
+        if requested_path:
+            return resolve_model_path(requested_path)
+        if self.pinned_path:
+            return resolve_model_path(self.pinned_path)
+        if self._latest_path is None or self._session_changed():
+            latest = find_latest_model(self.session_file)
+            if latest:
+                self._latest_path = latest
+        return self._latest_path
+
+    def resolve(self, requested_path=None):
+        """返回请求将使用的模型路径（不加载模型）"""
+        with self._lock:
+            return self._target_path(requested_path)
+
+    def _signature(self, path):
+        """权重文件和按优先级可用的导出模型（路径 + mtime），任一变化都需要重新加载"""
+        weights_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        return (weights_mtime, tuple((name, artifact, artifact_mtime(artifact))
+                                     for name, artifact in serving_candidates(path, self.backend)))
+
+    def served_path(self, path):
+        """path 对应的实际推理模型（导出模型或权重本身），检测缓存以它为准"""
+        with self._lock:
+            if self.model is not None and path == self.model_path and self._signature(path) == self.model_signature:
+                return self.model.model_path
+            candidates = serving_candidates(path, self.backend)
+            return candidates[0][1] if candidates else path
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"模型文件不存在: {path}")
+        started = time.perf_counter()
+        model = load_backend(path, self.backend)
+        print(f"🤖 模型已加载: {model.model_path} [{model.name}] ({time.perf_counter() - started:.2f}s)", file=sys.stderr)
+        return model
+
+    def get(self, requested_path=None):
+        """返回当前模型；目标路径、权重或导出模型变化时先加载新模型再替换"""
+        with self._lock:
+            path = self._target_path(requested_path)
+            if path is None:
+                raise FileNotFoundError("未找到训练好的模型，请先完成模型训练")
+            signature = self._signature(path)
+            if self.model is None or path != self.model_path or signature != self.model_signature:
+                # 新模型加载失败时保留旧模型继续服务
+                self.model = self._load(path)
+                self.model_path = path
+                self.model_signature = signature
+            return self.model, self.model_path
+
+    def reload(self):
+        """强制重新解析会话记录并加载模型"""
+        with self._lock:
+            self._session_mtime = None
+            self._last_check = 0.0
+            self.model_signature = None
+        return self.get()
+
+
+def _sliced_options(value):
+    """请求中的 sliced: true 或 {"tile": 640, "overlap": 0.2, "merge": "wbf"}；未启用时返回 None"""
+    if not value:
+        return None
+    options = value if isinstance(value, dict) else {}
+    checked = {}
+    if "tile" in options:
+        tile = int(options["tile"])
+        if not SLICE_TILE_RANGE[0] <= tile <= SLICE_TILE_RANGE[1]:
+            raise ValueError(f"tile 必须在 {SLICE_TILE_RANGE[0]}~{SLICE_TILE_RANGE[1]} 之间: {tile}")
+        checked["tile"] = tile
+    if "overlap" in options:
+        overlap = float(options["overlap"])
+        if not 0 <= overlap < SLICE_MAX_OVERLAP:
+            raise ValueError(f"overlap 必须满足 0 <= overlap < {SLICE_MAX_OVERLAP}: {overlap}")
+        checked["overlap"] = overlap
+    if "merge" in options:
+        if options["merge"] not in MERGE_MODES:
+            raise ValueError(f"merge 只支持 {', '.join(MERGE_MODES)}: {options['merge']}")
+        checked["merge"] = options["merge"]
+    return checked
+
+
+def error_response(e):
+    """把异常转换为与原推理脚本一致的错误响应"""
+    if isinstance(e, FileNotFoundError):
+        return {"success": False, "error": str(e)}
+    if isinstance(e, ImportError):
+        return {"success": False, "error": f"导入错误: {str(e)}. 请确保已安装ultralytics 或 onnxruntime: pip install ultralytics onnxruntime"}
+    return {
+        "success": False,
+        "error": f"{type(e).__name__}: {str(e)}",
+        "traceback": "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+    }
+
+
+class InferenceWorker:
+    """JSON Lines 协议处理；推理请求经过微批处理调度器"""
+
+    def __init__(self, manager, out=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 cache=None):
+        self.manager = manager
+        self.cache = cache
+        self.out = out or sys.stdout
+        self._write_lock = threading.Lock()
+        self.batcher = MicroBatcher(self.predict_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.batcher.start()
+
+    def send(self, payload):
+        line = json.dumps(payload, ensure_ascii=False)
+        with self._write_lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def predict_batch(self, items):
+        """同一模型的请求合并成一次前向推理；每个调用方只拿到自己那张图片的检测结果"""
+        results = [None] * len(items)
+        groups = {}
+        for index, item in enumerate(items):
+            if not os.path.exists(item["image_path"]):
+                results[index] = FileNotFoundError(f"图片文件不存在: {item['image_path']}")
+                continue
+            groups.setdefault(item.get("model_path"), []).append(index)
+
+        for model_path, indices in groups.items():
+            try:
+                model, used_path = self.manager.get(model_path)
+                predictions = {}
+                plain = [i for i in indices if items[i].get("sliced") is None]
+                if plain:
+                    # 用本批最低的置信度阈值推理，再按各请求自己的阈值过滤
+                    conf = min(items[i]["conf"] for i in plain)
+                    predictions.update(zip(plain, model.predict([items[i]["image_path"] for i in plain], conf=conf)))
+                for i in indices:
+                    if items[i].get("sliced") is not None:
+                        # 一张图片的所有 tile 作为一个 batch 推理
+                        predictions[i] = sliced_predict(model, items[i]["image_path"], conf=items[i]["conf"],
+                                                        **items[i]["sliced"])
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+                continue
+            table = load_table_for_model(used_path)
+            for i in indices:
+                prediction = predictions[i]
+                columns = detection_columns(prediction, model.names, items[i]["conf"])
+                results[i] = {"success": True, "model_path": used_path, "backend": model.name,
+                              "timing": {"decode_ms": prediction.get("decode_ms")}}
+                if items[i]["columnar"]:
+                    nutrition, missing = lookup_classes(columns["class"].tolist(), table)
+                    results[i].update(columns=columns_to_json(columns), nutrition=nutrition)
+                else:
+                    detections = columns_to_detections(columns)
+                    missing = fill_nutrition(detections, table)
+                    results[i]["detections"] = detections
+                results[i]["nutrition_missing"] = missing
+        return results
+
+    def _cache_lookup(self, item):
+        """返回 (缓存键, 缓存结果)；无法计算键时不使用缓存"""
+        if self.cache is None or not os.path.exists(item["image_path"]):
+            return None, None
+        try:
+            model_path = self.manager.resolve(item["model_path"])
+            if not model_path or not os.path.exists(model_path):
+                return None, None
+            variant = f"sliced:{json.dumps(item['sliced'], sort_keys=True)}" if item["sliced"] is not None else ""
+            if item["columnar"]:
+                variant += "|columnar"
+            # 以实际推理的导出模型为键：重新导出或旧导出失效后不会命中旧结果
+            key = self.cache.make_key(item["image_path"], self.manager.served_path(model_path), item["conf"], variant)
+        except OSError:
+            return None, None
+        return key, self.cache.get(key)
+
+    def _reply(self, request_id, future, cache_key=None):
+        try:
+            response = future.result()
+            if cache_key is not None:
+                self.cache.put(cache_key, response)
+        except Exception as e:
+            response = error_response(e)
+        self.send(dict(response, id=request_id))
+
+    def handle(self, request):
+        """处理一条请求，返回是否继续运行"""
+        request_id = request.get("id")
+        cmd = request.get("cmd", "predict")
+        try:
+            if cmd == "predict":
+                item = {
+                    "image_path": request["image_path"],
+                    "conf": float(request.get("conf", DEFAULT_CONF)),
+                    "model_path": request.get("model_path"),
+                    "sliced": _sliced_options(request.get("sliced")),
+                    "columnar": request.get("format") == "columnar",
+                }
+                cache_key, cached = self._cache_lookup(item)
+                if cached is not None:
+                    self.send(dict(cached, id=request_id, cached=True))
+                    return True
+                future = self.batcher.submit(item)
+                future.add_done_callback(lambda f: self._reply(request_id, f, cache_key))
+                return True
+            if cmd == "ping":
+                response = {"success": True, "model_path": self.manager.model_path}
+            elif cmd == "reload":
+                _, path = self.manager.reload()
+                response = {"success": True, "model_path": path}
+            elif cmd == "stats":
+                response = {
+                    "success": True,
+                    "stats": self.batcher.stats.snapshot(),
+                    "cache": self.cache.stats() if self.cache is not None else None,
+                }
+            elif cmd == "shutdown":
+                self.batcher.stop()
+                self.send({"id": request_id, "success": True})
+                return False
+            else:
+                response = {"success": False, "error": f"未知命令: {cmd}"}
+        except Exception as e:
+            response = error_response(e)
+        response["id"] = request_id
+        self.send(response)
+        return True
+
+    def serve(self, stream=None):
+        """逐行读取请求直到 stdin 关闭或收到 shutdown"""
+        stream = stream or sys.stdin
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.send({"id": None, "success": False, "error": f"请求解析失败: {e}"})
+                continue
+            if not self.handle(request):
+                return
+        # stdin 关闭：处理完队列中剩余的请求再退出
+        self.batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 常驻推理进程")
+    parser.add_argument("--sessions", default=DEFAULT_SESSION_FILE, help="训练会话记录文件")
+    parser.add_argument("--model", default=None, help="固定使用的模型路径（不随训练会话热替换）")
+    parser.add_argument("--backend", default="auto", choices=["auto", "openvino", "onnxruntime", "ultralytics"],
+                        help="推理后端（auto 选择最快的可用导出模型）")
+    parser.add_argument("--no-preload", action="store_true", help="启动时不预加载模型")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="单次前向推理最多合并的图片数")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="凑批的最长等待时间（毫秒）")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES, help="内存缓存条目数（0 关闭缓存）")
+    parser.add_argument("--cache-dir", default=None, help="磁盘缓存目录（不指定则只用内存缓存）")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help="磁盘缓存大小上限")
+    args = parser.parse_args()
+
+    if hasattr(sys.stdin, 'reconfigure'):
+        sys.stdin.reconfigure(encoding='utf-8')
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    # stdout 只用于协议输出，其它打印（包括第三方库日志）全部转到 stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    manager = ModelManager(session_file=args.sessions, model_path=args.model, backend=args.backend)
+    cache = None
+    if args.cache_entries > 0:
+        cache = DetectionCache(max_entries=args.cache_entries, cache_dir=args.cache_dir, max_disk_mb=args.cache_max_mb)
+    worker = InferenceWorker(manager, out=protocol_out,
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, cache=cache)
+
+    if not args.no_preload:
+        try:
+            manager.get()
+        except Exception as e:
+            print(f"⚠️ 模型预加载失败，将在首个请求时重试: {e}", file=sys.stderr)
+
+    worker.send({"id": None, "event": "ready", "model_path": manager.model_path})
+    worker.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,101 +13,201 @@ import json
 from datetime import datetime
 import uuid
 
-def download_roboflow_dataset():
-    """从 Roboflow 下载数据集"""
+from session_store import SessionStore
+
+SESSION_FILE = os.path.join("data", "training_sessions.json")
+
+ROBOFLOW_WORKSPACE = "malaysian-food-detection"
+ROBOFLOW_PROJECT = "malaysian-food-detection-wy3kt"
+ROBOFLOW_VERSION = 2
+
+TRAINING_PROJECT = "nutriscan_training"
+SAVE_PERIOD = 10  # 每隔多少轮额外保存 epochN.pt（last.pt 每轮都会更新）
+
+def download_roboflow_dataset(version=ROBOFLOW_VERSION, offline=False):
+    """从 Roboflow 同步数据集（本地已有则直接复用，新版本只下载变化的文件）"""
     try:
-        from roboflow import Roboflow
+        from dataset_store import DatasetStore
         
         print("🔗 连接到 Roboflow...")
-        rf = Roboflow(api_key="BwTemPbP39LHLFH4teds")
-        project = rf.workspace("malaysian-food-detection").project("malaysian-food-detection-wy3kt")
-        
-        print("📥 下载数据集版本 2...")
-        dataset = project.version(2).download("yolov8")
+        print(f"📥 同步数据集版本 {version}...")
+        location, _ = DatasetStore().sync(
+            ROBOFLOW_WORKSPACE,
+            ROBOFLOW_PROJECT,
+            version,
+            api_key=os.environ.get("ROBOFLOW_API_KEY", "BwTemPbP39LHLFH4teds"),
+            offline=offline
+        )
         
-        print(f"✅ 数据集下载完成: {dataset.location}")
-        return dataset.location
+        print(f"✅ 数据集下载完成: {location}")
+        return location
         
     except Exception as e:
         print(f"❌ Roboflow 下载失败: {e}")
         return None
 
-def train_model(dataset_path, epochs=100, batch=16, imgsz=640):
-    """训练 YOLOv8 模型"""
+def build_trainer(image_cache=True, profile=False, checkpoint=True, sampling=False, teacher_cache=None,
+                  pruned=False):
+    """
+    按启用的功能组合 DetectionTrainer 的 mixin（teacher_cache: 教师预测缓存，见 distillation.py；
+    pruned: 训练剪枝后的模型结构，见 pruning.py）
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    
+    mixins = []
+    if pruned:
+        from pruning import PruningTrainerMixin
+        mixins.append(PruningTrainerMixin)
+    if checkpoint:
+        from training_checkpoint import CheckpointTrainerMixin
+        mixins.append(CheckpointTrainerMixin)
+    if teacher_cache:
+        from distillation import DistillationTrainerMixin
+        mixins.append(DistillationTrainerMixin)
+    if sampling:
+        from sampling import SamplingTrainerMixin
+        mixins.append(SamplingTrainerMixin)
+    if profile:
+        from training_profiler import ProfilerTrainerMixin
+        mixins.append(ProfilerTrainerMixin)
+    if image_cache:
+        from image_cache import ImageCacheTrainerMixin
+        mixins.append(ImageCacheTrainerMixin)
+    if not mixins:
+        return None
+    return type("NutriScanTrainer", (*mixins, DetectionTrainer), {"teacher_cache": teacher_cache})
+
+def train_model(dataset_path, epochs=100, batch=16, imgsz=640, image_cache=True, profile=False, sampling=False,
+                resume=True, save_period=SAVE_PERIOD, model_type="yolov8n", overrides=None, callbacks=None,
+                project=TRAINING_PROJECT, name=None, teacher_cache=None, weights=None, pruned=False):
+    """
+    训练 YOLOv8 模型（resume=True 时优先从同一数据集上未完成的训练恢复）
+    sampling=True 时按类别频率、验证混淆矩阵和难例损失加权采样训练图片（见 sampling.py）
+    teacher_cache: 缓存的教师预测，作为软标签蒸馏训练（见 distillation.py）
+    weights: 起始权重（默认 {model_type}.pt 预训练模型）；pruned=True 时保留其中剪枝后的结构（见 pruning.py）
+    overrides: 额外的 ultralytics 训练参数（lr0、mosaic 等）；callbacks: {事件名: 回调}
+    """
+    from training_checkpoint import TrainingInterrupted, find_resumable_run, install_signal_handlers
     
     # 检查数据集
     data_yaml = os.path.join(dataset_path, "data.yaml")
     if not os.path.exists(data_yaml):
         print(f"❌ 找不到 data.yaml: {data_yaml}")
-        return None
+        return None, None
     
-    print("🤖 初始化 YOLOv8 模型...")
-    model = YOLO('yolov8n.pt')  # 使用预训练模型
+    trainer = build_trainer(image_cache=image_cache, profile=profile, sampling=sampling, teacher_cache=teacher_cache,
+                            pruned=pruned)
+    restore_signals = install_signal_handlers()
+    try:
+        last_checkpoint = find_resumable_run(data_yaml, project) if resume else None
+        if last_checkpoint:
+            # 模型、EMA、优化器、学习率调度和训练参数都从检查点恢复
+            print(f"🔁 从检查点恢复训练: {last_checkpoint}")
+            model = YOLO(last_checkpoint)
+            _add_callbacks(model, callbacks)
+            results = model.train(trainer=trainer, resume=True)
+        else:
+            model = YOLO(weights or f'{model_type}.pt')  # 使用预训练模型
+            _add_callbacks(model, callbacks)
+            results = _train_new(model, data_yaml, trainer, dataset_path, epochs, batch, imgsz, image_cache,
+                                 profile, sampling, save_period, overrides or {}, project,
+                                 name or f'malaysian_food_{model_type}_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    except TrainingInterrupted as e:
+        print(f"🛑 {e}，重新运行本脚本即可继续训练")
+        return None, None
+    finally:
+        restore_signals()
     
+    print("✅ 训练完成!")
+    return model, results
+
+def _add_callbacks(model, callbacks):
+    for event, callback in (callbacks or {}).items():
+        model.add_callback(event, callback)
+
+def _train_new(model, data_yaml, trainer, dataset_path, epochs, batch, imgsz, image_cache, profile, sampling,
+               save_period, overrides, project, name):
+    """从预训练权重开始一次新的训练"""
     print("🚀 开始训练...")
     print(f"📊 训练参数:")
     print(f"  - 数据集: {dataset_path}")
     print(f"  - 轮次: {epochs}")
     print(f"  - 批次大小: {batch}")
     print(f"  - 图像尺寸: {imgsz}")
-    
+    print(f"  - 预解码图片缓存: {'启用' if image_cache else '关闭'}")
+    print(f"  - 训练吞吐分析: {'启用' if profile else '关闭'}")
+    print(f"  - 类别均衡 / 难例采样: {'启用' if sampling else '关闭'}")
+    print(f"  - 额外检查点间隔: {f'每 {save_period} 轮' if save_period > 0 else '关闭'}（last.pt 每轮都会更新）")
+    for key, value in overrides.items():
+        print(f"  - {key}: {value}")
+
     # 开始训练
-    results = model.train(
-        data=data_yaml,
-        epochs=epochs,
-        batch=batch,
-        imgsz=imgsz,
-        device='cpu',  # CPU (自动兼容无GPU环境)
-        project='nutriscan_training',
-        name=f'malaysian_food_yolov8n_{datetime.now().strftime("%Y%m%d_%H%M%S")}',
-        save=True,
-        plots=True
-    )
-    
-    print("✅ 训练完成!")
-    return model, results
+    results = model.train(trainer=trainer, project=project, name=name,
+                          **training_args(data_yaml, epochs, batch, imgsz, save_period, overrides))
+    return results
+
+def training_args(data_yaml, epochs=100, batch=16, imgsz=640, save_period=SAVE_PERIOD, overrides=None):
+    """新训练传给 model.train() 的参数（训练指纹也基于它计算，见 training_fingerprint.py）"""
+    return {
+        "data": data_yaml,
+        "epochs": epochs,
+        "batch": batch,
+        "imgsz": imgsz,
+        "device": 'cpu',  # CPU (自动兼容无GPU环境)
+        "save": True,
+        "save_period": save_period,
+        "plots": True,
+        **(overrides or {}),
+    }
 
-def validate_model(model, dataset_path):
-    """验证模型"""
+def _validation_weights(model):
+    """分片验证的工作进程按路径加载模型：训练结束后是 best.pt，否则是加载时的路径"""
+    trainer = getattr(model, "trainer", None)
+    if trainer is not None and os.path.exists(str(getattr(trainer, "best", ""))):
+        return str(trainer.best)
+    return getattr(model, "ckpt_path", None) or getattr(model, "model_name", None)
+
+def validate_model(model, dataset_path, layout=None):
+    """
+    验证模型。layout（或环境变量 VALIDATION_LAYOUT，如 "4x2"）指定时按 进程数x线程数 分片验证（见 sharded_inference.py），
+    返回的结果提供相同的 results_dict / box 指标，但没有混淆矩阵
+    """
     print("🔍 验证模型...")
     data_yaml = os.path.join(dataset_path, "data.yaml")
-    results = model.val(data=data_yaml)
+    layout = layout or os.environ.get("VALIDATION_LAYOUT")
+    weights = _validation_weights(model) if layout else None
+    if weights and os.path.exists(str(weights)):
+        from sharded_inference import ShardedValResults, parse_layout, resolve_split_images, validate_sharded
+
+        processes, threads = parse_layout(layout)
+        metrics, summary = validate_sharded(str(weights), dataset_path, processes, threads)
+        results = ShardedValResults(metrics, summary, resolve_split_images(dataset_path)[1])
+    else:
+        if layout:
+            print("⚠️ 找不到模型权重文件，回退到单进程验证")
+        results = model.val(data=data_yaml)
     print("✅ 验证完成!")
     return results
 
-def export_model(model):
-    """导出模型"""
-    print("📦 导出模型...")
-    
-    formats = ['onnx', 'torchscript', 'tflite']
-    exported = {}
-    
-    for fmt in formats:
-        try:
-            path = model.export(format=fmt)
-            exported[fmt] = path
-            print(f"✅ {fmt.upper()} 导出成功: {path}")
-        except Exception as e:
-            print(f"❌ {fmt.upper()} 导出失败: {e}")
-    
-    return exported
+def export_model(best_model_path, imgsz=640):
+    """导出模型（进程池并行，每种格式一个进程，记录耗时 / 大小 / 延迟，见 export_stage.py）"""
+    from export_stage import run_export_stage
+    return run_export_stage(str(best_model_path), imgsz=imgsz)
 
-def save_training_session(training_info, session_file):
-    os.makedirs(os.path.dirname(session_file), exist_ok=True)
-    # 加载原有会话列表
+def load_training_sessions(session_file):
+    """加载会话列表（追加日志 + Node 维护的 JSON 文件），读取失败时返回空字典"""
     try:
-        if os.path.exists(session_file):
-            with open(session_file, 'r', encoding='utf-8') as f:
-                sessions = json.load(f)
-        else:
-            sessions = {}
+        return SessionStore(session_file).all()
     except Exception:
-        sessions = {}
+        return {}
+
+def save_training_session(training_info, session_file):
+    """追加一条已完成的会话（只追加一行并更新索引，不重写历史）"""
     session_id = str(uuid.uuid4())
     now = datetime.now().isoformat()
-    sessions[session_id] = {
+    session = {
         "id": session_id,
-        "status": "completed",
+        "status": training_info.get("status", "completed"),
         "created_at": now,
         "updated_at": now,
         "dataset_id": "roboflow_downloaded",
@@ -117,32 +217,109 @@ def save_training_session(training_info, session_file):
         "exported_models": training_info.get("exported_models", {}),
         "validation_results": training_info.get("validation_results", ""),
     }
-    with open(session_file, 'w', encoding='utf-8') as f:
-        json.dump(sessions, f, ensure_ascii=False, indent=2)
-    print(f"📜 会话记录已同步到: {session_file}")
+    # 可选字段：量化报告、首选部署模型、训练吞吐分析、恢复谱系、数据集统计、蒸馏报告、离线营养表、训练指纹、剪枝报告
+    for key in ("quantization", "serving_model_path", "profile", "lineage", "dataset_stats", "distillation",
+                "nutrition_table", "training_fingerprint", "pruning"):
+        if training_info.get(key):
+            session[key] = training_info[key]
+    store = SessionStore(session_file)
+    store.add(session)
+    print(f"📜 会话记录已追加到: {store.log_file}")
+    return session_id
+
+def update_training_session(session_id, updates, session_file):
+    """更新已有会话的部分字段（追加一份新快照）"""
+    updates = {**updates, "updated_at": datetime.now().isoformat()}
+    if SessionStore(session_file).update(session_id, updates) is None:
+        print(f"❌ 会话不存在: {session_id}")
+        return False
+    print(f"📜 会话记录已更新: {session_id}")
+    return True
 
 def main():
     """主函数"""
     print("🎯 NutriScan MY - 本地训练开始")
     print("=" * 50)
     
-    # 1. 下载数据集
-    dataset_path = download_roboflow_dataset()
+    # 1. 下载数据集（ROBOFLOW_OFFLINE=1 时只使用本地已同步的数据集）
+    dataset_path = download_roboflow_dataset(offline=os.environ.get("ROBOFLOW_OFFLINE") == "1")
     if not dataset_path:
         print("❌ 无法下载数据集，退出")
         return
     
-    # 2. 训练模型
-    model, results = train_model(dataset_path)
+    # 数据集统计（按 manifest 缓存，数据集不变时不重新扫描标签）
+    dataset_stats = {}
+    try:
+        from dataset_stats import load_split_stats
+        stats = load_split_stats(dataset_path, "train")
+        dataset_stats = {"names": stats.names, **stats.summary()}
+        print(f"📊 训练集: {dataset_stats['images']} 张图片, {dataset_stats['instances']} 个目标, "
+              f"损坏标签 {dataset_stats['corrupt_labels']}")
+        rare = stats.under_represented()
+        if rare:
+            print(f"⚠️ 样本偏少的类别: {', '.join(rare)}")
+    except Exception as e:
+        print(f"⚠️ 数据集统计失败: {e}")
+    
+    # 训练指纹：参数、数据集、预训练权重和库版本都没变时复用已完成的会话（TRAINING_FORCE=1 时仍然训练）
+    sampling = os.environ.get("TRAINING_SAMPLING") == "1"
+    fingerprint = {}
+    try:
+        from training_fingerprint import find_memoized_session, training_fingerprint
+        fingerprint = training_fingerprint(dataset_path, training_args(os.path.join(dataset_path, "data.yaml")),
+                                           "yolov8n", {"sampling": sampling})
+        memoized = find_memoized_session(fingerprint, SESSION_FILE)
+        if memoized and os.environ.get("TRAINING_FORCE") != "1":
+            print(f"♻️ 训练输入未变化，复用会话 {memoized['id']}（TRAINING_FORCE=1 可强制重新训练）")
+            print(f"📁 模型: {memoized['best_model_path']}")
+            print('复用指标:', json.dumps(memoized.get("metrics", {}), ensure_ascii=False, indent=2, default=str))
+            return
+    except Exception as e:
+        print(f"⚠️ 训练指纹计算失败，照常训练: {e}")
+    
+    # 2. 训练模型（TRAINING_PROFILE=1 时记录各阶段耗时；TRAINING_SAMPLING=1 时启用类别均衡 / 难例采样；
+    #    默认从未完成的训练恢复，TRAINING_RESUME=0 时重新开始）
+    model, results = train_model(dataset_path, profile=os.environ.get("TRAINING_PROFILE") == "1",
+                                 sampling=sampling,
+                                 resume=os.environ.get("TRAINING_RESUME", "1") != "0")
     if not model:
         print("❌ 训练失败，退出")
         return
+    # 从未完成的检查点恢复时，训练参数来自那次训练（可能与本次指纹不同），不记录指纹，避免之后被错误复用
+    trainer_args = getattr(getattr(model, "trainer", None), "args", None)
+    if fingerprint and getattr(trainer_args, "resume", False):
+        print("ℹ️ 本次是恢复的训练，会话不记录训练指纹")
+        fingerprint = {}
     
     # 3. 验证模型
     val_results = validate_model(model, dataset_path)
     
-    # 4. 导出模型
-    exported_models = export_model(model)
+    # 尝试提取最佳权重路径
+    best_model_path = ""
+    try:
+        if hasattr(model, "trainer") and hasattr(model.trainer, "best"):
+            best_model_path = model.trainer.best
+        elif hasattr(model, "best"):
+            best_model_path = model.best
+        elif hasattr(model, "ckpt_path"):
+            best_model_path = model.ckpt_path
+    except Exception:
+        best_model_path = ""
+
+    # 4. 导出模型（独立进程池，从 best.pt 导出）
+    exported_models = export_model(best_model_path)
+    
+    # 离线营养表：为 data.yaml 的每个类别生成营养记录，放在 best.pt 旁边随模型分发
+    nutrition_table = ""
+    try:
+        from nutrition_table import build_nutrition_table, table_path_for_model
+        nutrition_table = table_path_for_model(str(best_model_path))
+        names = model.names if hasattr(model, "names") else {}
+        build_nutrition_table([names[i] for i in sorted(names)], nutrition_table,
+                              import_file=os.environ.get("NUTRITION_IMPORT_FILE"))
+    except Exception as e:
+        print(f"⚠️ 营养表生成失败: {e}")
+        nutrition_table = ""
     
     # 5. 保存训练信息
     training_info = {
@@ -156,24 +333,26 @@ def main():
     with open("training_results.json", "w") as f:
         json.dump(training_info, f, indent=2)
     
-    # 尝试提取更丰富的训练参数和可视化指标
-    best_model_path = ""
-    try:
-        if hasattr(model, "trainer") and hasattr(model.trainer, "best"):
-            best_model_path = model.trainer.best
-        elif hasattr(model, "best"):
-            best_model_path = model.best
-        elif hasattr(model, "ckpt_path"):
-            best_model_path = model.ckpt_path
-    except Exception:
-        best_model_path = ""
-
     # 获取准确率等训练指标  
     metric_info = {}
     try:
         metric_info = results.results_dict if hasattr(results, 'results_dict') else {}
     except Exception:
         pass
+    # 达到目标 mAP 所用的轮次（比较启用采样前后的效果）和最易混淆的类别
+    try:
+        from sampling import DEFAULT_TARGET, epochs_to_target, most_confused_pairs
+        target = float(os.environ.get("TRAINING_TARGET_MAP", DEFAULT_TARGET))
+        metric_info["epochs_to_target"] = {
+            **epochs_to_target(os.path.join(str(model.trainer.save_dir), "results.csv"), target),
+            "sampling": sampling,
+        }
+        metric_info["confused_pairs"] = [
+            {"true": t, "predicted": p, "rate": r}
+            for t, p, r in most_confused_pairs(val_results.confusion_matrix.matrix, list(val_results.names.values()))
+        ] if getattr(val_results, "confusion_matrix", None) is not None else []
+    except Exception as e:
+        print(f"⚠️ 无法计算目标轮次 / 混淆类别: {e}")
     # 获取训练超参数（全部真实参数优先）
     train_config = None
     try:
@@ -187,21 +366,61 @@ def main():
         "learning_rate": 0.01,
         "img_size": 640
     }
+    # 训练吞吐分析汇总（仅在启用 profile 时存在）
+    profile_summary = getattr(getattr(model, "trainer", None), "profile_summary", None) or {}
+
+    # 训练谱系：新训练 / 每次中断与恢复（见 training_checkpoint.py）
+    lineage = []
+    try:
+        from training_checkpoint import read_lineage
+        lineage = read_lineage(str(model.trainer.save_dir))
+    except Exception:
+        pass
+
+    # INT8 量化（TRAINING_QUANTIZE=1 时启用，包含 TFLite 导出）：mAP 下降在阈值内时作为首选部署模型
+    quantization_report = {}
+    if os.environ.get("TRAINING_QUANTIZE") == "1":
+        if best_model_path and os.path.exists(str(best_model_path)):
+            try:
+                from quantization import quantize_model
+                quantization_report = quantize_model(str(best_model_path), dataset_path, exported_models)
+            except Exception as e:
+                print(f"❌ INT8 量化失败: {e}")
+        else:
+            print(f"⚠️ 找不到最佳权重，跳过 INT8 量化: {best_model_path}")
+
+    # 结构化剪枝 + 微调（TRAINING_PRUNE=0.25,0.5 指定稀疏度；每个稀疏度微调 TRAINING_PRUNE_EPOCHS 轮）
+    pruning_report = {}
+    if os.environ.get("TRAINING_PRUNE"):
+        try:
+            from pruning import DEFAULT_FINETUNE_EPOCHS, prune_and_finetune
+            sparsities = [float(value) for value in os.environ["TRAINING_PRUNE"].split(",") if value.strip()]
+            pruning_report = prune_and_finetune(str(best_model_path), dataset_path, sparsities,
+                                                int(os.environ.get("TRAINING_PRUNE_EPOCHS", DEFAULT_FINETUNE_EPOCHS)),
+                                                exported_models=exported_models)
+        except Exception as e:
+            print(f"❌ 剪枝失败: {e}")
+
     # 生成完整训练历史
-    session_file_path = os.path.join("data", "training_sessions.json")
-    save_training_session({
+    session_file_path = SESSION_FILE
+    session_id = save_training_session({
         "model_config": model_config,
         "metrics": metric_info,
         "best_model_path": str(best_model_path),
         "exported_models": exported_models,
-        "validation_results": str(val_results)
+        "validation_results": str(val_results),
+        "quantization": quantization_report,
+        "serving_model_path": quantization_report.get("serving_model_path", ""),
+        "profile": profile_summary,
+        "lineage": lineage,
+        "dataset_stats": dataset_stats,
+        "nutrition_table": nutrition_table,
+        "training_fingerprint": fingerprint,
+        "pruning": pruning_report
     }, session_file_path)
-    # 立即输出调试检查
-    import json
-    if os.path.exists(session_file_path):
-        with open(session_file_path, 'r', encoding='utf-8') as f:
-            sessions = json.load(f)
-            print('写入历史:', json.dumps(sessions, ensure_ascii=False, indent=2))
+    # 只输出本次写入的会话
+    session = SessionStore(session_file_path).get(session_id)
+    print('写入会话:', json.dumps(session, ensure_ascii=False, indent=2, default=str))
 
     print("\n🎉 训练完成!")
     print(f"📁 模型保存在: {model.ckpt_path}")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 营养分析客户端（Gemini）
+- 批量：一个提示词同时分析多道菜（默认每批 8 道），要求返回 JSON 数组
+- 并发：多个批次用 asyncio 并发请求，按并发数和每分钟请求数限流
+- 缓存：按 (菜名, 语言) 持久化到磁盘，带过期时间；Nasi Lemak 这类常见菜只在过期后才重新查询
+检测完成后调用 nutrition_for_detections()，所有检测到的类别通常一次请求就能拿到营养信息。
+
+GEMINI_BASE_URL 可指向本地桩服务（python nutrition_client.py --stub-server 8765）做离线测试。
+
+用法:
+    python nutrition_client.py "Nasi Lemak" "Roti Canai" --language en
+    python nutrition_client.py --stub-server 8765
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import threading
+import hashlib
+import argparse
+import urllib.error
+import urllib.request
+
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-2.0-flash"
+DEFAULT_CACHE_DIR = os.path.join("data", "nutrition_cache")
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RPM = 15  # Gemini 免费额度的每分钟请求数
+REQUEST_TIMEOUT = 60
+
+NUTRITION_FIELDS = ("calories", "protein", "carbohydrates", "fat", "fiber")
+
+LANGUAGE_INSTRUCTIONS = {
+    "zh-CN": "analysis 字段请用中文，包含健康建议、适合的食用时间和马来西亚文化背景",
+    "en": "Write the analysis field in English, covering health advice, best time to eat and Malaysian cultural context",
+    "ms": "Tulis medan analysis dalam Bahasa Melayu, termasuk nasihat kesihatan, masa terbaik dimakan dan konteks budaya Malaysia",
+}
+
+
+def normalize_dish(name):
+    """'nasi_lemak' / 'Nasi Lemak' 视为同一道菜"""
+    return re.sub(r"[\s_\-]+", " ", str(name)).strip().lower()
+
+
+def build_batch_prompt(dishes, language):
+    instruction = LANGUAGE_INSTRUCTIONS.get(language, LANGUAGE_INSTRUCTIONS["zh-CN"])
+    return (
+        "You are a nutritionist specialising in Malaysian food. For each dish below, give typical values per 100 g.\n"
+        f"Dishes: {json.dumps(list(dishes), ensure_ascii=False)}\n"
+        "Return ONLY a JSON array with one object per dish, in the same order, with keys: "
+        "food_name (exactly as given), calories (kcal), protein (g), carbohydrates (g), fat (g), fiber (g), "
+        f"vitamins, minerals, analysis. {instruction}."
+    )
+
+
+def parse_batch_response(text, dishes):
+    """把模型返回的 JSON 数组按菜名对应回请求的菜；缺失的菜不在结果中"""
+    text = text.strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.S)
+    if fenced:
+        text = fenced.group(1)
+    items = json.loads(text)
+    if isinstance(items, dict):
+        items = items.get("dishes") or items.get("results") or [items]
+    if not isinstance(items, list):
+        raise ValueError(f"营养分析结果不是 JSON 数组: {type(items).__name__}")
+    wanted = {normalize_dish(d): d for d in dishes}
+    results = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        dish = wanted.get(normalize_dish(item.get("food_name", "")))
+        if dish is None and index < len(dishes) and len(items) == len(dishes):
+            dish = dishes[index]  # 名称被改写时按顺序对应
+        if dish is None or dish in results:
+            continue
+        info = {"food_name": dish, "source": "gemini_ai", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        for key in NUTRITION_FIELDS:
+            try:
+                info[key] = float(item[key]) if item.get(key) is not None else None
+            except (TypeError, ValueError):
+                info[key] = None
+        for key in ("vitamins", "minerals", "analysis"):
+            if item.get(key) is not None:
+                info[key] = item[key]
+        results[dish] = info
+    return results
+
+
+def fallback_nutrition(dish):
+    """API 不可用时的默认值（不写入缓存）"""
+    return {"food_name": dish, "calories": 300.0, "protein": 10.0, "carbohydrates": 40.0, "fat": 15.0,
+            "fiber": None, "analysis": f"{dish} 是马来西亚传统食物，营养均衡，建议适量食用。", "source": "fallback_data"}
+
+
+class NutritionCache:
+    """每个 (菜名, 语言) 一个 JSON 文件，原子写入，读取时检查过期时间"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, dish, language):
+        key = hashlib.sha256(f"{normalize_dish(dish)}\0{language}".encode("utf-8")).hexdigest()[:24]
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, dish, language):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(dish, language), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("cached_at", 0) > self.ttl:
+            return None
+        return {**entry["data"], "food_name": dish}
+
+    def put(self, dish, language, data):
+        if not self.cache_dir:
+            return
+        path = self._path(dish, language)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"dish": normalize_dish(dish), "language": language, "cached_at": time.time(), "data": data},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+class RateLimiter:
+    """
+    每分钟最多 rpm 个请求，请求之间均匀间隔。
+    由客户端持有，跨多次 analyze() 调用（每次是新的事件循环）和多个线程生效，所以用线程锁而不是 asyncio.Lock
+    """
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    async def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class NutritionClient:
+    """批量 + 并发 + 磁盘缓存的 Gemini 营养分析客户端"""
+
+    def __init__(self, api_key=None, base_url=GEMINI_BASE_URL, model=GEMINI_MODEL, cache_dir=DEFAULT_CACHE_DIR,
+                 ttl=DEFAULT_TTL, batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_CONCURRENCY,
+                 requests_per_minute=DEFAULT_RPM, timeout=REQUEST_TIMEOUT):
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY", "")
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.cache = NutritionCache(cache_dir, ttl)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.limiter = RateLimiter(requests_per_minute)
+        self.timeout = timeout
+        self.stats = {"cache_hits": 0, "requests": 0, "dishes_requested": 0, "failures": 0}
+
+    def _post(self, prompt):
+        """同步 HTTP 请求（在线程中执行），返回模型输出的文本"""
+        url = f"{self.base_url}/models/{self.model}:generateContent?key={self.api_key}"
+        body = json.dumps({
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 8192, "responseMimeType": "application/json"},
+        }).encode("utf-8")
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = json.loads(response.read().decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError(f"Gemini 响应不是 JSON 对象: {type(data).__name__}")
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
+        if not isinstance(text, str):
+            raise ValueError(f"Gemini 响应中的 text 不是字符串: {type(text).__name__}")
+        return text
+
+    async def _request_batch(self, dishes, language, semaphore):
+        async with semaphore:
+            await self.limiter.wait()
+            self.stats["requests"] += 1
+            self.stats["dishes_requested"] += len(dishes)
+            try:
+                text = await asyncio.to_thread(self._post, build_batch_prompt(dishes, language))
+                return parse_batch_response(text, dishes)
+            except (urllib.error.URLError, OSError, ValueError, TypeError, KeyError, IndexError) as e:
+                self.stats["failures"] += 1
+                print(f"❌ 营养分析请求失败 ({', '.join(dishes)}): {e}")
+                return {}
+
+    async def analyze_many(self, dishes, language="zh-CN"):
+        """
+        {菜名: 营养信息}；先查缓存，未命中的菜分批并发请求，失败的菜返回默认值。
+        按 normalize_dish 去重（"Nasi Lemak" 和 "nasi_lemak" 只请求一次），返回的键保持调用方传入的写法
+        """
+        unique = list(dict.fromkeys(dishes))
+        groups = {}  # 规范化名称 -> 请求时使用的写法（第一次出现的）
+        for dish in unique:
+            groups.setdefault(normalize_dish(dish), dish)
+        results, missing = {}, []
+        for key, dish in groups.items():
+            cached = self.cache.get(dish, language)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                results[key] = cached
+            else:
+                missing.append(dish)
+
+        if missing:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            for fetched in await asyncio.gather(*(self._request_batch(b, language, semaphore) for b in batches)):
+                for dish, info in fetched.items():
+                    self.cache.put(dish, language, info)
+                    results[normalize_dish(dish)] = info
+        return {dish: results.get(normalize_dish(dish)) or fallback_nutrition(dish) for dish in unique}
+
+    def analyze(self, dishes, language="zh-CN"):
+        """同步版本"""
+        return asyncio.run(self.analyze_many(dishes, language))
+
+
+def nutrition_for_detections(detections, language="zh-CN", client=None):
+    """检测结果中所有类别的营养信息（去重后一次批量请求）"""
+    client = client or NutritionClient()
+    return client.analyze([d["class"] for d in detections], language)
+
+
+def analyze_food_nutrition(food_name, language="zh-CN", client=None):
+    """单道菜（与 Colab 模板中的同名函数对应）"""
+    client = client or NutritionClient()
+    return client.analyze([food_name], language)[food_name]
+
+
+# =============================================================================
+# 本地桩服务（离线测试用）
+# =============================================================================
+
+def serve_stub(port, delay=0.2):
+    """模拟 Gemini generateContent：按提示词中的菜名返回固定的 JSON 数组"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            prompt = payload["contents"][0]["parts"][0]["text"]
+            dishes = json.loads(re.search(r"Dishes: (\[.*?\])\n", prompt).group(1))
+            time.sleep(delay)
+            items = [{"food_name": d, "calories": 100 + 10 * i, "protein": 5, "carbohydrates": 20, "fat": 3,
+                      "fiber": 1, "analysis": f"stub {d}"} for i, d in enumerate(dishes)]
+            body = json.dumps({"candidates": [{"content": {"parts": [{"text": json.dumps(items)}]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            print(f"🧪 桩服务: {fmt % args}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    print(f"🧪 Gemini 桩服务: http://127.0.0.1:{port}（设置 GEMINI_BASE_URL=http://127.0.0.1:{port}）")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 营养分析客户端")
+    parser.add_argument("dishes", nargs="*", help="菜名")
+    parser.add_argument("--language", default="zh-CN", choices=sorted(LANGUAGE_INSTRUCTIONS))
+    parser.add_argument("--base-url", default=GEMINI_BASE_URL)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--ttl-hours", type=float, default=DEFAULT_TTL / 3600)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="每分钟最多请求数")
+    parser.add_argument("--clear-cache", action="store_true")
+    parser.add_argument("--stub-server", type=int, metavar="PORT", help="启动本地桩服务")
+    args = parser.parse_args()
+
+    if args.stub_server:
+        serve_stub(args.stub_server)
+        return
+    client = NutritionClient(base_url=args.base_url, cache_dir=args.cache_dir, ttl=args.ttl_hours * 3600,
+                             batch_size=args.batch_size, requests_per_minute=args.rpm)
+    if args.clear_cache:
+        client.cache.clear()
+        print("✅ 营养分析缓存已清理")
+    if not args.dishes:
+        return
+    started = time.perf_counter()
+    results = client.analyze(args.dishes, args.language)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"⏱️ {time.perf_counter() - started:.2f}s, {json.dumps(client.stats)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
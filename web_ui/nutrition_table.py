@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 离线营养表
+类别集合由 data.yaml 的 names 决定，训练完成后为每个类别生成（或从 CSV / JSON 导入）一条营养记录，
+保存为模型权重旁边的 nutrition_table.json（与导出的模型一起分发）:
+    {"version": 1, "language": "zh-CN", "fields": [...], "classes": [...], "rows": [[...]], "analysis": [...],
+     "sources": [...], "index": {规范化类别名: 行号}}
+推理进程加载一次后用字典查询填充检测结果（微秒级），只有表中没有的类别才回退到在线的营养分析。
+
+用法:
+    python nutrition_table.py build <数据集目录> --model nutriscan_training/<run>/weights/best.pt [--import table.csv]
+    python nutrition_table.py lookup <nutrition_table.json> "Nasi Lemak" roti_canai
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+
+from nutrition_client import NUTRITION_FIELDS, NutritionClient, normalize_dish
+
+TABLE_NAME = "nutrition_table.json"
+TABLE_VERSION = 1
+
+
+def table_path_for_model(model_path):
+    """模型权重（或 OpenVINO 导出目录）所在目录中的营养表"""
+    model_path = os.path.abspath(model_path)
+    directory = os.path.dirname(model_path.rstrip(os.sep))
+    return os.path.join(directory, TABLE_NAME)
+
+
+def read_import_file(path):
+    """{类别名: 营养信息}；CSV 需要 food_name 列，JSON 可以是 {名称: {...}} 或 [{food_name: ...}]"""
+    if path.lower().endswith(".csv"):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        records = [{"food_name": k, **v} for k, v in data.items()] if isinstance(data, dict) else data
+    imported = {}
+    for record in records:
+        name = record.get("food_name") or record.get("name")
+        if not name:
+            continue
+        info = {"food_name": name, "source": "imported", "analysis": record.get("analysis") or ""}
+        for key in NUTRITION_FIELDS:
+            value = record.get(key)
+            info[key] = float(value) if value not in (None, "") else None
+        imported[normalize_dish(name)] = info
+    return imported
+
+
+def build_nutrition_table(names, output_path, import_file=None, language="zh-CN", client=None):
+    """为每个类别生成营养记录并写入 output_path；导入文件中已有的类别不再请求。返回缺失的类别"""
+    names = list(names)
+    records = read_import_file(import_file) if import_file else {}
+    missing = [name for name in names if normalize_dish(name) not in records]
+    if missing:
+        print(f"🧠 生成 {len(missing)} 个类别的营养信息...")
+        client = client or NutritionClient()
+        for name, info in client.analyze(missing, language).items():
+            if info.get("source") != "fallback_data":  # 默认值不写入表，查询时再回退到在线分析
+                records[normalize_dish(name)] = info
+
+    classes, rows, analysis, sources, index = [], [], [], [], {}
+    for name in names:
+        info = records.get(normalize_dish(name))
+        if info is None:
+            continue
+        index[normalize_dish(name)] = len(classes)
+        classes.append(name)
+        rows.append([info.get(key) for key in NUTRITION_FIELDS])
+        analysis.append(info.get("analysis") or "")
+        sources.append(info.get("source", "gemini_ai"))
+
+    table = {
+        "version": TABLE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "language": language,
+        "fields": list(NUTRITION_FIELDS),
+        "classes": classes,
+        "rows": rows,
+        "analysis": analysis,
+        "sources": sources,
+        "index": index,
+    }
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, output_path)
+    unresolved = [name for name in names if normalize_dish(name) not in index]
+    print(f"🥗 营养表已保存: {output_path}（{len(classes)}/{len(names)} 个类别）")
+    return unresolved
+
+
+class NutritionTable:
+    """加载后每个类别的记录预先构造好，查询只是一次字典访问"""
+
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        self.path = path
+        self.language = table.get("language")
+        fields = table["fields"]
+        self._records = {}
+        for key, row in table["index"].items():
+            record = dict(zip(fields, table["rows"][row]))
+            record.update(food_name=table["classes"][row], analysis=table["analysis"][row],
+                          source=table["sources"][row])
+            self._records[key] = record
+        self._exact = {record["food_name"]: record for record in self._records.values()}
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, name):
+        record = self._exact.get(name)
+        if record is None:
+            record = self._records.get(normalize_dish(name))
+        return record
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def load_table_for_model(model_path):
+    """模型旁边的营养表（按 mtime 缓存）；不存在时返回 None"""
+    path = table_path_for_model(model_path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _tables_lock:
+        cached = _tables.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, NutritionTable(path))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ 营养表无法读取 {path}: {e}", file=sys.stderr)
+                return None
+            _tables[path] = cached
+        return cached[1]
+
+
+def lookup_classes(classes, table):
+    """列式结果用：{类别: 营养信息}（每个类别只查一次）和表中缺失的类别"""
+    nutrition, missing = {}, []
+    for name in dict.fromkeys(classes):
+        record = table.get(name) if table is not None else None
+        nutrition[name] = record
+        if record is None:
+            missing.append(name)
+    return nutrition, missing
+
+
+def fill_nutrition(detections, table, client=None, language="zh-CN"):
+    """
+    给每个检测结果加上 nutrition 字段；表中没有的类别在提供 client 时批量在线查询，否则为 None。
+    返回表中缺失的类别名列表
+    """
+    unknown = []
+    for detection in detections:
+        record = table.get(detection["class"]) if table is not None else None
+        detection["nutrition"] = record
+        if record is None and detection["class"] not in unknown:
+            unknown.append(detection["class"])
+    if unknown and client is not None:
+        fetched = client.analyze(unknown, language)
+        for detection in detections:
+            if detection["nutrition"] is None:
+                detection["nutrition"] = fetched.get(detection["class"])
+    return unknown
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 离线营养表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="为数据集的所有类别生成营养表")
+    build.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    build.add_argument("--model", required=True, help="模型权重路径（营养表保存在同一目录）")
+    build.add_argument("--import", dest="import_file", help="已有的营养数据 (CSV / JSON)")
+    build.add_argument("--language", default="zh-CN")
+    lookup = sub.add_parser("lookup", help="查询营养表")
+    lookup.add_argument("table")
+    lookup.add_argument("names", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from sharded_inference import resolve_split_images
+        _, names = resolve_split_images(args.dataset, "train")
+        unresolved = build_nutrition_table([names[i] for i in sorted(names)], table_path_for_model(args.model),
+                                           args.import_file, args.language)
+        if unresolved:
+            print(f"⚠️ 没有营养信息的类别（推理时在线查询）: {', '.join(unresolved)}")
+        return
+    table = NutritionTable(args.table)
+    started = time.perf_counter()
+    results = {name: table.get(name) for name in args.names}
+    elapsed_us = (time.perf_counter() - started) * 1e6 / len(args.names)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"⏱️ 每次查询 {elapsed_us:.1f} µs", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 结构化通道剪枝 + 微调
+CPU 推理延迟基本由卷积通道数决定。训练完成后对每个稀疏度:
+1. 按 BN 缩放系数 |γ| 去掉不重要的输出通道，并同步删掉下一层卷积对应的输入通道（模型真正变窄，不是置零）
+2. 在同一个 data.yaml 上短暂微调（train_model()，剪枝后的结构原样训练，不按 yaml 重建）
+3. validate_model() 重新验证，export_model() 导出，记录大小、参数量、GFLOPs、CPU 延迟和 mAP
+稀疏度 0 是未剪枝的基线，所有稀疏度写入会话的 pruning 字段，用于在速度 / 精度曲线上选择部署模型。
+
+只剪枝不与其他层耦合的通道：Bottleneck 内部 cv1 -> cv2 的隐藏通道，以及 Detect 头每个分支中间的卷积。
+C2f 的拼接和残差相加两端的通道数必须一致，保持不变。保留的通道数取 8 的倍数，便于 CPU 的 SIMD 卷积实现。
+
+用法:
+    python pruning.py <数据集目录> [--session <会话ID> | --model best.pt] --sparsity 0.25 0.5 --epochs 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from copy import deepcopy
+
+PRUNE_PROJECT = "nutriscan_pruning"
+DEFAULT_SPARSITIES = (0.25, 0.5)
+DEFAULT_FINETUNE_EPOCHS = 10
+CHANNEL_ROUND = 8
+# 微调从已训练的权重开始：固定 SGD 小学习率，不做 warmup（optimizer=auto 会忽略 lr0）
+FINETUNE_OVERRIDES = {"optimizer": "SGD", "lr0": 0.002, "warmup_epochs": 0.0}
+# 延迟按部署时优先使用的格式测量
+SERVING_FORMATS = ("openvino", "onnx")
+
+
+# =============================================================================
+# 剪枝
+# =============================================================================
+
+def _is_conv_bn(module):
+    """ultralytics 的 Conv（Conv2d + BN + 激活），非分组卷积"""
+    return hasattr(module, "conv") and hasattr(module, "bn") and module.conv.groups == 1
+
+
+def _is_plain_conv2d(module):
+    from torch import nn
+    return isinstance(module, nn.Conv2d) and module.groups == 1
+
+
+def prunable_pairs(model):
+    """[(产生通道的 Conv, 使用这些通道的卷积)]：中间通道只在这两层之间流动"""
+    from ultralytics.nn.modules.block import Bottleneck
+    from ultralytics.nn.modules.head import Detect
+
+    pairs = []
+    for module in model.modules():
+        if isinstance(module, Bottleneck) and _is_conv_bn(module.cv1) and _is_conv_bn(module.cv2):
+            pairs.append((module.cv1, module.cv2))
+        elif isinstance(module, Detect):
+            for branch in (*module.cv2, *module.cv3):
+                layers = list(branch)
+                for producer, consumer in zip(layers, layers[1:]):
+                    if _is_conv_bn(producer) and (_is_conv_bn(consumer) or _is_plain_conv2d(consumer)):
+                        pairs.append((producer, consumer))
+    return pairs
+
+
+def _kept_channels(producer, sparsity):
+    """按 |γ| 保留的通道索引（升序），不需要剪枝时返回 None"""
+    import torch
+
+    gamma = producer.bn.weight.detach().abs()
+    channels = len(gamma)
+    keep = max(CHANNEL_ROUND, int(round(channels * (1 - sparsity) / CHANNEL_ROUND)) * CHANNEL_ROUND)
+    if keep >= channels:
+        return None
+    return torch.sort(torch.argsort(gamma, descending=True)[:keep]).values
+
+
+def _new_conv(conv, in_channels, out_channels):
+    from torch import nn
+    return nn.Conv2d(in_channels, out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation,
+                     conv.groups, bias=conv.bias is not None).to(conv.weight.device, conv.weight.dtype)
+
+
+def _prune_outputs(module, index):
+    from torch import nn
+
+    conv, bn = module.conv, module.bn
+    new_conv = _new_conv(conv, conv.in_channels, len(index))
+    new_conv.weight.data = conv.weight.data[index].clone()
+    if conv.bias is not None:
+        new_conv.bias.data = conv.bias.data[index].clone()
+    new_bn = nn.BatchNorm2d(len(index), eps=bn.eps, momentum=bn.momentum).to(bn.weight.device, bn.weight.dtype)
+    for name in ("weight", "bias", "running_mean", "running_var"):
+        getattr(new_bn, name).data = getattr(bn, name).data[index].clone()
+    module.conv, module.bn = new_conv, new_bn
+
+
+def _prune_inputs(module, index):
+    conv = module.conv if hasattr(module, "conv") else module
+    new_conv = _new_conv(conv, len(index), conv.out_channels)
+    new_conv.weight.data = conv.weight.data[:, index].clone()
+    if conv.bias is not None:
+        new_conv.bias.data = conv.bias.data.clone()
+    if hasattr(module, "conv"):
+        module.conv = new_conv
+    return new_conv
+
+
+def prune_model(model, sparsity):
+    """原地剪枝 DetectionModel，返回 {"layers", "channels_before", "channels_after"}"""
+    stats = {"layers": 0, "channels_before": 0, "channels_after": 0}
+    parents = {id(child): (parent, name) for parent in model.modules() for name, child in parent.named_children()}
+    for producer, consumer in prunable_pairs(model):
+        channels = producer.conv.out_channels
+        stats["channels_before"] += channels
+        index = _kept_channels(producer, sparsity)
+        if index is None:
+            stats["channels_after"] += channels
+            continue
+        _prune_outputs(producer, index)
+        new_conv = _prune_inputs(consumer, index)
+        if new_conv is not consumer and not hasattr(consumer, "conv"):
+            parent, name = parents[id(consumer)]  # Detect 分支末尾的 nn.Conv2d 需要在父模块中替换
+            setattr(parent, name, new_conv)
+        stats["layers"] += 1
+        stats["channels_after"] += len(index)
+    return stats
+
+
+def save_pruned(model, path, train_args=None):
+    """保存为 ultralytics 可直接加载的检查点（整个模块序列化，保留剪枝后的结构）"""
+    import torch
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    torch.save({
+        "epoch": -1,
+        "best_fitness": None,
+        "model": deepcopy(model).half(),
+        "ema": None,
+        "updates": None,
+        "optimizer": None,
+        "train_args": train_args or {},
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, path)
+    return path
+
+
+class PruningTrainerMixin:
+    """DetectionTrainer 的 mixin：直接训练传入的（剪枝后的）模型，而不是按 yaml 重建后再加载权重"""
+
+    def get_model(self, cfg=None, weights=None, verbose=True):
+        if weights is None:
+            return super().get_model(cfg=cfg, weights=weights, verbose=verbose)
+        return weights
+
+
+# =============================================================================
+# 评估
+# =============================================================================
+
+def _serving_latency(model_path, exported_models, imgsz, fmt=None):
+    """
+    部署格式的 p50 延迟：fmt 为空时取第一个可用的部署格式，都不可用时测 .pt。
+    export_stage 记录的延迟直接复用；条目只有路径时现场测量
+    """
+    from export_stage import benchmark_artifact
+    from inference_backends import artifact_path
+    from inference_worker import resolve_model_path
+
+    for name in ((fmt,) if fmt else SERVING_FORMATS):
+        entry = (exported_models or {}).get(name)
+        latency = entry.get("latency") if isinstance(entry, dict) else None
+        if latency and "p50_ms" in latency:
+            return name, latency["p50_ms"]
+        path = artifact_path(entry)
+        if path and os.path.exists(resolve_model_path(path)):
+            return name, benchmark_artifact(resolve_model_path(path), imgsz)["p50_ms"]
+    return "pt", benchmark_artifact(str(model_path), imgsz)["p50_ms"]
+
+
+def measure_model(model_path, dataset_path, imgsz=640, exported_models=None, latency_format=None):
+    """
+    大小、参数量、GFLOPs、mAP 和部署格式的 CPU 延迟；exported_models 为空时先导出。
+    latency_format 指定延迟的测量格式（与基线一致，加速比才可比较）
+    """
+    from ultralytics import YOLO
+    from ultralytics.utils.torch_utils import get_flops
+    from export_stage import artifact_size_mb
+    from local_training import export_model, validate_model
+
+    model = YOLO(model_path)
+    # 参数量和 FLOPs 在验证之前统计（验证会原地融合 Conv + BN）
+    params = sum(p.numel() for p in model.model.parameters())
+    gflops = float(get_flops(model.model, imgsz))
+    exported_models = exported_models or export_model(str(model_path), imgsz)
+    results = validate_model(model, dataset_path)
+    latency_format, latency_ms = _serving_latency(model_path, exported_models, imgsz, latency_format)
+    return {
+        "model_path": str(model_path),
+        "size_mb": artifact_size_mb(str(model_path)),
+        "params": params,
+        "gflops": gflops,
+        "mAP50": float(results.box.map50),
+        "mAP50-95": float(results.box.map),
+        "latency_format": latency_format,
+        "latency_ms": latency_ms,
+        "exported_models": exported_models,
+    }
+
+
+# =============================================================================
+# 剪枝流程
+# =============================================================================
+
+def prune_and_finetune(best_model_path, dataset_path, sparsities=DEFAULT_SPARSITIES,
+                       epochs=DEFAULT_FINETUNE_EPOCHS, batch=16, imgsz=640, exported_models=None, overrides=None):
+    """
+    对每个稀疏度剪枝、微调、验证、导出，返回报告:
+    {"base_model", "finetune_epochs", "levels": [{"sparsity", "mAP50-95", "gflops", "latency_ms", ...}]}
+    单个稀疏度失败时记录 error 字段，不影响其他稀疏度
+    """
+    from ultralytics import YOLO
+    from local_training import train_model
+
+    run_name = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(best_model_path))))
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "base_model": str(best_model_path),
+        "finetune_epochs": epochs,
+        "imgsz": imgsz,
+        "levels": [],
+    }
+    print("📏 测量未剪枝的基线模型...")
+    baseline = measure_model(best_model_path, dataset_path, imgsz, exported_models)
+    report["levels"].append({"sparsity": 0.0, **baseline})
+
+    for sparsity in sparsities:
+        name = f"{run_name}_sparsity{int(round(sparsity * 100))}"
+        try:
+            base = YOLO(best_model_path)
+            model = deepcopy(base.model).float()
+            channels = prune_model(model, sparsity)
+            pruned_path = save_pruned(model, os.path.join(PRUNE_PROJECT, f"{name}_pruned.pt"),
+                                      base.ckpt.get("train_args") if base.ckpt else None)
+            print(f"✂️ 稀疏度 {sparsity:.0%}: 剪枝 {channels['layers']} 层，"
+                  f"通道 {channels['channels_before']} -> {channels['channels_after']}")
+
+            level = {"sparsity": sparsity, "channels": channels, "pruned_path": pruned_path}
+            if epochs > 0:
+                tuned, _ = train_model(dataset_path, epochs=epochs, batch=batch, imgsz=imgsz, resume=False,
+                                       weights=pruned_path, pruned=True, project=PRUNE_PROJECT, name=name,
+                                       overrides={**FINETUNE_OVERRIDES, **(overrides or {})})
+                if not tuned:
+                    raise RuntimeError("微调失败")
+                level_model = str(tuned.trainer.best)
+            else:
+                level_model = pruned_path
+            level.update(measure_model(level_model, dataset_path, imgsz, latency_format=baseline["latency_format"]))
+        except Exception as e:
+            print(f"❌ 稀疏度 {sparsity:.0%} 失败: {e}")
+            level = {"sparsity": sparsity, "error": f"{type(e).__name__}: {e}"}
+        report["levels"].append(level)
+
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    print("📊 剪枝结果（速度 / 精度）:")
+    baseline = report["levels"][0]
+    for level in report["levels"]:
+        if "error" in level:
+            print(f"  - 稀疏度 {level['sparsity']:.0%}: ❌ {level['error']}")
+            continue
+        # 延迟格式不同（该稀疏度缺少基线的导出格式）时加速比没有意义
+        speedup = ""
+        if level["latency_format"] == baseline["latency_format"]:
+            speedup = f" ({baseline['latency_ms'] / max(level['latency_ms'], 1e-6):.2f}x)"
+        print(f"  - 稀疏度 {level['sparsity']:.0%}: mAP50-95 {level['mAP50-95']:.3f}, {level['gflops']:.1f} GFLOPs, "
+              f"{level['size_mb']:.1f} MB, {level['latency_format']} {level['latency_ms']:.1f} ms{speedup}")
+
+
+def main():
+    from local_training import SESSION_FILE, update_training_session
+    from inference_worker import resolve_model_path
+    from session_store import SessionStore
+
+    parser = argparse.ArgumentParser(description="NutriScan MY 结构化剪枝 + 微调")
+    parser.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    parser.add_argument("--session", help="训练会话 ID（默认最新完成的会话）")
+    parser.add_argument("--model", help="直接指定 best.pt（不写入会话）")
+    parser.add_argument("--sparsity", type=float, nargs="+", default=list(DEFAULT_SPARSITIES))
+    parser.add_argument("--epochs", type=int, default=DEFAULT_FINETUNE_EPOCHS, help="每个稀疏度的微调轮次")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--imgsz", type=int, default=640)
+    args = parser.parse_args()
+
+    session = None
+    if args.model:
+        model_path, exported_models = args.model, None
+    else:
+        store = SessionStore(SESSION_FILE)
+        session = store.get(args.session) if args.session else store.latest_completed()
+        if not session:
+            print("❌ 找不到训练会话")
+            sys.exit(1)
+        model_path, exported_models = resolve_model_path(session["best_model_path"]), session.get("exported_models")
+    if not os.path.exists(model_path):
+        print(f"❌ 模型文件不存在: {model_path}")
+        sys.exit(1)
+
+    report = prune_and_finetune(model_path, args.dataset, args.sparsity, args.epochs, args.batch, args.imgsz,
+                                exported_models)
+    if session:
+        update_training_session(session["id"], {"pruning": report}, SESSION_FILE)
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
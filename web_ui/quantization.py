@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - INT8 训练后量化
+用仓库自带的校准张量（calibration_image_sample_data_20x128x128x3_float32.npy）
+或 Roboflow train/ 中抽样的图片作为校准集，生成 INT8 ONNX / TFLite 模型，
+并与浮点模型比较 mAP 和 CPU 延迟。mAP 下降不超过阈值时，把 INT8 模型记录为训练会话的首选部署模型。
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import statistics
+
+import numpy as np
+
+from inference_backends import artifact_path, letterbox, to_input_tensor, load_backend
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CALIBRATION_FILE = os.path.join(BASE_DIR, "..", "calibration_image_sample_data_20x128x128x3_float32.npy")
+DEFAULT_MAX_MAP_DROP = 0.01      # 允许的 mAP50-95 绝对下降
+DEFAULT_CALIBRATION_SIZE = 100   # 从 train/ 抽样的图片数
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+# =============================================================================
+# 校准集
+# =============================================================================
+
+def calibration_from_npy(npy_path=DEFAULT_CALIBRATION_FILE, imgsz=640):
+    """读取 N x H x W x 3 的 float32 校准张量（取值 0~1 或 0~255），letterbox 到模型输入尺寸"""
+    samples = np.load(npy_path)
+    if samples.max() <= 1.0:
+        samples = samples * 255.0
+    samples = samples.clip(0, 255).astype(np.uint8)
+    return [letterbox(sample, imgsz)[0] for sample in samples]
+
+
+def calibration_from_dataset(dataset_path, imgsz=640, size=DEFAULT_CALIBRATION_SIZE, seed=0):
+    """从数据集 train/images 中随机抽样校准图片"""
+    from inference_backends import load_image
+
+    image_dir = os.path.join(dataset_path, "train", "images")
+    if not os.path.isdir(image_dir):
+        image_dir = os.path.join(dataset_path, "train")
+    paths = sorted(p for p in glob.glob(os.path.join(image_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise FileNotFoundError(f"找不到校准图片: {image_dir}")
+    random.Random(seed).shuffle(paths)
+    return [letterbox(load_image(p), imgsz)[0] for p in paths[:size]]
+
+
+def build_calibration_set(dataset_path=None, imgsz=640, size=DEFAULT_CALIBRATION_SIZE, npy_path=DEFAULT_CALIBRATION_FILE):
+    """优先用真实训练图片校准；没有数据集时使用自带的校准张量"""
+    if dataset_path:
+        try:
+            images = calibration_from_dataset(dataset_path, imgsz, size)
+            print(f"📊 校准集: 从 train/ 抽样 {len(images)} 张图片")
+            return images
+        except FileNotFoundError as e:
+            print(f"⚠️ {e}，改用校准张量")
+    images = calibration_from_npy(npy_path, imgsz)
+    print(f"📊 校准集: {os.path.basename(npy_path)} ({len(images)} 张)")
+    return images
+
+
+class ImageCalibrationReader:
+    """onnxruntime.quantization 需要的校准数据读取器"""
+
+    def __init__(self, input_name, images):
+        self.input_name = input_name
+        self._iter = iter(images)
+
+    def get_next(self):
+        image = next(self._iter, None)
+        if image is None:
+            return None
+        return {self.input_name: to_input_tensor([image])}
+
+    def rewind(self):
+        pass
+
+
+# =============================================================================
+# 量化
+# =============================================================================
+
+def detect_head_nodes(onnx_path):
+    """YOLOv8 的 Detect 头（DFL、坐标解码）对量化误差最敏感，保持浮点"""
+    import re
+    import onnx
+
+    graph = onnx.load(onnx_path).graph
+    indices = [int(m.group(1)) for node in graph.node for m in [re.match(r"/model\.(\d+)/", node.name)] if m]
+    if not indices:
+        return []
+    head = f"/model.{max(indices)}/"
+    return [node.name for node in graph.node if node.name.startswith(head)]
+
+
+def quantize_onnx(float_onnx, calibration_images, output_path=None, exclude_head=True):
+    """静态 INT8 量化 (QDQ, 权重按通道对称量化)"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    output_path = output_path or float_onnx.replace(".onnx", "_int8.onnx")
+    prepared = float_onnx.replace(".onnx", "_prep.onnx")
+    quant_pre_process(float_onnx, prepared)
+
+    input_name = ort.InferenceSession(prepared, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        prepared,
+        output_path,
+        ImageCalibrationReader(input_name, calibration_images),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+        nodes_to_exclude=detect_head_nodes(prepared) if exclude_head else [],
+    )
+    os.remove(prepared)
+
+    # 保留 ultralytics 写入的 names / imgsz 元数据，推理后端依赖它们
+    import onnx
+    float_meta = onnx.load(float_onnx, load_external_data=False).metadata_props
+    quantized = onnx.load(output_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(float_meta)
+    onnx.save(quantized, output_path)
+
+    print(f"✅ INT8 ONNX 量化完成: {output_path}")
+    return output_path
+
+
+def quantize_tflite(best_model_path, data_yaml):
+    """
+    通过 ultralytics 导出 INT8 TFLite（用 data.yaml 中的图片校准）。
+    导出过程会重新生成 best.onnx / best_saved_model/，所以在暂存目录中进行，只把 .tflite 移到权重旁边，
+    不覆盖导出阶段产生的浮点模型
+    """
+    import shutil
+    from ultralytics import YOLO
+
+    weights_dir = os.path.dirname(os.path.abspath(best_model_path))
+    staging = os.path.join(weights_dir, ".quantize_tflite")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        staged_weights = os.path.join(staging, os.path.basename(best_model_path))
+        shutil.copy2(best_model_path, staged_weights)
+        exported = str(YOLO(staged_weights).export(format="tflite", int8=True, data=data_yaml))
+        path = os.path.join(weights_dir, os.path.basename(exported))
+        os.replace(exported, path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    print(f"✅ INT8 TFLite 导出完成: {path}")
+    return path
+
+
+# =============================================================================
+# 精度与延迟评估
+# =============================================================================
+
+def evaluate_accuracy(model_path, dataset_path):
+    """用 validate_model() 评估任意格式的模型，返回 mAP"""
+    from ultralytics import YOLO
+    from local_training import validate_model
+
+    results = validate_model(YOLO(model_path, task="detect"), dataset_path)
+    return {"mAP50": float(results.box.map50), "mAP50-95": float(results.box.map)}
+
+
+def benchmark_latency(model_path, images, runs=20, warmup=3):
+    """在固定图片上测量单张推理延迟（毫秒）"""
+    backend = load_backend(model_path, "onnxruntime" if model_path.endswith(".onnx") else "ultralytics")
+    for image in images[:warmup]:
+        backend.predict([image])
+    timings = []
+    for i in range(runs):
+        image = images[i % len(images)]
+        started = time.perf_counter()
+        backend.predict([image])
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(timings), "mean_ms": statistics.mean(timings), "runs": runs}
+
+
+def quantize_model(best_model_path, dataset_path=None, exported_models=None, imgsz=640,
+                   max_map_drop=DEFAULT_MAX_MAP_DROP, calibration_size=DEFAULT_CALIBRATION_SIZE,
+                   formats=("onnx", "tflite")):
+    """
+    完整量化流程，返回报告:
+    {"float": {...}, "int8": {...}, "accepted": bool, "serving_model_path": str}
+    """
+    exported_models = exported_models or {}
+    float_onnx = artifact_path(exported_models.get("onnx")) or os.path.splitext(best_model_path)[0] + ".onnx"
+    if not os.path.exists(float_onnx):
+        from ultralytics import YOLO
+        float_onnx = YOLO(best_model_path).export(format="onnx", imgsz=imgsz)
+
+    calibration = build_calibration_set(dataset_path, imgsz, calibration_size)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "calibration_images": len(calibration),
+        "max_map_drop": max_map_drop,
+        "float": {"path": float_onnx},
+        "int8": {},
+        "accepted": False,
+        "serving_model_path": "",
+    }
+
+    int8_onnx = quantize_onnx(float_onnx, calibration) if "onnx" in formats else None
+    if int8_onnx:
+        report["int8"]["path"] = int8_onnx
+        report["float"]["size_mb"] = os.path.getsize(float_onnx) / 1e6
+        report["int8"]["size_mb"] = os.path.getsize(int8_onnx) / 1e6
+
+    if "tflite" in formats and dataset_path:
+        try:
+            report["int8"]["tflite_path"] = quantize_tflite(best_model_path, os.path.join(dataset_path, "data.yaml"))
+        except Exception as e:
+            print(f"❌ INT8 TFLite 导出失败: {e}")
+
+    if not int8_onnx:
+        return report
+
+    print("⏱️ 测量延迟...")
+    report["float"]["latency"] = benchmark_latency(float_onnx, calibration)
+    report["int8"]["latency"] = benchmark_latency(int8_onnx, calibration)
+    report["speedup"] = report["float"]["latency"]["median_ms"] / max(report["int8"]["latency"]["median_ms"], 1e-6)
+
+    if dataset_path:
+        report["float"]["metrics"] = evaluate_accuracy(float_onnx, dataset_path)
+        report["int8"]["metrics"] = evaluate_accuracy(int8_onnx, dataset_path)
+        drop = report["float"]["metrics"]["mAP50-95"] - report["int8"]["metrics"]["mAP50-95"]
+        report["map_drop"] = drop
+        report["accepted"] = drop <= max_map_drop
+        if report["accepted"]:
+            report["serving_model_path"] = int8_onnx
+    else:
+        print("⚠️ 没有数据集，无法评估精度，INT8 模型不会被设为首选")
+
+    print(f"📊 INT8 量化结果: 加速 {report['speedup']:.2f}x, "
+          f"mAP 下降 {report.get('map_drop', float('nan')):.4f}, "
+          f"{'✅ 采用 INT8 模型' if report['accepted'] else '❌ 保留浮点模型'}")
+    return report
+
+
+def main():
+    from local_training import update_training_session, SESSION_FILE
+    from inference_worker import resolve_model_path
+    from session_store import SessionStore
+
+    parser = argparse.ArgumentParser(description="NutriScan MY INT8 量化")
+    parser.add_argument("--session", help="训练会话 ID（默认最新完成的会话）")
+    parser.add_argument("--dataset", help="数据集目录（包含 data.yaml 和 train/）")
+    parser.add_argument("--max-map-drop", type=float, default=DEFAULT_MAX_MAP_DROP, help="允许的 mAP50-95 下降")
+    parser.add_argument("--calibration-size", type=int, default=DEFAULT_CALIBRATION_SIZE)
+    parser.add_argument("--imgsz", type=int, default=640)
+    args = parser.parse_args()
+
+    store = SessionStore(SESSION_FILE)
+    session = store.get(args.session) if args.session else store.latest_completed()
+    if not session or not session.get("best_model_path"):
+        print("❌ 找不到训练会话")
+        sys.exit(1)
+    best_model_path = resolve_model_path(session["best_model_path"])
+    if not os.path.exists(best_model_path):
+        print(f"❌ 模型文件不存在: {best_model_path}")
+        sys.exit(1)
+
+    report = quantize_model(best_model_path, args.dataset, session.get("exported_models"),
+                            imgsz=args.imgsz, max_map_drop=args.max_map_drop, calibration_size=args.calibration_size)
+    updates = {"quantization": report}
+    if report["accepted"]:
+        updates["serving_model_path"] = report["serving_model_path"]
+    update_training_session(session["id"], updates, SESSION_FILE)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
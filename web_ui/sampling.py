@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 训练采样
+用加权采样代替均匀打乱，让小模型（yolov8n）在更少的轮次内达到目标精度:
+  - 类别均衡: 按 dataset_stats 的类别频率，含稀有类别的图片被更多地抽到
+  - 混淆类别: 每轮验证后读取混淆矩阵，召回率低 / 经常被误判成其他类别的类别（如 Wantan Mee 与 Char Kway Teow）加权
+  - 难例挖掘: 记录每张图片所在 batch 的训练损失（指数滑动平均），损失高的图片在下一轮被更多地抽到
+权重在每轮结束时更新。数据加载器预取时会在上一轮验证之前就开始迭代下一轮的采样器，
+所以采样器按小块惰性抽取、每块读取当前权重：只有已经预取的前几个 batch 仍使用旧权重。
+
+epochs_to_target() 从 results.csv 得到验证指标第一次达到目标值的轮次，写入会话指标，用来比较启用采样前后的效果。
+"""
+
+import os
+import csv
+
+import numpy as np
+
+DEFAULT_POWER = 0.5          # 类别均衡强度: 权重 ∝ (1 / 频率)^power
+DEFAULT_CONFUSION_ALPHA = 1.0  # 类别权重 = 1 + alpha × (1 - 召回率)
+DEFAULT_HARD_ALPHA = 0.5     # 图片权重 × (1 + hard_alpha × 相对损失)，裁剪到 [0.5, 2]
+LOSS_EMA = 0.7
+SAMPLE_CHUNK = 64            # 每次按当前权重抽取的样本数
+TARGET_METRIC = "metrics/mAP50(B)"
+DEFAULT_TARGET = 0.7
+
+try:
+    import torch
+    from torch.utils.data import Sampler as _Sampler
+except ImportError:  # 只计算权重时不需要 torch
+    torch = None
+    _Sampler = object
+
+
+class AdaptiveWeightedSampler(_Sampler):
+    """有放回的加权采样器，权重可在两轮之间更新"""
+
+    def __init__(self, weights, num_samples=None, seed=0):
+        self.weights = torch.as_tensor(np.asarray(weights, dtype=np.float64))
+        self.num_samples = num_samples or len(self.weights)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_weights(self, weights):
+        self.weights = torch.as_tensor(np.asarray(weights, dtype=np.float64))
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        remaining = self.num_samples
+        while remaining > 0:
+            count = min(SAMPLE_CHUNK, remaining)
+            yield from torch.multinomial(self.weights, count, replacement=True, generator=generator).tolist()
+            remaining -= count
+
+    def __len__(self):
+        return self.num_samples
+
+
+def confusion_class_factors(matrix, nc, alpha=DEFAULT_CONFUSION_ALPHA):
+    """
+    由 ultralytics 混淆矩阵（行 = 预测，列 = 真实，最后一行 / 列为背景）计算类别权重:
+    1 + alpha × (1 - 召回率)；没有验证样本的类别保持 1
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)[:nc + 1, :nc]
+    totals = matrix.sum(axis=0)
+    recall = np.divide(np.diag(matrix[:nc, :nc]), totals, out=np.ones(nc), where=totals > 0)
+    return 1.0 + alpha * (1.0 - recall)
+
+
+def most_confused_pairs(matrix, names, top=3):
+    """最常见的 (真实类别, 误判类别, 比例)"""
+    nc = len(names)
+    matrix = np.asarray(matrix, dtype=np.float64)[:nc, :nc]
+    totals = matrix.sum(axis=0)
+    rates = np.divide(matrix, totals[None, :], out=np.zeros_like(matrix), where=totals[None, :] > 0)
+    np.fill_diagonal(rates, 0)
+    flat = np.argsort(rates, axis=None)[::-1][:top]
+    pairs = []
+    for index in flat:
+        predicted, true = np.unravel_index(index, rates.shape)
+        if rates[predicted, true] > 0:
+            pairs.append((names[true], names[predicted], float(rates[predicted, true])))
+    return pairs
+
+
+def epochs_to_target(results_csv, target=DEFAULT_TARGET, metric=TARGET_METRIC):
+    """results.csv 中指标第一次达到 target 的轮次（从 1 开始），未达到时为 None；中断恢复的训练也按完整历史计算"""
+    epoch = None
+    if os.path.exists(results_csv):
+        with open(results_csv, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                row = {k.strip(): v.strip() for k, v in row.items()}
+                if row.get(metric) and float(row[metric]) >= target:
+                    epoch = int(float(row["epoch"]))  # ultralytics 的 epoch 列从 1 开始
+                    break
+    return {"metric": metric, "target": target, "epoch": epoch}
+
+
+class SamplingTrainerMixin:
+    """DetectionTrainer 的 mixin：训练集使用类别均衡 + 混淆类别 + 难例加权的采样器"""
+
+    sampling_power = DEFAULT_POWER
+    confusion_alpha = DEFAULT_CONFUSION_ALPHA
+    hard_alpha = DEFAULT_HARD_ALPHA
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sampler = None
+        self.sampling_stats = None
+        self.class_factors = None
+        self.image_loss = None
+        self._batch_indices = None
+        self.add_callback("on_train_batch_end", self._record_batch_loss)
+        self.add_callback("on_fit_epoch_end", self._update_weights)
+
+    def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode="train"):
+        if mode != "train":
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+        from ultralytics.data.build import InfiniteDataLoader, seed_worker
+        from ultralytics.utils.torch_utils import torch_distributed_zero_first
+        from dataset_stats import compute_stats
+
+        with torch_distributed_zero_first(rank):
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+        names = [self.data["names"][i] for i in sorted(self.data["names"])]
+        self.sampling_stats = compute_stats(list(dataset.im_files), names)
+        self.image_loss = np.full(len(dataset.im_files), np.nan)
+        self._index_of = {path: i for i, path in enumerate(dataset.im_files)}
+        self.sampler = AdaptiveWeightedSampler(self._image_weights(), seed=self.args.seed)
+        workers = self.args.workers
+        print(f"⚖️ 类别均衡采样: 权重范围 {self.sampler.weights.min():.2f} ~ {self.sampler.weights.max():.2f}")
+        return InfiniteDataLoader(
+            dataset=dataset,
+            batch_size=min(batch_size, len(dataset)),
+            shuffle=False,
+            sampler=self.sampler,
+            num_workers=min(os.cpu_count() or 1, workers),
+            pin_memory=False,
+            collate_fn=getattr(dataset, "collate_fn", None),
+            worker_init_fn=seed_worker,
+        )
+
+    def _image_weights(self):
+        weights = self.sampling_stats.image_weights(self.sampling_power, self.class_factors)
+        if self.image_loss is not None and np.isfinite(self.image_loss).any():
+            mean = np.nanmean(self.image_loss)
+            relative = np.nan_to_num((self.image_loss - mean) / (mean + 1e-9), nan=0.0)
+            weights = weights * np.clip(1.0 + self.hard_alpha * relative, 0.5, 2.0)
+        return weights / weights.mean()
+
+    def preprocess_batch(self, batch):
+        if self.sampler is not None and "im_file" in batch:
+            self._batch_indices = [self._index_of.get(path) for path in batch["im_file"]]
+        return super().preprocess_batch(batch)
+
+    def _record_batch_loss(self, trainer):
+        if not self._batch_indices or self.loss_items is None:
+            return
+        loss = float(self.loss_items.sum())
+        indices = [i for i in self._batch_indices if i is not None]
+        previous = self.image_loss[indices]
+        self.image_loss[indices] = np.where(np.isnan(previous), loss, LOSS_EMA * previous + (1 - LOSS_EMA) * loss)
+        self._batch_indices = None
+
+    def _update_weights(self, trainer):
+        """验证之后：按混淆矩阵更新类别权重，结合难例损失刷新采样权重"""
+        if self.sampler is None:
+            return
+        confusion = getattr(getattr(self, "validator", None), "confusion_matrix", None)
+        nc = self.sampling_stats.nc
+        if confusion is not None and np.asarray(confusion.matrix).sum() > 0:
+            self.class_factors = confusion_class_factors(confusion.matrix, nc, self.confusion_alpha)
+            pairs = most_confused_pairs(confusion.matrix, self.sampling_stats.names)
+            if pairs:
+                print("🔀 最易混淆: " + ", ".join(f"{t}→{p} {r:.0%}" for t, p, r in pairs))
+        self.sampler.set_weights(self._image_weights())
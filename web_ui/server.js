@@ -4,9 +4,6 @@ const path = require('path');
 const fs = require('fs');
 const { v4: uuidv4 } = require('uuid');
 const multer = require('multer');
-const { exec } = require('child_process');
-const util = require('util');
-const execPromise = util.promisify(exec);
 
 // 导入真实数据服务
 const realDataService = require('./services/real-data-service');
@@ -22,6 +19,12 @@ const trainingAutomation = require('./services/training-automation-service');
 // 导入营养分析服务
 const nutritionAnalysis = require('./services/nutrition-analysis-service');
 
+// 导入常驻推理进程客户端
+const inferenceWorker = require('./services/inference-worker-client');
+
+// 导入训练会话索引（本地训练的追加日志 + Colab 会话文件）
+const sessionStore = require('./services/session-store');
+
 const app = express();
 const PORT = process.env.PORT || 5000;
 
@@ -1337,12 +1340,10 @@ app.post('/api/detection/analyze', upload.single('image'), async (req, res) => {
         console.log(`📸 收到图片上传: ${imageName}`);
         console.log(`📁 完整图片路径: ${imagePath}`);
         
-        // 查找最新的训练模型
-        const trainingSessions = readJsonFile(trainingSessionsFile);
-        const sessions = Object.values(trainingSessions);
-        const completedSessions = sessions.filter(s => s.status === 'completed' && s.best_model_path);
+        // 查找最新的训练模型（读取会话索引，不再解析并排序全部会话）
+        const latestSession = sessionStore.latestCompleted();
         
-        if (completedSessions.length === 0) {
+        if (!latestSession) {
             // 清理临时文件
             fs.unlinkSync(imagePath);
             return res.status(404).json({
@@ -1351,14 +1352,15 @@ app.post('/api/detection/analyze', upload.single('image'), async (req, res) => {
             });
         }
         
-        // 使用最新的模型
-        const latestSession = completedSessions.sort((a, b) => 
-            new Date(b.created_at || 0) - new Date(a.created_at || 0)
-        )[0];
+        const resolveModelPath = (modelFile) => path.isAbsolute(modelFile)
+            ? modelFile
+            : path.join(__dirname, '..', modelFile);
         
-        const modelPath = path.isAbsolute(latestSession.best_model_path) 
-            ? latestSession.best_model_path 
-            : path.join(__dirname, '..', latestSession.best_model_path);
+        // 量化后被选为首选的部署模型（INT8）优先
+        const servingPath = latestSession.serving_model_path && resolveModelPath(latestSession.serving_model_path);
+        const modelPath = servingPath && fs.existsSync(servingPath)
+            ? servingPath
+            : resolveModelPath(latestSession.best_model_path);
         
         // 检查模型文件是否存在
         if (!fs.existsSync(modelPath)) {
@@ -1371,145 +1373,27 @@ app.post('/api/detection/analyze', upload.single('image'), async (req, res) => {
         
         console.log(`🤖 使用模型: ${modelPath}`);
         
-        // 调用Python脚本进行推理（如果Python不可用，返回模拟结果用于演示）
+        // 调用常驻推理进程（如果Python不可用，返回模拟结果用于演示）
         try {
-            // 检查是否有Python环境
-            const { stdout: pythonVersion } = await execPromise('python --version').catch(() => ({ stdout: '' }));
-            const hasPython = pythonVersion.includes('Python');
-            
-            if (hasPython) {
-                // 创建Python推理脚本
-                // 转换Windows路径格式
-                const modelPathEscaped = modelPath.replace(/\\/g, '\\\\');
-                const imagePathEscaped = imagePath.replace(/\\/g, '\\\\');
-                
-                // 使用原始路径，Python会自动处理
-                const modelPathNormalized = modelPath.replace(/\\/g, '/');
-                const imagePathNormalized = imagePath.replace(/\\/g, '/');
-                
-                const pythonScript = `# -*- coding: utf-8 -*-
-import sys
-import json
-import os
-from pathlib import Path
-
-# 设置输出编码
-sys.stdout.reconfigure(encoding='utf-8') if hasattr(sys.stdout, 'reconfigure') else None
-
-try:
-    from ultralytics import YOLO
-    
-    model_path = r"${modelPathNormalized}"
-    image_path = r"${imagePathNormalized}"
-    
-    # 验证文件存在
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"模型文件不存在: {model_path}")
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"图片文件不存在: {image_path}")
-    
-    # 加载模型
-    model = YOLO(model_path)
-    
-    # 进行推理
-    results = model(image_path, conf=0.25, save=False, verbose=False)
-    
-    detections = []
-    for result in results:
-        if hasattr(result, 'boxes') and result.boxes is not None:
-            boxes = result.boxes
-            for i in range(len(boxes)):
-                box = boxes[i]
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
-                xyxy = box.xyxy[0].tolist()
-                
-                # 获取类别名称
-                class_name = result.names[cls] if hasattr(result, 'names') and cls < len(result.names) else f"class_{cls}"
-                
-                detections.append({
-                    "class": class_name,
-                    "confidence": conf,
-                    "bbox": [xyxy[0], xyxy[1], xyxy[2] - xyxy[0], xyxy[3] - xyxy[1]]
-                })
-    
-    print(json.dumps({"success": True, "detections": detections}, ensure_ascii=False))
-except FileNotFoundError as e:
-    print(json.dumps({"success": False, "error": str(e)}, ensure_ascii=False))
-    sys.exit(1)
-except ImportError as e:
-    print(json.dumps({"success": False, "error": f"导入错误: {str(e)}. 请确保已安装ultralytics: pip install ultralytics"}, ensure_ascii=False))
-    sys.exit(1)
-except Exception as e:
-    import traceback
-    error_msg = f"{type(e).__name__}: {str(e)}"
-    traceback_str = traceback.format_exc()
-    print(json.dumps({"success": False, "error": error_msg, "traceback": traceback_str}, ensure_ascii=False))
-    sys.exit(1)
-`;
-                
-                const scriptPath = path.join(uploadsDir, `inference_${Date.now()}.py`);
-                fs.writeFileSync(scriptPath, pythonScript, 'utf8');
-                
-                console.log(`📝 Python脚本已创建: ${scriptPath}`);
-                console.log(`🤖 模型路径: ${modelPath}`);
-                console.log(`📸 图片路径: ${imagePath}`);
-                
-                // 执行Python脚本 - 使用绝对路径并捕获详细错误
-                let stdout, stderr;
-                try {
-                    const command = `python "${scriptPath}" 2>&1`;
-                    const result = await execPromise(command, { 
-                        maxBuffer: 10 * 1024 * 1024, // 10MB buffer
-                        cwd: path.dirname(scriptPath)
-                    });
-                    stdout = result.stdout;
-                    stderr = result.stderr;
-                    
-                    console.log(`✅ Python执行成功`);
-                    console.log(`📤 输出: ${stdout.substring(0, 200)}`);
-                } catch (execError) {
-                    stdout = execError.stdout || '';
-                    stderr = execError.stderr || execError.message || '';
-                    console.error(`❌ Python执行失败:`, execError);
-                    console.error(`📥 标准输出:`, stdout);
-                    console.error(`📥 标准错误:`, stderr);
-                    
-                    // 清理文件
-                    if (fs.existsSync(scriptPath)) fs.unlinkSync(scriptPath);
-                    if (fs.existsSync(imagePath)) fs.unlinkSync(imagePath);
-                    
-                    return res.status(500).json({
-                        success: false,
-                        error: `Python执行失败: ${stderr || execError.message || '未知错误'}`,
-                        details: {
-                            script: scriptPath,
-                            model: modelPath,
-                            python_error: stderr
-                        }
-                    });
-                }
-                
-                // 清理Python脚本
-                if (fs.existsSync(scriptPath)) {
-                    fs.unlinkSync(scriptPath);
-                }
-                
-                // 解析结果
+            if (inferenceWorker.isAvailable()) {
                 let result;
                 try {
-                    result = JSON.parse(stdout.trim());
-                } catch (parseError) {
-                    console.error(`❌ JSON解析失败:`, parseError);
-                    console.error(`📥 原始输出:`, stdout);
+                    // sliced=true 时对高分辨率整桌照片切片推理（小碟配菜不会因整图缩放而漏检）
+                    const sliced = req.body && (req.body.sliced === 'true' || req.body.sliced === true);
+                    result = await inferenceWorker.analyze(imagePath, { modelPath, sliced });
+                    console.log(`✅ 推理完成: ${(result.detections || []).length} 个检测结果`);
+                } catch (workerError) {
+                    console.error(`❌ 推理进程调用失败:`, workerError);
                     
                     // 清理临时图片
                     if (fs.existsSync(imagePath)) fs.unlinkSync(imagePath);
                     
                     return res.status(500).json({
                         success: false,
-                        error: `结果解析失败: ${parseError.message}`,
-                        raw_output: stdout.substring(0, 500)
+                        error: `Python执行失败: ${workerError.message || '未知错误'}`,
+                        details: {
+                            model: modelPath
+                        }
                     });
                 }
                 
@@ -1519,9 +1403,24 @@ except Exception as e:
                 }
                 
                 if (result.success) {
+                    // 营养信息由推理进程从模型旁的营养表填充；表中没有的类别先查内存缓存，
+                    // 仍然没有的在后台请求 Gemini，不阻塞检测响应（客户端可稍后用 /api/nutrition/analyze-batch 获取）
+                    const pending = [];
+                    (result.nutrition_missing || []).forEach(foodName => {
+                        const cached = nutritionAnalysis.getCachedNutrition(foodName);
+                        if (cached) {
+                            (result.detections || []).forEach(detection => {
+                                if (detection.class === foodName && !detection.nutrition) detection.nutrition = cached;
+                            });
+                        } else {
+                            pending.push(foodName);
+                        }
+                    });
+                    if (pending.length > 0) nutritionAnalysis.prefetchFoods(pending);
                     res.json({
                         success: true,
                         detections: result.detections,
+                        nutrition_pending: pending,
                         model_used: latestSession.id,
                         model_name: latestSession.name || 'Latest Model'
                     });
@@ -1580,6 +1479,32 @@ except Exception as e:
     }
 });
 
+// 推理服务统计 (p50/p99 延迟、吞吐、平均批大小、缓存命中率)
+app.get('/api/detection/stats', async (req, res) => {
+    try {
+        if (!inferenceWorker.process) {
+            return res.json({
+                success: true,
+                running: false,
+                stats: null
+            });
+        }
+        const result = await inferenceWorker.stats();
+        res.json({
+            success: result.success,
+            running: true,
+            stats: result.stats,
+            cache: result.cache
+        });
+    } catch (error) {
+        console.error('Error getting inference stats:', error);
+        res.status(500).json({
+            success: false,
+            error: '获取推理统计失败: ' + error.message
+        });
+    }
+});
+
 // ==================== 前端路由 ====================
 
 // 根路径加载主dashboard
@@ -1602,7 +1527,8 @@ app.use((req, res, next) => {
                 'GET /api/training/colab/templates',
                 'GET /api/datasets',
                 'GET /api/models/versions',
-                'POST /api/detection/analyze'
+                'POST /api/detection/analyze',
+                'GET /api/detection/stats'
             ]
         });
     } else if (req.method === 'GET') {
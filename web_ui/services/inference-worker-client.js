@@ -0,0 +1,167 @@
+/**
+ * 🍜 NutriScan MY - 常驻推理进程客户端
+ * 启动并复用 inference_worker.py，通过 stdin/stdout JSON Lines 发送推理请求
+ */
+
+const { spawn, execSync } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+class InferenceWorkerClient {
+    constructor() {
+        this.pythonCommand = process.env.PYTHON || 'python';
+        this.workerScript = path.join(__dirname, '..', 'inference_worker.py');
+        this.sessionFile = path.join(__dirname, '..', 'data', 'training_sessions.json');
+        this.requestTimeout = 60 * 1000; // 单次推理超时
+        this.maxBatchSize = process.env.INFERENCE_MAX_BATCH_SIZE || '8'; // 单次前向推理最多合并的图片数
+        this.maxWaitMs = process.env.INFERENCE_MAX_WAIT_MS || '10'; // 凑批的最长等待时间
+        this.cacheDir = process.env.INFERENCE_CACHE_DIR || path.join(__dirname, '..', 'data', 'detection_cache'); // 检测结果磁盘缓存
+        this.process = null;
+        this.pending = new Map();
+        this.nextId = 1;
+        this.pythonAvailable = null;
+    }
+
+    /**
+     * 检查Python环境（只检查一次）
+     */
+    isAvailable() {
+        if (this.pythonAvailable === null) {
+            try {
+                const version = execSync(`${this.pythonCommand} --version`, { stdio: 'pipe' }).toString();
+                this.pythonAvailable = version.includes('Python');
+            } catch (error) {
+                this.pythonAvailable = false;
+            }
+        }
+        return this.pythonAvailable;
+    }
+
+    /**
+     * 启动常驻进程（已运行则复用）
+     */
+    start() {
+        if (this.process) {
+            return this.process;
+        }
+
+        console.log(`🚀 启动常驻推理进程: ${this.workerScript}`);
+        const args = [
+            this.workerScript,
+            '--sessions', this.sessionFile,
+            '--max-batch-size', String(this.maxBatchSize),
+            '--max-wait-ms', String(this.maxWaitMs),
+            '--cache-dir', this.cacheDir
+        ];
+        const child = spawn(this.pythonCommand, args, {
+            cwd: path.dirname(this.workerScript),
+            env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+            stdio: ['pipe', 'pipe', 'pipe']
+        });
+
+        readline.createInterface({ input: child.stdout }).on('line', (line) => this.handleLine(line));
+        readline.createInterface({ input: child.stderr }).on('line', (line) => console.log(`🐍 ${line}`));
+
+        child.on('exit', (code, signal) => {
+            console.error(`⚠️ 推理进程已退出 (code=${code}, signal=${signal})`);
+            if (this.process === child) {
+                this.process = null;
+            }
+            this.rejectAll(new Error('推理进程已退出'));
+        });
+        child.on('error', (error) => {
+            console.error('❌ 推理进程启动失败:', error);
+            if (this.process === child) {
+                this.process = null;
+            }
+            this.rejectAll(error);
+        });
+
+        this.process = child;
+        return child;
+    }
+
+    /**
+     * 处理进程输出的一行响应
+     */
+    handleLine(line) {
+        let message;
+        try {
+            message = JSON.parse(line);
+        } catch (error) {
+            console.log(`🐍 ${line}`);
+            return;
+        }
+
+        if (message.event === 'ready') {
+            console.log(`✅ 推理进程就绪，模型: ${message.model_path || '未加载'}`);
+            return;
+        }
+
+        const entry = this.pending.get(message.id);
+        if (!entry) {
+            return;
+        }
+        this.pending.delete(message.id);
+        clearTimeout(entry.timer);
+        entry.resolve(message);
+    }
+
+    rejectAll(error) {
+        for (const [id, entry] of this.pending) {
+            clearTimeout(entry.timer);
+            entry.reject(error);
+            this.pending.delete(id);
+        }
+    }
+
+    /**
+     * 发送请求并等待对应 id 的响应
+     */
+    request(payload) {
+        const child = this.start();
+        const id = String(this.nextId++);
+
+        return new Promise((resolve, reject) => {
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                reject(new Error(`推理超时 (${this.requestTimeout}ms)`));
+            }, this.requestTimeout);
+
+            this.pending.set(id, { resolve, reject, timer });
+            child.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+        });
+    }
+
+    /**
+     * 分析单张图片，返回 {success, detections} 格式
+     */
+    analyze(imagePath, options = {}) {
+        return this.request({
+            cmd: 'predict',
+            image_path: imagePath,
+            model_path: options.modelPath,
+            conf: options.conf || 0.25,
+            sliced: options.sliced || false
+        });
+    }
+
+    /**
+     * 获取微批处理的延迟与吞吐统计，以及检测缓存命中率
+     */
+    stats() {
+        return this.request({ cmd: 'stats' });
+    }
+
+    /**
+     * 停止常驻进程
+     */
+    stop() {
+        if (this.process) {
+            this.process.stdin.end();
+            this.process = null;
+        }
+    }
+}
+
+module.exports = new InferenceWorkerClient();
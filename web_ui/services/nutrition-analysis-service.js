@@ -12,6 +12,28 @@ class NutritionAnalysisService {
         this.model = 'gemini-2.0-flash';
         this.cache = new Map();
         this.cacheTimeout = 24 * 60 * 60 * 1000; // 24小时缓存
+        this.inFlight = new Map(); // 正在请求的 cacheKey -> Promise（同一类别只请求一次）
+    }
+
+    /**
+     * 只读缓存：已分析过的食物立即返回，没有时返回 null（不请求 Gemini）
+     */
+    getCachedNutrition(foodName, language = 'zh-CN') {
+        return this.getCachedResult(`nutrition_${foodName}_${language}`);
+    }
+
+    /**
+     * 后台预取营养信息（不等待结果）；已缓存或正在请求的食物不会重复请求
+     */
+    prefetchFoods(foodNames, language = 'zh-CN') {
+        foodNames.forEach(foodName => {
+            const cacheKey = `nutrition_${foodName}_${language}`;
+            if (this.getCachedResult(cacheKey) || this.inFlight.has(cacheKey)) return;
+            const pending = this.analyzeFoodNutrition(foodName, language)
+                .catch(error => console.error(`❌ 营养预取失败 (${foodName}):`, error))
+                .finally(() => this.inFlight.delete(cacheKey));
+            this.inFlight.set(cacheKey, pending);
+        });
     }
 
     /**
@@ -1,6 +1,7 @@
 // 真实数据服务
 const apiConfig = require('../config/api-config');
 const axios = require('axios');
+const sessionStore = require('./session-store');
 // 移除未使用的引用，避免潜在循环依赖和linter告警
 
 class RealDataService {
@@ -48,9 +49,8 @@ class RealDataService {
             
             try {
                 const trainingSessionsFile = path.join(__dirname, '..', 'data', 'training_sessions.json');
-                if (fs.existsSync(trainingSessionsFile)) {
-                    const fileData = fs.readFileSync(trainingSessionsFile, 'utf8');
-                    const sessionsData = JSON.parse(fileData);
+                if (fs.existsSync(trainingSessionsFile) || fs.existsSync(sessionStore.indexFile)) {
+                    const sessionsData = sessionStore.all();
                     
                     // 转换文件数据为数组格式
                     const sessions = Object.values(sessionsData).map(session => ({
@@ -198,6 +198,20 @@ class RealDataService {
         }
     }
 
+    // 会话中实测的单张推理延迟（ms）：benchmark.py 的结果优先，其次是导出阶段的快速测试
+    measuredInferenceTime(session) {
+        const benchmark = Object.values(session.benchmark?.results || {})
+            .map(result => result.p50_ms)
+            .filter(value => typeof value === 'number');
+        if (benchmark.length > 0) {
+            return +Math.min(...benchmark).toFixed(1);
+        }
+        const exported = Object.values(session.exported_models || {})
+            .map(entry => entry?.latency?.p50_ms)
+            .filter(value => typeof value === 'number');
+        return exported.length > 0 ? +Math.min(...exported).toFixed(1) : undefined;
+    }
+
     // 获取模型数据
     async getModels() {
         const cacheKey = 'models';
@@ -210,9 +224,8 @@ class RealDataService {
                 const fs = require('fs');
                 const path = require('path');
                 const sessionsFile = path.join(__dirname, '..', 'data', 'training_sessions.json');
-                if (fs.existsSync(sessionsFile)) {
-                    const sessionsContent = fs.readFileSync(sessionsFile, 'utf8');
-                    const sessions = JSON.parse(sessionsContent);
+                if (fs.existsSync(sessionsFile) || fs.existsSync(sessionStore.indexFile)) {
+                    const sessions = sessionStore.all();
                     const sessionArray = Object.values(sessions);
 
                     const modelsFromSessions = sessionArray.map((s, idx) => {
@@ -240,7 +253,8 @@ class RealDataService {
                             status: 'active',
                             file_size: fileSize || undefined,
                             created_at: s.created_at,
-                            inference_time: undefined,
+                            inference_time: this.measuredInferenceTime(s),
+                            benchmark_file: s.benchmark?.file,
                             classes: Array.isArray(s.model_config?.names) ? s.model_config.names.length : undefined,
                             source: 'local',
                             best_model_path: s.best_model_path,
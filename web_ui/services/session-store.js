@@ -0,0 +1,104 @@
+/**
+ * 🍜 NutriScan MY - 训练会话读取
+ * 本地训练（session_store.py）把会话追加写入 training_sessions.jsonl，并维护 training_sessions.index.json 索引；
+ * Colab 流程的会话仍在 training_sessions.json。这里合并两者，日志中的同 ID 记录优先。
+ * 各文件按 mtime / 大小缓存解析结果，检测请求只需几次 stat 即可拿到最新模型。
+ */
+
+const fs = require('fs');
+const path = require('path');
+
+class SessionStore {
+    constructor(sessionFile = path.join(__dirname, '..', 'data', 'training_sessions.json')) {
+        const base = sessionFile.replace(/\.json$/, '');
+        this.legacyFile = sessionFile;
+        this.logFile = `${base}.jsonl`;
+        this.indexFile = `${base}.index.json`;
+        this.cache = new Map();
+    }
+
+    /**
+     * 读取并解析文件，文件未变化时返回缓存
+     */
+    readCached(filePath, parse, fallback) {
+        let stat;
+        try {
+            stat = fs.statSync(filePath);
+        } catch (error) {
+            return fallback;
+        }
+        const key = `${stat.mtimeMs}:${stat.size}`;
+        const cached = this.cache.get(filePath);
+        if (cached && cached.key === key) {
+            return cached.value;
+        }
+        let value = fallback;
+        try {
+            value = parse(fs.readFileSync(filePath));
+        } catch (error) {
+            console.error(`❌ 读取会话文件失败 ${filePath}:`, error.message);
+        }
+        this.cache.set(filePath, { key, value });
+        return value;
+    }
+
+    legacySessions() {
+        return this.readCached(this.legacyFile, (buffer) => JSON.parse(buffer.toString('utf8')), {});
+    }
+
+    index() {
+        return this.readCached(this.indexFile, (buffer) => JSON.parse(buffer.toString('utf8')), { sessions: {} });
+    }
+
+    /**
+     * 按索引中的偏移读取单条会话快照
+     */
+    readRecord(entry) {
+        const fd = fs.openSync(this.logFile, 'r');
+        try {
+            const buffer = Buffer.alloc(entry.length);
+            fs.readSync(fd, buffer, 0, entry.length, entry.offset);
+            return JSON.parse(buffer.toString('utf8'));
+        } finally {
+            fs.closeSync(fd);
+        }
+    }
+
+    /**
+     * 全部会话 {id: 记录}
+     */
+    all() {
+        const sessions = { ...this.legacySessions() };
+        const index = this.index();
+        const entries = Object.entries(index.sessions || {});
+        if (entries.length > 0) {
+            const log = this.readCached(this.logFile, (buffer) => buffer, Buffer.alloc(0));
+            for (const [id, entry] of entries) {
+                if (entry.offset + entry.length <= log.length) {
+                    sessions[id] = JSON.parse(log.subarray(entry.offset, entry.offset + entry.length).toString('utf8'));
+                }
+            }
+        }
+        return sessions;
+    }
+
+    /**
+     * 最新完成且有模型的会话；不存在时返回 null
+     */
+    latestCompleted() {
+        const index = this.index();
+        const indexed = index.sessions || {};
+        let latest = index.latest_completed ? this.readRecord(indexed[index.latest_completed]) : null;
+        for (const [id, session] of Object.entries(this.legacySessions())) {
+            if (indexed[id] || session.status !== 'completed' || !session.best_model_path) {
+                continue;
+            }
+            if (!latest || (session.created_at || '') > (latest.created_at || '')) {
+                latest = session;
+            }
+        }
+        return latest;
+    }
+}
+
+module.exports = new SessionStore();
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 训练会话存储（追加写日志 + 索引）
+本地训练写入的会话不再整体重写 training_sessions.json，而是:
+  - training_sessions.jsonl        只追加的日志，每行是某个会话的完整快照（更新 = 追加一份新快照）
+  - training_sessions.index.json   索引: 每个会话最新快照在日志中的位置、status / created_at，
+                                   以及"最新完成的会话"，原子替换写入
+写入时持有文件锁，多个训练进程同时保存不会互相覆盖；检测接口只需读取很小的索引文件即可找到最新模型。
+
+training_sessions.json 仍由 Node 服务（Colab 训练流程）维护，读取时与日志合并，日志中的同 ID 记录优先。
+"""
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+INDEX_VERSION = 1
+
+
+@contextmanager
+def file_lock(lock_path):
+    """跨平台的独占文件锁（阻塞直到获得）"""
+    with open(lock_path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _has_model(record):
+    return record.get("status") == "completed" and bool(record.get("best_model_path"))
+
+
+class SessionStore:
+    """以 training_sessions.json 的路径为基准，日志和索引放在同一目录"""
+
+    def __init__(self, session_file):
+        base = os.path.splitext(session_file)[0]
+        self.legacy_file = session_file
+        self.log_file = f"{base}.jsonl"
+        self.index_file = f"{base}.index.json"
+        self.lock_file = f"{base}.lock"
+        self._legacy_cache = (None, {})
+
+    # ------------------------------------------------------------------ 索引
+
+    def _empty_index(self):
+        return {"version": INDEX_VERSION, "log_size": 0, "sessions": {}, "latest_completed": None}
+
+    def _read_index(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return self._empty_index()
+
+    def _index_record(self, index, record, offset, length):
+        session_id = record["id"]
+        index["sessions"][session_id] = {
+            "status": record.get("status"),
+            "created_at": record.get("created_at") or "",
+            "updated_at": record.get("updated_at") or "",
+            "has_model": _has_model(record),
+            "offset": offset,
+            "length": length,
+        }
+        self._refresh_latest(index)
+
+    @staticmethod
+    def _refresh_latest(index):
+        completed = [(entry["created_at"], session_id) for session_id, entry in index["sessions"].items()
+                     if entry.get("has_model")]
+        index["latest_completed"] = max(completed)[1] if completed else None
+
+    def _catch_up(self, index):
+        """把索引之后追加（例如写索引前进程崩溃）的日志行补进索引，返回是否有变化"""
+        if not os.path.exists(self.log_file):
+            return False
+        size = os.path.getsize(self.log_file)
+        if size <= index["log_size"]:
+            return False
+        offset = index["log_size"]
+        with open(self.log_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 尚未写完的行
+                try:
+                    record = json.loads(line)
+                    self._index_record(index, record, offset, len(line))
+                except (ValueError, KeyError, TypeError):
+                    pass  # 损坏的行直接跳过
+                offset += len(line)
+        index["log_size"] = offset
+        return True
+
+    def index(self):
+        """读取索引（必要时补齐，但不写回）"""
+        index = self._read_index()
+        self._catch_up(index)
+        return index
+
+    def rebuild_index(self):
+        """从头重放日志重建索引"""
+        with file_lock(self.lock_file):
+            index = self._empty_index()
+            self._catch_up(index)
+            _write_json_atomic(self.index_file, index)
+        return index
+
+    # ------------------------------------------------------------------ 读取
+
+    def _read_at(self, entry):
+        with open(self.log_file, 'rb') as f:
+            f.seek(entry["offset"])
+            return json.loads(f.read(entry["length"]))
+
+    def _legacy_sessions(self):
+        """Node 维护的 training_sessions.json，按 mtime / 大小缓存解析结果"""
+        try:
+            stat = os.stat(self.legacy_file)
+        except OSError:
+            return {}
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._legacy_cache[0] != key:
+            try:
+                with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                    sessions = json.load(f)
+            except (OSError, ValueError):
+                sessions = {}
+            self._legacy_cache = (key, sessions if isinstance(sessions, dict) else {})
+        return self._legacy_cache[1]
+
+    def get(self, session_id):
+        entry = self.index()["sessions"].get(session_id)
+        if entry is not None:
+            return self._read_at(entry)
+        return self._legacy_sessions().get(session_id)
+
+    def all(self):
+        """全部会话 {id: 记录}，日志中的记录覆盖 Node 文件中的同 ID 记录"""
+        sessions = dict(self._legacy_sessions())
+        index = self.index()
+        if index["sessions"]:
+            with open(self.log_file, 'rb') as f:
+                for session_id, entry in index["sessions"].items():
+                    f.seek(entry["offset"])
+                    sessions[session_id] = json.loads(f.read(entry["length"]))
+        return sessions
+
+    def latest_completed(self):
+        """最新完成且有模型的会话；只读取索引和其中一条日志记录"""
+        index = self.index()
+        latest_id = index["latest_completed"]
+        latest = self._read_at(index["sessions"][latest_id]) if latest_id else None
+        for session_id, record in self._legacy_sessions().items():
+            if session_id in index["sessions"] or not _has_model(record):
+                continue
+            if latest is None or (record.get("created_at") or "") > (latest.get("created_at") or ""):
+                latest = record
+        return latest
+
+    # ------------------------------------------------------------------ 写入
+
+    def _append(self, record):
+        """在锁内追加一条快照并更新索引"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        index = self._read_index()
+        self._catch_up(index)
+        with open(self.log_file, 'ab') as f:
+            offset = f.tell()
+            if offset > index["log_size"]:
+                # 上次写到一半的行：补换行，让它成为一条被跳过的坏行
+                f.write(b"\n")
+                offset += 1
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._index_record(index, record, offset, len(line))
+        index["log_size"] = offset + len(line)
+        _write_json_atomic(self.index_file, index)
+
+    def add(self, record):
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_file)), exist_ok=True)
+        with file_lock(self.lock_file):
+            self._append(record)
+        return record["id"]
+
+    def update(self, session_id, updates):
+        """合并字段后追加新快照；不存在时返回 None"""
+        with file_lock(self.lock_file):
+            record = self.get(session_id)
+            if record is None:
+                return None
+            record = {**record, **updates}
+            self._append(record)
+        return record
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 多进程分片推理 / 验证
+把图片集切成小块分发给 N 个工作进程，每个进程持有自己的模型副本并限制算子内线程数（进程 × 线程布局）。
+推理模式按输入顺序合并检测结果；验证模式各进程返回逐图匹配结果，由主进程统一计算 mAP，
+结果与单进程验证一致，而不是对各分片的 mAP 取平均。
+
+用法:
+    python sharded_inference.py predict <目录或glob> -o results.jsonl --layout 4x2
+    python sharded_inference.py validate <数据集目录> --layout 8x1
+    python sharded_inference.py validate <数据集目录> --sweep        # 测试所有布局，找出吞吐最高的
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from batch_inference import iter_images
+from detection_metrics import concat_stats, image_stats, label_path_for, load_yolo_labels, summarize
+from inference_worker import DEFAULT_SESSION_FILE, build_detections, find_latest_model
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+DEFAULT_CHUNK_SIZE = 32
+
+# 工作进程内的模型（每个进程一份）
+_backend = None
+
+
+def parse_layout(layout):
+    """'4x2' -> (4 个进程, 每进程 2 线程)"""
+    processes, threads = layout.lower().split("x")
+    return int(processes), int(threads)
+
+
+def candidate_layouts(cpu_count=None):
+    """进程数 × 线程数 = CPU 核数的所有组合"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return [(p, cpu_count // p) for p in range(1, cpu_count + 1) if cpu_count % p == 0]
+
+
+# =============================================================================
+# 工作进程
+# =============================================================================
+
+def _init_worker(model_path, backend, threads):
+    global _backend
+    from inference_backends import load_backend
+
+    _backend = load_backend(model_path, backend, intra_op_threads=threads)
+
+
+def _ping(_):
+    """预热用的空任务：稍作停留，让每个工作进程都领到一个（初始化完成后才会执行任务）"""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _warm_up(pool, processes, max_rounds=20):
+    """等待所有工作进程启动并加载完模型，之后再开始计时"""
+    seen = set()
+    for _ in range(max_rounds):
+        seen.update(pool.map(_ping, range(processes)))
+        if len(seen) >= processes:
+            break
+
+
+def _original_shape(prepared):
+    # NumPy 后端返回 (图像, 比例, 填充, 原图尺寸)；ultralytics 后端返回 (图像, 比例, 原图尺寸)
+    return prepared[-1]
+
+
+def _process_chunk(task):
+    """处理一块图片，返回 (检测记录, 匹配结果, 失败数)"""
+    paths, conf, batch_size, validate = task
+    records, stats, failed = [], [], 0
+    for start in range(0, len(paths), batch_size):
+        ready = []
+        for path in paths[start:start + batch_size]:
+            try:
+                ready.append((path, _backend.prepare(path)))
+            except Exception as e:
+                failed += 1
+                if not validate:
+                    records.append({"image_path": path, "success": False, "error": f"{type(e).__name__}: {e}"})
+        if not ready:
+            continue
+        predictions = _backend.predict_prepared([p for _, p in ready], conf=conf)
+        for (path, prepared), pred in zip(ready, predictions):
+            if validate:
+                height, width = _original_shape(prepared)
+                gt_boxes, gt_cls = load_yolo_labels(label_path_for(path), width, height)
+                stats.append(image_stats(pred, gt_boxes, gt_cls))
+            else:
+                records.append({"image_path": path, "success": True,
+                                "detections": build_detections(pred, _backend.names)})
+    return records, concat_stats(stats) if validate else None, failed
+
+
+# =============================================================================
+# 主进程
+# =============================================================================
+
+def run_sharded(paths, model_path, processes=None, threads=1, conf=0.25, batch_size=8,
+                chunk_size=DEFAULT_CHUNK_SIZE, backend="auto", validate=False, on_records=None):
+    """
+    在 processes 个进程上分片执行；返回 (匹配结果或 None, 统计)
+    on_records(records) 按输入顺序接收每块的检测结果
+    """
+    processes = processes or os.cpu_count() or 1
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+    # 线程数环境变量在创建进程前设置，子进程导入数值库时即生效
+    saved_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    all_stats, failed = [], 0
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(model_path, backend, threads)) as pool:
+            # spawn 的工作进程和模型加载是惰性的，预热后才开始计时，吞吐不包含启动时间
+            _warm_up(pool, processes)
+            ready_at = time.perf_counter()
+            tasks = ((chunk, conf, batch_size, validate) for chunk in chunks)
+            for records, stats, chunk_failed in pool.map(_process_chunk, tasks):
+                failed += chunk_failed
+                if stats is not None:
+                    all_stats.append(stats)
+                if on_records and records:
+                    on_records(records)
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    elapsed = time.perf_counter() - started
+    compute = time.perf_counter() - ready_at
+    summary = {
+        "layout": f"{processes}x{threads}",
+        "images": len(paths),
+        "failed": failed,
+        "elapsed_s": elapsed,
+        "images_per_s": len(paths) / compute if compute > 0 else 0.0,
+    }
+    return (concat_stats(all_stats) if validate else None), summary
+
+
+def resolve_split_images(dataset_path, split="val"):
+    """从 data.yaml 解析验证集图片目录（兼容 Roboflow 导出的 ../valid/images 写法）"""
+    data_yaml = os.path.join(dataset_path, "data.yaml")
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    entry = data.get(split) or data.get("val")
+    base = data.get("path") or dataset_path
+    candidates = [os.path.join(base, entry), os.path.join(dataset_path, entry),
+                  os.path.join(dataset_path, entry.replace("../", "", 1))]
+    image_dir = next((os.path.normpath(c) for c in candidates if os.path.isdir(c)), None)
+    if image_dir is None:
+        raise FileNotFoundError(f"找不到 {split} 图片目录: {entry}")
+    names = data.get("names", {})
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    return image_dir, names
+
+
+class _BoxMetrics:
+    def __init__(self, metrics):
+        self.mp = metrics["metrics/precision(B)"]
+        self.mr = metrics["metrics/recall(B)"]
+        self.map50 = metrics["metrics/mAP50(B)"]
+        self.map = metrics["metrics/mAP50-95(B)"]
+
+
+class ShardedValResults:
+    """与 ultralytics 验证结果接口相同的部分（results_dict / box / names），供 validate_model() 的调用方使用"""
+
+    confusion_matrix = None  # 分片验证不计算混淆矩阵
+
+    def __init__(self, metrics, summary, names):
+        self.results_dict = {key: value for key, value in metrics.items() if key != "per_class"}
+        self.per_class = metrics.get("per_class", {})
+        self.box = _BoxMetrics(metrics)
+        self.names = names
+        self.summary = summary
+
+    def __str__(self):
+        return json.dumps({"metrics": self.results_dict, "summary": self.summary}, ensure_ascii=False)
+
+
+def validate_sharded(model_path, dataset_path, processes=None, threads=1, batch_size=8,
+                     conf=0.001, backend="auto", split="val"):
+    """分片验证，返回与 ultralytics results_dict 同名的指标和吞吐统计"""
+    image_dir, names = resolve_split_images(dataset_path, split)
+    paths = list(iter_images(image_dir))
+    stats, summary = run_sharded(paths, model_path, processes, threads, conf=conf, batch_size=batch_size,
+                                 backend=backend, validate=True)
+    metrics = summarize(stats, names)
+    print(f"📊 [{summary['layout']}] mAP50={metrics['metrics/mAP50(B)']:.4f} "
+          f"mAP50-95={metrics['metrics/mAP50-95(B)']:.4f} ({summary['images_per_s']:.1f} 张/秒)")
+    return metrics, summary
+
+
+def sweep_layouts(paths, model_path, layouts=None, **kwargs):
+    """依次测试各种进程 × 线程布局，返回按吞吐排序的结果"""
+    results = []
+    for processes, threads in layouts or candidate_layouts():
+        _, summary = run_sharded(paths, model_path, processes, threads, **kwargs)
+        print(f"⏱️ 布局 {summary['layout']}: {summary['images_per_s']:.1f} 张/秒")
+        results.append(summary)
+    results.sort(key=lambda s: s["images_per_s"], reverse=True)
+    print(f"🏆 最佳布局: {results[0]['layout']} ({results[0]['images_per_s']:.1f} 张/秒)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 多进程分片推理 / 验证")
+    parser.add_argument("mode", choices=["predict", "validate"])
+    parser.add_argument("source", help="predict: 图片目录或 glob；validate: 数据集目录（包含 data.yaml）")
+    parser.add_argument("-o", "--output", help="predict 模式的 JSON Lines 输出文件")
+    parser.add_argument("--model", default=None, help="模型路径（默认最新完成的训练会话）")
+    parser.add_argument("--backend", default="auto", choices=["auto", "openvino", "onnxruntime", "ultralytics"])
+    parser.add_argument("--layout", default=None, help="进程数x每进程线程数，如 4x2（默认 CPU核数x1）")
+    parser.add_argument("--sweep", action="store_true", help="测试所有布局并报告吞吐")
+    parser.add_argument("--sweep-images", type=int, default=256, help="布局测试使用的图片数")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--conf", type=float, default=None, help="置信度阈值（predict 默认 0.25，validate 默认 0.001）")
+    args = parser.parse_args()
+
+    model_path = args.model or find_latest_model(DEFAULT_SESSION_FILE)
+    if not model_path:
+        print("❌ 未找到训练好的模型，请先完成模型训练或使用 --model 指定")
+        sys.exit(1)
+    processes, threads = parse_layout(args.layout) if args.layout else (os.cpu_count() or 1, 1)
+    validate = args.mode == "validate"
+    conf = args.conf if args.conf is not None else (0.001 if validate else 0.25)
+
+    if validate:
+        image_dir, _ = resolve_split_images(args.source)
+        paths = list(iter_images(image_dir))
+    else:
+        paths = list(iter_images(args.source))
+
+    if args.sweep:
+        results = sweep_layouts(paths[:args.sweep_images], model_path, conf=conf,
+                                batch_size=args.batch_size, backend=args.backend, validate=validate)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    if validate:
+        metrics, summary = validate_sharded(model_path, args.source, processes, threads,
+                                            batch_size=args.batch_size, conf=conf, backend=args.backend)
+        print(json.dumps({"metrics": metrics, "summary": summary}, ensure_ascii=False, indent=2))
+        return
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        def write(records):
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        _, summary = run_sharded(paths, model_path, processes, threads, conf=conf,
+                                 batch_size=args.batch_size, backend=args.backend, on_records=write)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"✅ 分片推理完成: {json.dumps(summary, ensure_ascii=False)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
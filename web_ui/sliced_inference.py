@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 切片推理（高分辨率多菜品照片）
+3000~4000 px 的整桌照片直接缩放到 640 时，小碟配菜只剩几十个像素，容易漏检。
+切片模式把原图切成互相重叠的 tile（默认 640，重叠 20%），连同缩小后的整图一起作为一个 batch
+送入常驻模型，再把各 tile 的框平移回原图坐标，跨 tile 边界的重复框用向量化的 NMS 或 WBF 合并。
+
+合并按同类别两两计算 IoS（交集 / 较小框面积）：tile 边界切开的半个框与完整框的 IoU 可能很低，
+但 IoS 接近 1，仍会被合并。
+- nms: 保留分数最高的框
+- wbf: 按分数加权平均同一组框的坐标，分数取组内最高
+
+用法:
+    python sliced_inference.py photo.jpg --model best.onnx --tile 640 --overlap 0.2 --merge wbf
+"""
+
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from image_io import open_image
+from inference_backends import empty_prediction
+
+DEFAULT_TILE = 640
+DEFAULT_OVERLAP = 0.2
+DEFAULT_MATCH_THRESHOLD = 0.5
+MERGE_MODES = ("nms", "wbf")
+
+
+def tile_windows(height, width, tile=DEFAULT_TILE, overlap=DEFAULT_OVERLAP):
+    """覆盖整张图片的 tile 窗口 (N, 4) [x0, y0, x1, y1]；最后一行 / 列贴齐图片边缘"""
+    step = max(1, int(tile * (1 - overlap)))
+
+    def starts(size):
+        if size <= tile:
+            return np.array([0])
+        values = np.arange(0, size - tile, step)
+        return np.append(values, size - tile)
+
+    ys, xs = np.meshgrid(starts(height), starts(width), indexing="ij")
+    x0, y0 = xs.ravel(), ys.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile, width), np.minimum(y0 + tile, height)], axis=1)
+
+
+def pairwise_ios(boxes):
+    """两两之间的 交集 / 较小框面积，(N, N)"""
+    x0 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y0 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x1 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y1 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (np.minimum(areas[:, None], areas[None, :]) + 1e-9)
+
+
+def merge_predictions(xyxy, conf, cls, mode="nms", threshold=DEFAULT_MATCH_THRESHOLD, max_det=300):
+    """合并跨 tile 的重复框：相似度矩阵一次算出，贪心分组只遍历保留下来的框"""
+    if len(conf) == 0:
+        return empty_prediction()
+    order = np.argsort(-conf)
+    xyxy, conf, cls = xyxy[order], conf[order], cls[order]
+    matches = (pairwise_ios(xyxy) > threshold) & (cls[:, None] == cls[None, :])
+
+    assigned = np.zeros(len(conf), dtype=bool)
+    boxes, scores, classes = [], [], []
+    for i in range(len(conf)):
+        if assigned[i]:
+            continue
+        group = matches[i] & ~assigned
+        group[i] = True
+        assigned |= group
+        if mode == "wbf":
+            weights = conf[group]
+            boxes.append((xyxy[group] * weights[:, None]).sum(axis=0) / weights.sum())
+        else:
+            boxes.append(xyxy[i])
+        scores.append(conf[i])
+        classes.append(cls[i])
+        if len(scores) >= max_det:
+            break
+    return {
+        "xyxy": np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+        "conf": np.asarray(scores, dtype=np.float32),
+        "cls": np.asarray(classes, dtype=np.int64),
+    }
+
+
+def sliced_predict(backend, image, conf=0.25, tile=DEFAULT_TILE, overlap=DEFAULT_OVERLAP, merge="nms",
+                   threshold=DEFAULT_MATCH_THRESHOLD, include_full=True, max_det=300):
+    """
+    切片推理一张图片，返回与 backend.predict() 相同结构的结果。
+    图片不大于一个 tile 时与普通推理相同；include_full 时整图也作为 batch 中的一项（检出占满画面的大菜）
+    """
+    # 按 EXIF 方向旋转后再切片（手机竖拍照片），与非切片路径的坐标一致
+    original = open_image(image)[0] if isinstance(image, str) else image
+    height, width = original.shape[:2]
+    windows = tile_windows(height, width, tile, overlap)
+    if len(windows) == 1:
+        return backend.predict_prepared([backend.prepare(original)], conf=conf, max_det=max_det)[0]
+
+    crops = [original[y0:y1, x0:x1] for x0, y0, x1, y1 in windows.tolist()]
+    offsets = windows[:, :2].astype(np.float32)
+    if include_full:
+        crops.append(original)
+        offsets = np.vstack([offsets, np.zeros((1, 2), np.float32)])
+
+    # 所有 tile 一次送入模型（后端按自身的 batch 大小分块）
+    predictions = backend.predict_prepared([backend.prepare(crop) for crop in crops], conf=conf, max_det=max_det)
+    counts = [len(p["conf"]) for p in predictions]
+    if not sum(counts):
+        return empty_prediction()
+    xyxy = np.concatenate([p["xyxy"] for p in predictions]) + np.repeat(np.tile(offsets, 2), counts, axis=0)
+    scores = np.concatenate([p["conf"] for p in predictions])
+    classes = np.concatenate([p["cls"] for p in predictions])
+    return merge_predictions(xyxy, scores, classes, merge, threshold, max_det)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 切片推理")
+    parser.add_argument("image")
+    parser.add_argument("--model", default=None, help="模型路径（默认最新完成的训练会话）")
+    parser.add_argument("--backend", default="auto", choices=["auto", "openvino", "onnxruntime", "ultralytics"])
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE)
+    parser.add_argument("--overlap", type=float, default=DEFAULT_OVERLAP)
+    parser.add_argument("--merge", choices=MERGE_MODES, default="nms")
+    parser.add_argument("--no-full", action="store_true", help="不把整图加入 batch")
+    args = parser.parse_args()
+
+    from inference_backends import load_backend
+    from inference_worker import DEFAULT_SESSION_FILE, build_detections, find_latest_model
+
+    model_path = args.model or find_latest_model(DEFAULT_SESSION_FILE)
+    if not model_path:
+        print("❌ 未找到训练好的模型")
+        sys.exit(1)
+    backend = load_backend(model_path, args.backend)
+    started = time.perf_counter()
+    prediction = sliced_predict(backend, args.image, args.conf, args.tile, args.overlap, args.merge,
+                                include_full=not args.no_full)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(json.dumps({"detections": build_detections(prediction, backend.names, args.conf),
+                      "latency_ms": elapsed}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
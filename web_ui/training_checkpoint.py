@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 可恢复训练
+- find_resumable_run(): 在 nutriscan_training/ 下找同一数据集上未完成的训练。
+  ultralytics 训练正常结束时会把 last.pt 中的优化器状态去掉（epoch = -1），
+  仍带优化器状态的 last.pt 就是未完成的训练，可以用 resume=True 从中恢复模型、EMA、优化器和学习率调度。
+- CheckpointTrainerMixin: 收到 SIGTERM / SIGINT 后在当前 batch 结束时保存检查点（含优化器状态）并抛出
+  TrainingInterrupted 退出，不会执行最终验证（最终验证会去掉 last.pt 的优化器状态，之后就无法恢复）。
+- 每次开始 / 恢复 / 中断都追加到训练目录的 lineage.json，完成后写入训练会话。
+"""
+
+import os
+import json
+import glob
+import signal
+import threading
+from datetime import datetime
+
+LINEAGE_FILE = "lineage.json"
+
+_interrupt = threading.Event()
+
+
+class TrainingInterrupted(Exception):
+    """训练因 SIGTERM / SIGINT 中止，检查点已保存"""
+
+    def __init__(self, run_dir, epoch):
+        super().__init__(f"训练在第 {epoch + 1} 轮中止，可从 {run_dir} 恢复")
+        self.run_dir = run_dir
+        self.epoch = epoch
+
+
+def _load_checkpoint(path):
+    import torch
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:  # 旧版 torch 没有 weights_only 参数
+        return torch.load(path, map_location="cpu")
+
+
+def is_resumable(ckpt):
+    return ckpt.get("epoch", -1) >= 0 and ckpt.get("optimizer") is not None
+
+
+def find_resumable_run(data_yaml, project="nutriscan_training"):
+    """返回同一 data.yaml 上最近一次未完成训练的 last.pt，没有时返回 None"""
+    data_yaml = os.path.abspath(data_yaml)
+    candidates = sorted(glob.glob(os.path.join(project, "*", "weights", "last.pt")),
+                        key=os.path.getmtime, reverse=True)
+    for last in candidates:
+        try:
+            ckpt = _load_checkpoint(last)
+        except Exception as e:
+            print(f"⚠️ 无法读取检查点 {last}: {e}")
+            continue
+        train_args = ckpt.get("train_args") or {}
+        if is_resumable(ckpt) and os.path.abspath(str(train_args.get("data", ""))) == data_yaml:
+            epochs = train_args.get("epochs")
+            print(f"♻️ 发现未完成的训练: {last}（已完成 {ckpt['epoch'] + 1}/{epochs} 轮）")
+            return last
+    return None
+
+
+def read_lineage(run_dir):
+    path = os.path.join(run_dir, LINEAGE_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def append_lineage(run_dir, event):
+    lineage = read_lineage(run_dir)
+    lineage.append({"at": datetime.now().isoformat(), **event})
+    tmp_path = os.path.join(run_dir, f"{LINEAGE_FILE}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(lineage, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(run_dir, LINEAGE_FILE))
+    return lineage
+
+
+def install_signal_handlers():
+    """SIGTERM / SIGINT 只设置标志，由训练循环在 batch 边界保存检查点；返回恢复原处理函数的回调"""
+    _interrupt.clear()
+    previous = {}
+
+    def handler(signum, frame):
+        if _interrupt.is_set() and signum == getattr(signal, "SIGINT", None):
+            raise KeyboardInterrupt  # 再按一次 Ctrl+C 立即退出
+        print(f"\n🛑 收到信号 {signum}，当前 batch 结束后保存检查点并退出...")
+        _interrupt.set()
+
+    for name in ("SIGTERM", "SIGINT"):
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            previous[signum] = signal.signal(signum, handler)
+
+    def restore():
+        for signum, old in previous.items():
+            signal.signal(signum, old)
+
+    return restore
+
+
+class CheckpointTrainerMixin:
+    """DetectionTrainer 的 mixin：记录训练谱系，收到终止信号时保存可恢复的检查点"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_callback("on_train_start", self._on_train_start)
+        self.add_callback("on_train_batch_end", self._on_train_batch_end)
+
+    def _on_train_start(self, trainer):
+        event = {"event": "resume" if self.args.resume else "start", "start_epoch": self.start_epoch,
+                 "epochs": self.epochs}
+        if self.args.resume:
+            event["resumed_from"] = str(self.args.resume)
+        append_lineage(str(self.save_dir), event)
+
+    def _on_train_batch_end(self, trainer):
+        if not _interrupt.is_set():
+            return
+        run_dir = str(self.save_dir)
+        if self.epoch > 0:
+            # 记为上一轮结束：恢复时重新训练当前轮，但权重和优化器状态保留本轮已完成的部分
+            epoch, fitness = self.epoch, self.fitness
+            self.epoch, self.fitness = epoch - 1, float("nan")  # fitness 设为 NaN，避免覆盖 best.pt
+            try:
+                self.save_model()
+            finally:
+                self.epoch, self.fitness = epoch, fitness
+            print(f"💾 检查点已保存: {self.last}")
+        append_lineage(run_dir, {"event": "interrupted", "epoch": self.epoch})
+        raise TrainingInterrupted(run_dir, self.epoch)
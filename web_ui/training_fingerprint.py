@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 训练记忆化
+训练前把会影响结果的输入合成一个指纹，写入会话的 training_fingerprint 字段:
+  - 生效的训练参数：ultralytics 默认配置 + 本次覆盖（seed、deterministic 等默认值也在内），
+    去掉输出目录、日志、检查点间隔这类不影响结果的参数
+  - 数据集：dataset_store 的 manifest 哈希（没有 manifest 时用文件名 + 大小 + mtime）和 data.yaml 内容
+  - 预训练权重文件的内容哈希
+  - torch / ultralytics / numpy / Python 版本
+  - 影响训练结果的功能开关（类别均衡 / 难例采样、蒸馏的教师缓存）
+已有相同指纹且权重仍在的完成会话时，直接复用它的权重和指标，不再重新训练（TRAINING_FORCE=1 强制训练）。
+
+用法:
+    python training_fingerprint.py <数据集目录> [--model-type yolov8n] [--epochs 100]   # 打印指纹和匹配的会话
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import platform
+
+from dataset_store import manifest_hash
+from detection_cache import file_sha256
+from session_store import SessionStore
+
+FINGERPRINT_VERSION = 1
+# 只影响输出位置、日志和保存频率的参数
+VOLATILE_ARGS = ("project", "name", "exist_ok", "resume", "save", "save_period", "save_dir", "plots", "verbose",
+                 "model", "data", "mode", "task")
+LIBRARIES = ("torch", "ultralytics", "numpy")
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def effective_args(train_args):
+    """ultralytics 合并默认配置后的完整训练参数（去掉不影响结果的项）"""
+    from ultralytics.cfg import get_cfg
+
+    args = vars(get_cfg(overrides=dict(train_args)))
+    return {key: value for key, value in sorted(args.items()) if key not in VOLATILE_ARGS}
+
+
+def dataset_digest(dataset_path):
+    """数据集内容的哈希：manifest 优先；否则遍历目录的文件名 + 大小 + mtime。data.yaml 内容总是计入"""
+    digest = hashlib.sha256()
+    content = manifest_hash(dataset_path)
+    if content is None:
+        for root, dirs, files in os.walk(dataset_path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))  # 跳过 .nutriscan_* 等缓存目录
+            for name in sorted(files):
+                if name.endswith(".cache"):  # ultralytics 写在标签旁边的 labels.cache
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, dataset_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n"
+                              .encode("utf-8"))
+    else:
+        digest.update(content.encode("utf-8"))
+    data_yaml = os.path.join(dataset_path, "data.yaml")
+    if os.path.exists(data_yaml):
+        digest.update(b"data.yaml\0")
+        digest.update(file_sha256(data_yaml).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def library_versions():
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = {"python": platform.python_version()}
+    for name in LIBRARIES:
+        try:
+            versions[name] = version(name)
+        except PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def base_weights_path(model_type):
+    """预训练权重的本地路径（不存在时由 ultralytics 下载）"""
+    from ultralytics import YOLO
+    return str(YOLO(f"{model_type}.pt").ckpt_path)
+
+
+def training_fingerprint(dataset_path, train_args, model_type, features=None):
+    """返回 {"hash", "version", "components"}；components 记录各部分的哈希 / 版本，便于排查为什么没有命中"""
+    components = {
+        "args": _digest(effective_args(train_args)),
+        "dataset": dataset_digest(dataset_path),
+        "weights": file_sha256(base_weights_path(model_type)),
+        "libraries": library_versions(),
+        "features": {key: value for key, value in sorted((features or {}).items()) if value},
+    }
+    return {"hash": _digest([FINGERPRINT_VERSION, components]), "version": FINGERPRINT_VERSION,
+            "components": components}
+
+
+def find_memoized_session(fingerprint, session_file):
+    """指纹相同、已完成且 best.pt 仍存在的最新会话；没有时返回 None"""
+    matches = [
+        session for session in SessionStore(session_file).all().values()
+        if session.get("status") == "completed"
+        and (session.get("training_fingerprint") or {}).get("hash") == fingerprint["hash"]
+        and session.get("best_model_path") and os.path.exists(session["best_model_path"])
+    ]
+    return max(matches, key=lambda s: s.get("created_at") or "", default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NutriScan MY 训练指纹")
+    parser.add_argument("dataset", help="数据集目录（包含 data.yaml）")
+    parser.add_argument("--model-type", default="yolov8n")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--sampling", action="store_true")
+    parser.add_argument("--session-file", default=os.path.join("data", "training_sessions.json"))
+    args = parser.parse_args()
+
+    from local_training import training_args
+
+    train_args = training_args(os.path.join(args.dataset, "data.yaml"), args.epochs, args.batch, args.imgsz)
+    fingerprint = training_fingerprint(args.dataset, train_args, args.model_type, {"sampling": args.sampling})
+    print(json.dumps(fingerprint, ensure_ascii=False, indent=2))
+    session = find_memoized_session(fingerprint, args.session_file)
+    if session:
+        print(f"♻️ 命中会话 {session['id']}: {session['best_model_path']}")
+    else:
+        print("🆕 没有相同指纹的完成会话", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+NutriScan MY - 训练吞吐分析
+可选的训练插桩（train_model(profile=True)），逐 epoch 记录:
+  - data_wait_s     主进程等待数据加载器的时间（数据加载 / 解码 / 增强跟不上时变大）
+  - augment_cpu_s   数据增强（mosaic / mixup 等 transforms）在各 worker 中消耗的 CPU 时间总和
+  - forward_s       前向 + 损失计算
+  - backward_s      反向传播 + 优化器更新
+  - val_s           验证
+  - images_per_s    训练阶段吞吐
+  - peak_rss_mb     主进程 + 数据加载 worker 的峰值常驻内存
+结果写到 results.csv 旁边的 profile.csv，汇总写入 profile_summary.json 并记录到训练会话。
+"""
+
+import os
+import csv
+import json
+import time
+
+PROFILE_CSV = "profile.csv"
+PROFILE_SUMMARY = "profile_summary.json"
+RSS_SAMPLE_EVERY = 10  # 每隔多少个 batch 采样一次内存
+
+FIELDS = [
+    "epoch", "epoch_time_s", "train_time_s", "data_wait_s", "augment_cpu_s", "forward_s", "backward_s",
+    "val_s", "batches", "images", "images_per_s", "data_wait_pct", "peak_rss_mb",
+]
+
+
+class TimedTransforms:
+    """包装数据集的 transforms，在每个样本里记录增强耗时（在 worker 进程中执行，可被 pickle）"""
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __call__(self, labels):
+        started = time.perf_counter()
+        labels = self.transforms(labels)
+        labels["_augment_time"] = time.perf_counter() - started
+        return labels
+
+    def __getattr__(self, name):
+        # close_mosaic 等逻辑会访问原 transforms 的属性
+        if name == "transforms":
+            raise AttributeError(name)
+        return getattr(self.transforms, name)
+
+
+def _sync():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+    except ImportError:
+        pass
+
+
+def _rss_mb():
+    try:
+        import psutil
+    except ImportError:
+        return 0.0
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss / (1024 * 1024)
+
+
+class TrainingProfiler:
+    """通过 ultralytics 回调收集每个 epoch 的分阶段耗时"""
+
+    def __init__(self):
+        self.rows = []
+        self._reset_epoch()
+
+    def _reset_epoch(self):
+        self.epoch_start = time.perf_counter()
+        self.last_batch_end = self.epoch_start
+        self.batch_start = None
+        self.forward_end = None
+        self.train_end = None
+        self.val_start = None
+        self.current = {"data_wait_s": 0.0, "augment_cpu_s": 0.0, "forward_s": 0.0, "backward_s": 0.0,
+                        "val_s": 0.0, "batches": 0, "images": 0, "peak_rss_mb": 0.0}
+
+    # ------------------------------------------------------------------ 回调
+
+    def register(self, trainer):
+        trainer.add_callback("on_train_start", self.on_train_start)
+        trainer.add_callback("on_train_epoch_start", self.on_train_epoch_start)
+        trainer.add_callback("on_train_batch_start", self.on_train_batch_start)
+        trainer.add_callback("on_train_batch_end", self.on_train_batch_end)
+        trainer.add_callback("on_train_epoch_end", self.on_train_epoch_end)
+        trainer.add_callback("on_val_start", self.on_val_start)
+        trainer.add_callback("on_val_end", self.on_val_end)
+        trainer.add_callback("on_fit_epoch_end", self.on_fit_epoch_end)
+        trainer.add_callback("on_train_end", self.on_train_end)
+
+    def on_train_start(self, trainer):
+        # 前向钩子标记前向结束时间，用来拆分前向与反向
+        model = trainer.model.module if hasattr(trainer.model, "module") else trainer.model
+        model.register_forward_hook(self._on_forward_end)
+
+    def _on_forward_end(self, module, inputs, outputs):
+        if module.training and self.batch_start is not None:
+            _sync()
+            self.forward_end = time.perf_counter()
+
+    def on_train_epoch_start(self, trainer):
+        self._reset_epoch()
+
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self.current["data_wait_s"] += now - self.last_batch_end
+        self.batch_start = now
+        self.forward_end = None
+
+    def on_train_batch_end(self, trainer):
+        _sync()
+        now = time.perf_counter()
+        forward_end = self.forward_end or now
+        self.current["forward_s"] += forward_end - self.batch_start
+        self.current["backward_s"] += now - forward_end
+        self.current["batches"] += 1
+        if self.current["batches"] % RSS_SAMPLE_EVERY == 1:
+            self.current["peak_rss_mb"] = max(self.current["peak_rss_mb"], _rss_mb())
+        self.last_batch_end = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer):
+        self.train_end = time.perf_counter()
+
+    def on_val_start(self, validator):
+        self.val_start = time.perf_counter()
+
+    def on_val_end(self, validator):
+        if self.val_start is not None:
+            self.current["val_s"] += time.perf_counter() - self.val_start
+            self.val_start = None
+
+    def record_batch(self, batch):
+        """由 ProfilerTrainerMixin.preprocess_batch 调用：统计图片数和 worker 中的增强耗时"""
+        augment_times = batch.pop("_augment_time", None)
+        if augment_times is not None:
+            self.current["augment_cpu_s"] += float(sum(augment_times))
+        if "img" in batch:
+            self.current["images"] += int(batch["img"].shape[0])
+
+    def on_fit_epoch_end(self, trainer):
+        now = time.perf_counter()
+        train_time = (self.train_end or now) - self.epoch_start
+        row = dict(self.current)
+        row["peak_rss_mb"] = max(row["peak_rss_mb"], _rss_mb())
+        row.update({
+            "epoch": trainer.epoch + 1,
+            "epoch_time_s": now - self.epoch_start,
+            "train_time_s": train_time,
+            "images_per_s": row["images"] / train_time if train_time > 0 else 0.0,
+            "data_wait_pct": 100.0 * row["data_wait_s"] / train_time if train_time > 0 else 0.0,
+        })
+        self.rows.append(row)
+        self._append_csv(trainer.save_dir, row)
+
+    def on_train_end(self, trainer):
+        summary = self.summary()
+        with open(os.path.join(trainer.save_dir, PROFILE_SUMMARY), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        trainer.profile_summary = summary
+        print(f"⏱️ 训练分析: {summary['avg_images_per_s']:.1f} 张/秒, "
+              f"数据等待 {summary['avg_data_wait_pct']:.1f}%, 瓶颈: {summary['bottleneck']}")
+
+    # ------------------------------------------------------------------ 输出
+
+    def _append_csv(self, save_dir, row):
+        path = os.path.join(save_dir, PROFILE_CSV)
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerow({k: round(v, 4) if isinstance(v, float) else v for k, v in row.items() if k in FIELDS})
+
+    def summary(self):
+        """全部 epoch 的平均值，以及耗时最多的阶段"""
+        if not self.rows:
+            return {"epochs": 0}
+        n = len(self.rows)
+
+        def avg(key):
+            return sum(r[key] for r in self.rows) / n
+
+        stages = {"data_wait": avg("data_wait_s"), "forward": avg("forward_s"),
+                  "backward": avg("backward_s"), "validation": avg("val_s")}
+        return {
+            "epochs": n,
+            "avg_epoch_time_s": avg("epoch_time_s"),
+            "avg_data_wait_s": stages["data_wait"],
+            "avg_augment_cpu_s": avg("augment_cpu_s"),
+            "avg_forward_s": stages["forward"],
+            "avg_backward_s": stages["backward"],
+            "avg_val_s": stages["validation"],
+            "avg_images_per_s": avg("images_per_s"),
+            "avg_data_wait_pct": avg("data_wait_pct"),
+            "peak_rss_mb": max(r["peak_rss_mb"] for r in self.rows),
+            "bottleneck": max(stages, key=stages.get),
+        }
+
+
+class ProfilerTrainerMixin:
+    """DetectionTrainer 的 mixin：注册分析回调并给训练集 transforms 加上计时"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = TrainingProfiler()
+        self.profiler.register(self)
+        self.profile_summary = {}
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if mode == "train":
+            dataset.transforms = TimedTransforms(dataset.transforms)
+        return dataset
+
+    def _close_dataloader_mosaic(self):
+        # 关闭 mosaic 时 ultralytics 会重建 transforms，需要重新包装
+        super()._close_dataloader_mosaic()
+        dataset = self.train_loader.dataset
+        if not isinstance(dataset.transforms, TimedTransforms):
+            dataset.transforms = TimedTransforms(dataset.transforms)
+
+    def preprocess_batch(self, batch):
+        self.profiler.record_batch(batch)
+        return super().preprocess_batch(batch)